@@ -30,173 +30,227 @@
 # =================================================================================================
 
 import sys
-from typing  import Optional, List, Any, cast
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from itertools          import repeat
+from typing             import Optional, List, Dict, Tuple, Type, Union, Any, cast
+from pathlib            import Path
 
 import xml.etree.ElementTree as ET
 
 import npt.parser
+import npt.parser_asciidiagrams
 import npt.parser_rfc_txt
 import npt.parser_rfc_xml
+import npt.protocol_ir
 import npt.rfc
+import npt.simplifier
 import npt.util
 
 from npt.formatter            import Formatter
+from npt.formatter_ir         import IRFormatter, IR_FILENAME
 from npt.formatter_rust       import RustFormatter
 from npt.formatter_simple     import SimpleFormatter
 from npt.parser_asciidiagrams import AsciiDiagramsParser
 from npt.protocol             import *
 from npt.helpers              import *
 
-# Protocol DFS
-
-def dfs_struct(struct: Struct, type_names:List[str]):
-    for field in struct.get_fields():
-        dfs_protocoltype(field.field_type, type_names)
-
-def dfs_array(array: Array, type_names:List[str]):
-    dfs_protocoltype(array.element_type, type_names)
-    dfs_protocoltype(array.parse_from, type_names)
-    dfs_protocoltype(array.serialise_to, type_names)
-
-def dfs_enum(enum: Enum, type_names:List[str]):
-    for variant in enum.variants:
-        dfs_protocoltype(variant, type_names)
-    dfs_protocoltype(enum.parse_from, type_names)
-    dfs_protocoltype(enum.serialise_to, type_names)
-
-def dfs_function(function: Function, type_names:List[str]):
-    for parameter in function.parameters:
-        if not isinstance(parameter.param_type, TypeVariable) and isinstance(parameter.param_type, ConstructableType) and parameter.param_type.name not in type_names:
-            dfs_protocoltype(parameter.param_type, type_names)
-    if not isinstance(function.return_type, TypeVariable) and isinstance(function.return_type, ConstructableType) and function.return_type.name not in type_names:
-        dfs_protocoltype(function.return_type, type_names)
-
-def dfs_context(context: Context, type_names:List[str]):
-    for field in context.get_fields():
-        dfs_protocoltype(field.field_type, type_names)
-
-def dfs_protocoltype(pt: Union[None, Function, ProtocolType], type_names:List[str]):
-    if isinstance(pt, BitString):
-        type_names.append(pt.name)
-    elif isinstance(pt, Struct):
-        dfs_struct(pt, type_names)
-        type_names.append(pt.name)
-    elif isinstance(pt, Array):
-        dfs_array(pt, type_names)
-        type_names.append(pt.name)
-    elif isinstance(pt, Enum):
-        dfs_enum(pt, type_names)
-        type_names.append(pt.name)
-    elif isinstance(pt, Function):
-        dfs_function(pt, type_names)
-        type_names.append(pt.name)
-    elif isinstance(pt, Context):
-        dfs_context(pt, type_names)
-        type_names.append(pt.name)
-    elif pt is None:
-        return
-
-def dfs_protocol(protocol: Protocol):
-    type_names : List[str] = []
-
-    for pdu_name in protocol.get_pdu_names():
-        dfs_protocoltype(protocol.get_pdu(pdu_name), type_names)
-
-    dfs_protocoltype(protocol.get_context(), type_names)
-
-    type_names_dedupe = []
-
-    for type_name in type_names:
-        if type_name not in type_names_dedupe:
-            type_names_dedupe.append(type_name)
-
-    return type_names_dedupe
-
-
-
-def parse_input_file( doc : npt.util.IETF_URI ) -> Optional[npt.rfc.RFC] :
-    content = None
+def parse_input_file( doc : npt.util.IETF_URI, middle_only : bool = False, txt_engine : str = "grammar" ) -> Union[None, npt.rfc.RFC, npt.rfc.Middle] :
+    """
+    Parse an input document into an RFC DOM object. If middle_only is set, XML documents are
+    parsed incrementally, and only the middle of the document is returned. Text documents are
+    structured using the given txt_engine.
+    """
+    content : Union[None, npt.rfc.RFC, npt.rfc.Middle] = None
     doc_filepath = doc.get_filepath_in()
-    if doc.extn == '.xml' and doc_filepath is not None:
+    if doc.extn == '.xml' and doc_filepath is not None and middle_only:
+        content = npt.parser_rfc_xml.parse_middle_iter(str(doc_filepath))
+    elif doc.extn == '.xml' and doc_filepath is not None:
         with open(doc_filepath , 'r') as infile :
             xml_tree = ET.fromstring(infile.read())
             content = npt.parser_rfc_xml.parse_rfc(xml_tree)
     elif doc.extn == '.txt' and doc_filepath is not None:
         with open(doc_filepath, 'r') as infile :
-            content = npt.parser_rfc_txt.parse_rfc(infile.readlines())
+            content = npt.parser_rfc_txt.parse_rfc(infile, txt_engine)
     return content
 
-def main():
-    # Set up optional component parsers
-    # TODO : Currently we have only one parser. When multiple parsers
-    # for each sub-subcomponent are available, loop through them and initialise
-    #dom_parser = { "asciidiagrams" : parsers.asciidiagrams.asciidiagrams_parser.AsciiDiagramsParser() }
-    dom_parser = AsciiDiagramsParser()
-    output_formatter = {
-            "simple" : SimpleFormatter(),
-            "rust"   : RustFormatter()
-            }
+# Output formatters, by name. A new formatter instance is created for each document, so that no
+# state is shared between documents.
+output_formatters : Dict[str, Union[Type[SimpleFormatter], Type[RustFormatter], Type[IRFormatter]]] = {
+        "simple" : SimpleFormatter,
+        "rust"   : RustFormatter,
+        "ir"     : IRFormatter
+        }
 
-    opt = npt.util.read_usr_opts(sys.argv[1:])
-    for idx, doc in enumerate(opt.infiles):
-        parsed_content = parse_input_file( doc )
+def tool_components(txt_engine: str, intern_types: bool = False, from_ir: bool = False) -> Dict[str, str]:
+    """
+    A digest of the source of the tool, including its grammars, and the options that affect the
+    outputs it generates: the text engine used, whether types were interned, and whether the
+    protocol was loaded from its snapshot. These are recorded in the build manifest, so that a
+    change to any stage of the tool, or to these options, causes documents to be regenerated.
+    """
+    return {"tool"         : npt.util.package_digest(),
+            "txt-engine"   : txt_engine,
+            "intern-types" : str(intern_types),
+            "from-ir"      : str(from_ir)}
+
+def format_types(formatter: Formatter, protocol: Protocol) -> None:
+    """
+    Format each of the types and functions of the protocol, in its type order, so that each is
+    formatted after the types it depends on.
+    """
+    expr_traversal = ExpressionTraversal(formatter)
+    formatter.analyse_protocol(protocol)
+    for type_name in protocol.get_type_order():
+        if protocol.has_type(type_name):
+            pt = protocol.get_type(type_name)
+            if isinstance(pt, BitString):
+                size_expr = expr_traversal.dfs_expression(cast(Expression, pt.size))
+                formatter.format_bitstring(pt, size_expr)
+            elif isinstance(pt, Struct):
+                constraints = []
+                for constraint in pt.constraints:
+                    expr = expr_traversal.dfs_expression(constraint)
+                    constraints.append(expr)
+                formatter.format_struct(pt, constraints)
+            elif isinstance(pt, Array):
+                formatter.format_array(pt)
+            elif isinstance(pt, Enum):
+                formatter.format_enum(pt)
+            elif isinstance(pt, Context):
+                formatter.format_context(pt)
+        elif protocol.has_func(type_name):
+            formatter.format_function(protocol.get_func(type_name))
+
+def process_document(doc: npt.util.IETF_URI, output_fmts: List[str], root_dir: Path, txt_engine: str = "grammar", intern_types: bool = False, from_ir: bool = False) -> Tuple[List[str], Dict[str, List[Path]]]:
+    """
+    Parse a single document, build and synthesise its protocol, interning structurally identical
+    types if intern_types is set, and remove the types that its PDUs do not use, then format and
+    write the output in each of the requested formats. If from_ir is set, the protocol is instead
+    loaded from the snapshot written to the document's ir output directory by a previous run.
+    Returns the messages to report for this document, in order, and the files written for each
+    output format that was generated successfully. Failures are reported as messages, so that
+    one document cannot stop the others from being processed.
+    This is run in a worker process when documents are processed in parallel, so everything it
+    uses is created afresh for each document.
+    """
+    messages : List[str] = []
+    outputs  : Dict[str, List[Path]] = {}
+
+    if from_ir:
+        ir_dir = doc.gen_filepath_out(root_dir, "ir")
+        assert isinstance(ir_dir, Path)
+        try:
+            protocol = npt.protocol_ir.load(ir_dir / IR_FILENAME)
+        except (OSError, npt.protocol_ir.ProtocolIRError, ProtocolTypeError) as e:
+            messages.append(f"Error : File {doc.get_filepath_in()}: could not load protocol from {ir_dir / IR_FILENAME} ({type(e).__name__})")
+            return messages, outputs
+    else:
+        # Set up optional component parsers
+        # TODO : Currently we have only one parser. When multiple parsers
+        # for each sub-subcomponent are available, loop through them and initialise
+        #dom_parser = { "asciidiagrams" : parsers.asciidiagrams.asciidiagrams_parser.AsciiDiagramsParser() }
+        dom_parser = AsciiDiagramsParser()
+
+        # Protocol extraction only needs the middle of the document
+        try:
+            parsed_content = parse_input_file( doc, middle_only=True, txt_engine=txt_engine )
+        except Exception as e:
+            messages.append(f"Error : File {doc.get_filepath_in()}: could not parse document ({type(e).__name__})")
+            return messages, outputs
         if parsed_content is None :
-            print(f"Error : Parsing {doc.get_filepath_in()} -> container = {doc}")
-            continue
+            messages.append(f"Error : Parsing {doc.get_filepath_in()} -> container = {doc}")
+            return messages, outputs
 
-        protocol = dom_parser.build_protocol(  None , parsed_content )
+        try:
+            protocol = dom_parser.build_protocol( Protocol(intern_types=intern_types), parsed_content )
+        except Exception as e:
+            messages.append(f"Error : File {doc.get_filepath_in()}: could not build protocol ({type(e).__name__})")
+            return messages, outputs
 
         try:
             protocol.synthesise()
         except Exception as e:
-            print(f"Error: could not synthesise protocol ({e})")
+            messages.append(f"Error : File {doc.get_filepath_in()}: could not synthesise protocol ({type(e).__name__})")
+            return messages, outputs
+
+    try:
+        npt.simplifier.simplify_protocol(protocol)
+    except Exception as e:
+        messages.append(f"Error : File {doc.get_filepath_in()}: could not simplify protocol ({type(e).__name__})")
+        return messages, outputs
+
+    # Types that cannot be reached from the PDUs are not formatted
+    removed = protocol.remove_unreachable()
+    if len(removed.types) + len(removed.context_fields) > 0:
+        messages.append(f"Removed : File {doc.get_filepath_in()}: {len(removed.types)} unreachable types and {len(removed.context_fields)} context fields")
+
+    # The type order is cached by the protocol, and used by each formatter
+    try:
+        protocol.get_type_order()
+    except ProtocolTypeError as e:
+        messages.append(f"Error : File {doc.get_filepath_in()}: could not order protocol types ({e})")
+        return messages, outputs
+
+    for o_fmt in output_fmts :
+        formatter = output_formatters[o_fmt]()
+        try:
+            format_types(formatter, protocol)
+        except Exception as e:
+            messages.append(f"Error : File {doc.get_filepath_in()}: Could not format protocol with '{o_fmt}' formatter (format_types failed)")
+            continue
+        try:
+            formatter.format_protocol(protocol)
+        except Exception as e:
+            messages.append(f"Error : File {doc.get_filepath_in()}: Could not format protocol with '{o_fmt}' formatter (format_protocol failed)")
             continue
+        for warning in formatter.get_warnings():
+            messages.append(f"Warning : File {doc.get_filepath_in()}: {warning}")
 
-        type_names = dfs_protocol(protocol)
-
-        for o_fmt in opt.output_fmt :
-            formatter = output_formatter[o_fmt]
-            expr_traversal = ExpressionTraversal(formatter)
-            try:
-                for type_name in type_names:
-                    if protocol.has_type(type_name):
-                        pt = protocol.get_type(type_name)
-                        if isinstance(pt, BitString):
-                            size_expr = expr_traversal.dfs_expression(cast(Expression, pt.size))
-                            formatter.format_bitstring(pt, size_expr)
-                        elif isinstance(pt, Struct):
-                            constraints = []
-                            for constraint in pt.constraints:
-                                expr = expr_traversal.dfs_expression(constraint)
-                                constraints.append(expr)
-                            formatter.format_struct(pt, constraints)
-                        elif isinstance(pt, Array):
-                            formatter.format_array(pt)
-                        elif isinstance(pt, Enum):
-                            formatter.format_enum(pt)
-                        elif isinstance(pt, Context):
-                            formatter.format_context(pt)
-                    elif protocol.has_func(type_name):
-                        formatter.format_function(protocol.get_func(type_name))
-            except Exception as e:
-                print(f"Error : File {doc.get_filepath_in()}: Could not format protocol with '{o_fmt}' formatter (format_{pt} failed)")
-                continue
-            try:
-                formatter.format_protocol(protocol)
-            except Exception as e:
-                print(f"Error : File {doc.get_filepath_in()}: Could not format protocol with '{o_fmt}' formatter (format_protocol failed)")
-                continue
-
-            output_dir = doc.gen_filepath_out(opt.root_dir, o_fmt)
-            assert isinstance(output_dir, Path)
-            output = formatter.generate_output(doc.document_name())
-            for output_filename in output:
-                output_filepath = Path(output_dir, output_filename)
-                output_filepath.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
-                with open(output_filepath, "w") as out_fp:
-                    out_fp.write(output[output_filename])
-                print(f"\t{output_filepath}")
+        output_dir = doc.gen_filepath_out(root_dir, o_fmt)
+        assert isinstance(output_dir, Path)
+        output = formatter.generate_output(doc.document_name())
+        outputs[o_fmt] = []
+        for output_filename in output:
+            output_filepath = Path(output_dir, output_filename)
+            output_filepath.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+            with open(output_filepath, "w") as out_fp:
+                out_fp.write(output[output_filename])
+            outputs[o_fmt].append(output_filepath)
+            messages.append(f"\t{output_filepath}")
+    return messages, outputs
+
+
+def main():
+    opt = npt.util.read_usr_opts(sys.argv[1:])
+    with npt.util.RootWorkingDir(root=opt.root_dir) as rwd, npt.util.BuildManifest(rwd.manifest, tool_components(opt.txt_engine, opt.intern_types, opt.from_ir)) as manifest:
+        # Skip documents whose outputs were generated from identical inputs by a previous run
+        docs = []
+        for doc in opt.infiles:
+            infile = doc.get_filepath_in()
+            if not opt.rebuild and infile is not None and manifest.is_current(infile, opt.output_fmt):
+                print(f"Unchanged : {infile}")
+            else:
+                docs.append(doc)
+
+        if opt.jobs > 1 and len(docs) > 1:
+            # Documents are independent, so spread them across a pool of worker processes. The
+            # results are reported in the order the documents were given, as in the serial case.
+            executor = ProcessPoolExecutor(max_workers=opt.jobs)
+            results  = executor.map(process_document, docs, repeat(opt.output_fmt), repeat(opt.root_dir), repeat(opt.txt_engine), repeat(opt.intern_types), repeat(opt.from_ir))
+        else:
+            executor = None
+            results  = map(process_document, docs, repeat(opt.output_fmt), repeat(opt.root_dir), repeat(opt.txt_engine), repeat(opt.intern_types), repeat(opt.from_ir))
+
+        try:
+            for doc, (messages, outputs) in zip(docs, results):
+                for message in messages:
+                    print(message)
+                infile = doc.get_filepath_in()
+                if infile is not None and len(outputs) > 0:
+                    manifest.record(infile, outputs)
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+# =================================================================================================
+# Copyright (C) 2018-2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+"""
+Per-stage benchmarks for the document-to-code pipeline.
+
+Each document is taken through the same stages as the command line tool, and the time taken by
+each stage is recorded: reading the file, parsing it into the RFC DOM (incrementally, and only the
+middle of the document, for XML), building, synthesising, simplifying, pruning and ordering the
+protocol, formatting it with each output formatter, and writing the output files. As well as the
+given documents, synthetic drafts describing increasing numbers of structures are generated, to
+show how each stage scales with the size of the document. The results identify the version of the
+tool that produced them, so that they can be compared between versions.
+
+Usage: python -m npt.benchmark [-o results.json] [-n repeat] [-s scale,...] [file ...]
+"""
+
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import npt.parser_rfc_txt
+import npt.parser_rfc_xml
+import npt.simplifier
+import npt.util
+
+from npt.__main__             import format_types, output_formatters
+from npt.parser_asciidiagrams import AsciiDiagramsParser
+from pathlib                  import Path
+from typing                   import Any, Callable, Dict, List, Optional
+
+DEFAULT_SCALES = [10, 50, 250]
+
+def synthetic_name(index: int) -> str:
+    """
+    A name for the index-th synthetic structure. Names are made from letters only, since the
+    structured text does not allow digits in the names of structures, and do not end in "s",
+    so that their plurals are unambiguous.
+    """
+    alphabet = "abcdefghijklmnopqrtuvwxyz"
+    letters  = ""
+    while True:
+        letters = alphabet[index % len(alphabet)] + letters
+        index   = index // len(alphabet)
+        if index == 0:
+            break
+    return f"Header {letters.capitalize()}"
+
+
+def synthetic_draft(num_structs: int) -> str:
+    """
+    Generate an XML Internet-Draft, in the format of the examples, describing a protocol whose
+    PDUs are num_structs structures. Each structure has three fixed-width fields, and a
+    variable-length field whose length is given by the first of these.
+    """
+    sections = []
+    for i in range(num_structs):
+        name = synthetic_name(i)
+        sections.append(f"""
+        <section>
+            <name>{name}</name>
+            <t>
+                A {name} is formatted as follows:
+            </t>
+            <artwork>
+     0                   1                   2                   3
+     0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |     Length    |  Type |  Flags|
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |                                                               :
+    :                            Payload                            :
+    :                                                               |
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+            </artwork>
+            <t>
+                where:
+            </t>
+            <dl>
+                <dt>Length (L): 1 byte.</dt>
+                <dd><t>The length of the payload, in bytes.</t></dd>
+                <dt>Type: 4 bits.</dt>
+                <dd><t>Fixed-width field.</t></dd>
+                <dt>Flags: 4 bits.</dt>
+                <dd><t>Fixed-width field.</t></dd>
+                <dt>Payload: 8*L bits.</dt>
+                <dd><t>Variable-length field.</t></dd>
+            </dl>
+        </section>""")
+    pdus = [f"{synthetic_name(i)}s" for i in range(num_structs)]
+    if len(pdus) > 1:
+        pdus[-1] = f"and {pdus[-1]}"
+    return f"""<?xml version='1.0' encoding='US-ASCII'?>
+<rfc version='3' ipr='trust200902' submissionType='IETF' docName='draft-synthetic-{num_structs}-00' category='exp'>
+    <front>
+        <title>A Synthetic Protocol with {num_structs} Structures</title>
+        <seriesInfo name='Internet-Draft' value='draft-synthetic-{num_structs}-00' status="experimental" />
+        <abstract><t>A generated draft, used to benchmark the tools.</t></abstract>
+    </front>
+    <middle>{"".join(sections)}
+        <section>
+            <name>Specifying Protocol Data Units</name>
+            <t>
+                This document describes the Synthetic protocol. The Synthetic protocol uses {", ".join(pdus)}.
+            </t>
+        </section>
+    </middle>
+    <back>
+    </back>
+</rfc>
+"""
+
+
+class StageTimer:
+    """
+    Times the stages of the pipeline for one document, keeping the fastest of the repeated runs
+    of each stage.
+    """
+    def __init__(self) -> None:
+        self.stages : Dict[str, float] = {}
+
+    def run(self, stage: str, func: Callable[..., Any], *args: Any) -> Any:
+        start   = time.perf_counter()
+        result  = func(*args)
+        elapsed = time.perf_counter() - start
+        if stage not in self.stages or elapsed < self.stages[stage]:
+            self.stages[stage] = elapsed
+        return result
+
+
+def write_outputs(output: Dict[Path, str], output_dir: Path) -> None:
+    for output_filename in output:
+        output_filepath = Path(output_dir, output_filename)
+        output_filepath.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        with open(output_filepath, "w") as out_fp:
+            out_fp.write(output[output_filename])
+
+
+def read_lines(filepath: Path) -> List[str]:
+    with open(filepath, "r") as infile:
+        return infile.readlines()
+
+
+def benchmark_document(filepath: Path, output_fmts: List[str], output_dir: Path, repeat: int, txt_engine: str) -> Dict[str, Any]:
+    """
+    Time each stage of processing the given document, repeat times. Returns a result giving the
+    fastest time for each stage, in seconds, and the error that stopped the pipeline, if any.
+    """
+    timer = StageTimer()
+    error : Optional[str] = None
+    for _ in range(repeat):
+        try:
+            if filepath.suffix == ".xml":
+                raw_content = timer.run("read", filepath.read_bytes)
+                content     = timer.run("parse_middle", npt.parser_rfc_xml.parse_middle_iter, io.BytesIO(raw_content))
+            else:
+                lines       = timer.run("read", read_lines, filepath)
+                content     = timer.run("parse_rfc", npt.parser_rfc_txt.parse_rfc, lines, txt_engine)
+            protocol   = timer.run("build_protocol", AsciiDiagramsParser().build_protocol, None, content)
+            timer.run("synthesise", protocol.synthesise)
+            timer.run("simplify", npt.simplifier.simplify_protocol, protocol)
+            timer.run("remove_unreachable", protocol.remove_unreachable)
+            timer.run("order_types", protocol.get_type_order)
+            for o_fmt in output_fmts:
+                def format_protocol() -> Dict[Path, str]:
+                    formatter = output_formatters[o_fmt]()
+                    format_types(formatter, protocol)
+                    formatter.format_protocol(protocol)
+                    return formatter.generate_output(filepath.stem)
+                output = timer.run(f"format:{o_fmt}", format_protocol)
+                timer.run(f"write:{o_fmt}", write_outputs, output, output_dir / filepath.stem / o_fmt)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+            break
+    return {"document" : filepath.name,
+            "bytes"    : filepath.stat().st_size,
+            "stages"   : timer.stages,
+            "total"    : sum(timer.stages.values()),
+            "error"    : error}
+
+
+def git_revision() -> Optional[str]:
+    """
+    The git revision of the source tree the tool is run from, or None if it is not run from a git
+    checkout. A "-dirty" suffix marks a tree with uncommitted changes.
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(description="Time each stage of the document-to-code pipeline")
+    ap.add_argument("-o", "--output", metavar="file", default="benchmark.json",
+                    help="File to write the results to, as JSON. Defaults to benchmark.json")
+    ap.add_argument("-n", "--repeat", metavar="N", type=int, default=3,
+                    help="Number of times to run each stage, keeping the fastest. Defaults to 3")
+    ap.add_argument("-s", "--scales", metavar="scale", default=",".join(str(s) for s in DEFAULT_SCALES),
+                    help="Comma delimited list of the numbers of structures in the synthetic drafts, "
+                         "or an empty string for none")
+    ap.add_argument("-of", "--outformat", metavar="format", default=",".join(npt.util.output_formats),
+                    help="Comma delimited list of output formats to benchmark")
+    ap.add_argument("-te", "--txt-engine", metavar="engine", choices=npt.util.txt_engines, default="grammar",
+                    help="Engine used to structure text documents")
+    ap.add_argument("files", metavar="file", nargs="*",
+                    help="Documents to benchmark. Defaults to those in examples/")
+    args = ap.parse_args(argv)
+
+    files = [Path(f) for f in args.files]
+    if len(files) == 0:
+        files = sorted(Path("examples").glob("*.xml")) + sorted(Path("examples").glob("*.txt"))
+    output_fmts = args.outformat.split(",")
+    scales      = [int(s) for s in args.scales.split(",") if s != ""]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_structs in scales:
+            filepath = Path(tmp_dir, f"draft-synthetic-{num_structs}.xml")
+            filepath.write_text(synthetic_draft(num_structs))
+            files.append(filepath)
+        for filepath in files:
+            result = benchmark_document(filepath, output_fmts, Path(tmp_dir, "output"), args.repeat, args.txt_engine)
+            results.append(result)
+            stages = "  ".join(f"{stage}={elapsed:.4f}" for stage, elapsed in result["stages"].items())
+            print(f"{result['document']}: {result['total']:.4f}s  {stages}")
+            if result["error"] is not None:
+                print(f"\tError : {result['error']}")
+
+    with open(args.output, "w") as outfile:
+        json.dump({"tool"       : npt.util.package_digest(),
+                   "revision"   : git_revision(),
+                   "python"     : platform.python_version(),
+                   "platform"   : platform.platform(),
+                   "time"       : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "repeat"     : args.repeat,
+                   "txt_engine" : args.txt_engine,
+                   "results"    : results}, outfile, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -107,3 +107,17 @@ class Formatter(abc.ABC):
     def format_protocol(self, protocol:Protocol):
         pass
 
+    def analyse_protocol(self, protocol: Protocol) -> None:
+        """
+        Called before any of the types of the protocol are formatted, for formatters that need to
+        know how the types are used by the protocol as a whole. Does nothing by default.
+        """
+        pass
+
+    def get_warnings(self) -> List[str]:
+        """
+        Describes the parts of the protocol that could not be formatted, and were left out of the
+        output. There are none by default.
+        """
+        return []
+
@@ -0,0 +1,104 @@
+# =================================================================================================
+# Copyright (C) 2018-2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import npt.protocol_ir
+
+from typing        import Optional, List, Any
+from pathlib       import Path
+from npt.protocol  import *
+from npt.formatter import Formatter
+
+# The file, in the ir output directory of a document, to which its protocol is saved
+IR_FILENAME = "protocol.json"
+
+class IRFormatter(Formatter):
+    """
+    Saves a snapshot of the protocol, that can be loaded to generate the other outputs without
+    parsing the document again. The types are saved as part of the protocol, so formatting them
+    individually does nothing.
+    """
+    protocol: Optional[Protocol]
+
+    def __init__(self):
+        self.protocol = None
+
+    def generate_output(self, output_name: str) -> Dict[Path, str]:
+        assert self.protocol is not None
+        return {Path(IR_FILENAME): npt.protocol_ir.dumps(self.protocol)}
+
+    def format_argumentexpression(self, arg_name: str, arg_value: Any) -> Any:
+        return None
+
+    def format_methodinvocationexpr(self, target: Any, method_name: str, arg_exprs: List[Any]) -> Any:
+        return None
+
+    def format_functioninvocationexpr(self, func_name: str, args_exprs: List[Any]) -> Any:
+        return None
+
+    def format_fieldaccessexpr(self, target: Any, field_name: str) -> Any:
+        return None
+
+    def format_contextaccessexpr(self, field_name: str) -> Any:
+        return None
+
+    def format_ifelseexpr(self, condition: Any, if_true: Any, if_false: Any) -> Any:
+        return None
+
+    def format_selfexpr(self) -> Any:
+        return None
+
+    def format_constantexpr(self, constant_type: ProtocolType, constant_value: Any) -> Any:
+        return None
+
+    def format_expression(self, expr:Any):
+        return None
+
+    def format_bitstring(self, bitstring:BitString, size: str):
+        pass
+
+    def format_struct(self, struct:Struct, constraints: List[str]):
+        pass
+
+    def format_array(self, array:Array):
+        pass
+
+    def format_enum(self, enum:Enum):
+        pass
+
+    def format_function(self, function:Function):
+        pass
+
+    def format_context(self, context:Context):
+        pass
+
+    def format_protocol(self, protocol:Protocol):
+        self.protocol = protocol
+
+# vim: set tw=0 ai:
@@ -36,6 +36,7 @@ from pathlib import Path
 from npt.protocol  import *
 from npt.formatter import Formatter
 from npt.helpers   import ExpressionTraversal
+from npt.layout    import TypeLayout, analyse_layout
 
 import re
 
@@ -49,6 +50,11 @@ class RustFormatter(Formatter):
 
     output: List[str]
     expr_traversal: ExpressionTraversal
+    layouts: Dict[str, TypeLayout]
+    borrowed: Set[str]
+    native_ints: Set[str]
+    lifetimes: Set[str]
+    warnings: List[str]
 
     #add necessary imports at the start of every generated rust file
     def __init__(self):
@@ -56,6 +62,11 @@ class RustFormatter(Formatter):
         self.structs = {}
         self.struct_field_signatures = {}
         self.expr_traversal = ExpressionTraversal(self)
+        self.layouts = {}
+        self.borrowed = set()
+        self.native_ints = set()
+        self.lifetimes = set()
+        self.warnings = []
 
     def generate_output(self, output_name: str) -> Dict[Path, str]:
         manifest = f"[package]\nname = \"{output_name.replace('-', '_')}\"\nversion = \"0.1.0\"\n\n[dependencies]\nnom = \"*\"\n\n"
@@ -64,18 +75,88 @@ class RustFormatter(Formatter):
                         Path(f"Cargo.toml"): manifest}
         return output_files
 
+    def analyse_protocol(self, protocol: Protocol) -> None:
+        """
+        Find the bitstrings that are always byte aligned, and a whole number of bytes long,
+        wherever they are used. Those of variable length borrow their value from the input,
+        rather than copying it, and so the types that contain them, directly or indirectly, take
+        a lifetime. Those the size of a native integer are read directly from the input bytes,
+        rather than bit by bit.
+        """
+        self.layouts = analyse_layout(protocol)
+        types = [protocol.get_type(type_name) for type_name in protocol.get_type_names()]
+        structs = [pt for pt in types if isinstance(pt, Struct)]
+
+        # Structures are parsed from byte aligned input unless they are used at an unaligned
+        # offset within another structure, or within an array, enum or option
+        unaligned : Set[str] = set()
+        for pt in types:
+            if isinstance(pt, Array):
+                unaligned.add(pt.element_type.name if isinstance(pt.element_type, ConstructableType) else "")
+            elif isinstance(pt, Option):
+                unaligned.add(pt.reference_type.name if isinstance(pt.reference_type, ConstructableType) else "")
+            elif isinstance(pt, Enum):
+                unaligned.update(variant.name for variant in pt.variants if isinstance(variant, ConstructableType))
+        changed = True
+        while changed:
+            changed = False
+            for struct in structs:
+                for field in struct.get_fields():
+                    if isinstance(field.field_type, Struct) and field.field_type.name not in unaligned:
+                        if struct.name in unaligned or not self.layouts[struct.name].field(field.field_name).aligned:
+                            unaligned.add(field.field_type.name)
+                            changed = True
+
+        aligned = set(pt.name for pt in types if isinstance(pt, BitString) and pt.size is not None and pt.name not in unaligned)
+        for struct in structs:
+            for field in struct.get_fields():
+                if struct.name in unaligned or not self.layouts[struct.name].field(field.field_name).byte_aligned:
+                    aligned.discard(field.field_type.name if isinstance(field.field_type, ConstructableType) else "")
+        self.borrowed = set(name for name in aligned if not isinstance(cast(BitString, protocol.get_type(name)).size, ConstantExpression))
+        self.native_ints = set(name for name in aligned if self.layouts[name].fixed_size in [8, 16, 32, 64, 128])
+
+        self.lifetimes = set(self.borrowed)
+        changed = True
+        while changed:
+            changed = False
+            for pt in types:
+                if isinstance(pt, Struct):
+                    parts = [field.field_type for field in pt.get_fields()]
+                elif isinstance(pt, Array):
+                    parts = [pt.element_type]
+                else:
+                    continue
+                if pt.name not in self.lifetimes and any(isinstance(part, ConstructableType) and part.name in self.lifetimes for part in parts):
+                    self.lifetimes.add(pt.name)
+                    changed = True
+
+    def get_warnings(self) -> List[str]:
+        return self.warnings
+
+    def rust_type(self, type_name: str) -> str:
+        """
+        The Rust type for the protocol type with the given name, with its lifetime if it has one.
+        """
+        return camelcase(type_name) + ("<'a>" if type_name in self.lifetimes else "")
+
     def format_argumentexpression(self, arg_name: str, arg_value: Any) -> Any:
         return arg_value
 
     def format_methodinvocationexpr(self, target: Any, method_name: str, arg_exprs: List[Any]) -> Any:
+        # An expression with a part that cannot be expressed in Rust cannot be expressed at all
+        if target in ["", None] or any(arg_expr in ["", None] for arg_expr in arg_exprs):
+            return ""
+        operators = {"plus" : "+", "eq" : "==", "ne" : "!=", "lt" : "<", "le" : "<=", "gt" : ">", "ge" : ">=", "and" : "&&", "or" : "||"}
         if method_name == "pow":
             return f"({target}.pow({arg_exprs[0]}))"
         elif method_name == "multiply":
             return f"({target}*{arg_exprs[0]})"
         elif method_name == "minus":
             return f"({target}-{arg_exprs[0]})"
-        elif method_name == "ge":
-            return f"({target} >= {arg_exprs[0]})"
+        elif method_name in operators:
+            return f"({target} {operators[method_name]} {arg_exprs[0]})"
+        elif method_name == "not":
+            return f"(!{target})"
         if method_name == "to_number":
             return f"{target}"
         return ""
@@ -101,6 +182,8 @@ class RustFormatter(Formatter):
     def format_constantexpr(self, constant_type: ProtocolType, constant_value: Any) -> Any:
         if constant_type == Number():
             return int(constant_value)
+        elif constant_type == Boolean():
+            return "true" if constant_value else "false"
         else:
             return str(constant_value)
 
@@ -115,7 +198,7 @@ class RustFormatter(Formatter):
         if type(size) is not str:
             data_type = f"u{self.assign_int_size(size)}"
         else:
-            data_type = "Vec<u8>"
+            data_type = "&'a [u8]" if bitstring.name in self.borrowed else "Vec<u8>"
             self_vars = re.findall(r"self\(([\w]*)\)", size)
             size = re.sub(r"self\(([\w]*)\)", r"\1", size)
             self.struct_field_signatures[f"parse_{bitstring.name.lower()}"] = self_vars
@@ -123,12 +206,28 @@ class RustFormatter(Formatter):
         assert bitstring.name not in self.output
         self.output.append(f"\n// Structure and parser for {bitstring.name} (bitstring type)\n")
         self.output.append("\n#[derive(Debug, PartialEq, Eq)]\n")
-        self.output.extend(["pub struct ", camelcase(bitstring.name), "(pub %s);\n" % (data_type)])
+        self.output.extend(["pub struct ", self.rust_type(bitstring.name), "(pub %s);\n" % (data_type)])
         if len(required_vars) > 0:
-            self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context, {required_vars_signatures}) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context){{\n".format(fname=bitstring.name.lower(), typename=camelcase(bitstring.name), required_vars_signatures=", ".join(required_vars)))
+            self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context, {required_vars_signatures}) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context){{\n".format(fname=bitstring.name.lower(), typename=self.rust_type(bitstring.name), required_vars_signatures=", ".join(required_vars)))
         else:
-            self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context){{\n".format(fname=bitstring.name.lower(), typename=camelcase(bitstring.name)))
-        if data_type == "Vec<u8>":
+            self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context){{\n".format(fname=bitstring.name.lower(), typename=self.rust_type(bitstring.name)))
+        if size == "":
+            # A parser that cannot know how much to read rejects all input, rather than being
+            # left out, so that the types using it can still be parsed up to this field
+            self.warnings.append(f"Size of {bitstring.name} cannot be expressed in Rust, and it is not parsed")
+            self.output.append(f"    (nom::IResult::Err(nom::Err::Failure((input, nom::error::ErrorKind::Verify))), context)\n")
+        elif bitstring.name in self.borrowed:
+            # The value is a whole number of bytes starting on a byte boundary, so is borrowed
+            # from the input; the alignment is checked, since the parser is public
+            if size[0] == "(" and size[-1] == ")":
+                size = size[1:-1]
+            self.output.append(f"    let {bitstring.name.lower()}_size = ({size}) / 8;\n")
+            self.output.append(f"    if input.1 != 0 || input.0.len() < {bitstring.name.lower()}_size {{\n")
+            self.output.append(f"        return (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Eof))), context);\n")
+            self.output.append(f"    }}\n")
+            self.output.append(f"    let ({bitstring.name.lower()}, rest) = input.0.split_at({bitstring.name.lower()}_size);\n")
+            self.output.append(f"    (nom::IResult::Ok(((rest, 0), {camelcase(bitstring.name)}({bitstring.name.lower()}))), context)\n")
+        elif data_type == "Vec<u8>":
             if size[0] == "(" and size[-1] == ")":
                 size = size[1:-1]
             self.output.append(f"    let mut {bitstring.name.lower()}_size = {size};\n")
@@ -144,6 +243,16 @@ class RustFormatter(Formatter):
             self.output.append(f"    }}\n")
             self.output.append(f"    (nom::IResult::Ok((input, {bitstring.name.lower()})), context)\n")
         else:
+            if bitstring.name in self.native_ints:
+                # The value is a whole native integer starting on a byte boundary, so is read
+                # directly from the input bytes; unaligned or short input, which the layout rules
+                # out but the public parser cannot, falls back to reading bits
+                byte_size = size // 8
+                value = "u{size}::from_be_bytes([{bytes}])".format(size=size, bytes=", ".join(f"bytes[{i}]" for i in range(byte_size)))
+                self.output.append(f"    if input.1 == 0 && input.0.len() >= {byte_size} {{\n")
+                self.output.append(f"        let (bytes, rest) = input.0.split_at({byte_size});\n")
+                self.output.append(f"        return (nom::IResult::Ok(((rest, 0), {camelcase(bitstring.name)}({value}))), context);\n")
+                self.output.append(f"    }}\n")
             self.output.append("    let {fname} = take({size}_usize)(input);\n".format(fname=bitstring.name.lower(), size=size))
             self.output.append("    match {fname} {{\n".format(fname=bitstring.name.lower()))
             self.output.append("        nom::IResult::Ok((i, o)) => (nom::IResult::Ok((i, {name}(o))), context),\n".format(name=camelcase(bitstring.name)))
@@ -170,54 +279,43 @@ class RustFormatter(Formatter):
         else:
             return 128
 
-    def format_struct_field(self, index: int, struct_name: str, field_names: List[str], parser_func_names: List[str], constraints):
-        args = []
-        if parser_func_names[index] in self.struct_field_signatures:
-            args = [f"o{field_names.index(arg)}.0 as usize" for arg in self.struct_field_signatures[parser_func_names[index]]]
-        indentation = "    "*(index+1) + "    "*(index)
+    def format_struct_fields(self, struct_name: str, field_names: List[str], parser_func_names: List[str], constraints) -> List[str]:
+        """
+        The body of the parser for a structure: the fields are parsed in turn, each returning
+        early if it cannot be parsed, so the generated code is linear in the number of fields.
+        The value of the index-th field, and the input and context after it is parsed, are bound
+        to o<index>, i<index> and con<index>. Each constraint is checked as soon as the fields it
+        refers to have been parsed, and a structure that violates it is rejected with a Verify
+        error at the position the structure starts.
+        """
         generated_code = []
-        context_str = "context"
         input_str = "input"
-        if index > 0:
-            input_str = f"i{index-1}"
-            context_str = f"con{index-1}"
-
-        # process constraints: find those that can be expressed here
-        handled_constraints = []
-        unhandled_constraints = []
-        for constraint in constraints:
-            if all(field in field_names[:index+1] for field in constraint[1]):
-                constraint_expr = constraint[0]
-                for field in constraint[1]:
-                    constraint_expr = constraint_expr.replace(field, f"o{field_names.index(field)}.0")
-                handled_constraints.append((constraint_expr, constraint[0]))
-            else:
-                unhandled_constraints.append(constraint)
-
-        if len(args) > 0:
-            generated_code.append(f"{indentation}let {field_names[index]} = {parser_func_names[index]}({input_str}, {context_str}, {', '.join(args)});\n")
-        else:
-            generated_code.append(f"{indentation}let {field_names[index]} = {parser_func_names[index]}({input_str}, {context_str});\n")
-        generated_code.append(f"{indentation}match {field_names[index]} {{\n")
-        if index+1 == len(field_names):
-            struct_instantiation_fields = ", ".join([f"{field_names[i]}: o{i}" for i in range(len(field_names))])
-            if len(handled_constraints) > 0:
-                generated_code.append(f"{indentation}    (nom::IResult::Ok((i{index}, o{index})), con{index}) => {{\n")
-                for constraint in handled_constraints:
-                    generated_code.append(f"{indentation}        assert!({constraint[0]}); // check constraint: {constraint[1]}\n")
-                generated_code.append(f"{indentation}        nom::IResult::Ok((i{index}, {struct_name}{{{struct_instantiation_fields}}})), con{index})}},\n")
-            else:
-                generated_code.append(f"{indentation}    (nom::IResult::Ok((i{index}, o{index})), con{index}) => (nom::IResult::Ok((i{index}, {struct_name}{{{struct_instantiation_fields}}})), con{index}),\n")
-            generated_code.append(f"{indentation}    (nom::IResult::Err(e), con{index}) => (nom::IResult::Err(e), con{index})\n")
-            generated_code.append(f"{indentation}}}\n")
-        else:
-            generated_code.append(f"{indentation}    (nom::IResult::Ok((i{index}, o{index})), con{index}) => {{\n")
-            for constraint in handled_constraints:
-                generated_code.append(f"{indentation}        assert!({constraint[0]}); // check constraint: {constraint[1]}\n")
-            generated_code = generated_code + self.format_struct_field(index+1, struct_name, field_names, parser_func_names, unhandled_constraints)
-            generated_code.append(f"{indentation}    }}\n")
-            generated_code.append(f"{indentation}    (nom::IResult::Err(e), con{index}) => (nom::IResult::Err(e), con{index})\n")
-            generated_code.append(f"{indentation}}}\n")
+        context_str = "context"
+        for index in range(len(field_names)):
+            args = []
+            if parser_func_names[index] in self.struct_field_signatures:
+                args = [f"o{field_names.index(arg)}.0 as usize" for arg in self.struct_field_signatures[parser_func_names[index]]]
+            generated_code.append(f"    let (i{index}, con{index}, o{index}) = match {parser_func_names[index]}({', '.join([input_str, context_str] + args)}) {{\n")
+            generated_code.append(f"        (nom::IResult::Ok((i, o)), con) => (i, con, o),\n")
+            generated_code.append(f"        (nom::IResult::Err(e), con) => return (nom::IResult::Err(e), con)\n")
+            generated_code.append(f"    }};\n")
+            input_str = f"i{index}"
+            context_str = f"con{index}"
+
+            # process constraints: check those that can be expressed here
+            unhandled_constraints = []
+            for constraint in constraints:
+                if all(field in field_names[:index+1] for field in constraint[1]):
+                    constraint_expr = re.sub(r"self\(([\w]*)\)", lambda match: f"o{field_names.index(match.group(1))}.0", constraint[0]).replace("context.", f"con{index}.")
+                    constraint_desc = re.sub(r"self\(([\w]*)\)", r"\1", constraint[0])
+                    generated_code.append(f"    if !{constraint_expr} {{ // check constraint: {constraint_desc}\n")
+                    generated_code.append(f"        return (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Verify))), con{index});\n")
+                    generated_code.append(f"    }}\n")
+                else:
+                    unhandled_constraints.append(constraint)
+            constraints = unhandled_constraints
+        struct_instantiation_fields = ", ".join([f"{field_names[i]}: o{i}" for i in range(len(field_names))])
+        generated_code.append(f"    (nom::IResult::Ok(({input_str}, {struct_name}{{{struct_instantiation_fields}}})), {context_str})\n")
         return generated_code
 
     def format_struct(self, struct: Struct, constraints: List[str]):
@@ -225,7 +323,11 @@ class RustFormatter(Formatter):
         # process constraints - pick out field names and build structure
         processed_constraints = []
         for constraint in constraints:
-            processed_constraints.append((re.sub(r"self\(([\w]*)\)", r"\1", constraint), re.findall(r"self\(([\w]*)\)", constraint)))
+            constraint_fields = re.findall(r"self\(([\w]*)\)", constraint)
+            if constraint == "" or any(field_name not in [field.field_name for field in struct.get_fields()] for field_name in constraint_fields):
+                self.warnings.append(f"Constraint on {struct.name} cannot be expressed in Rust, and is not checked")
+                continue
+            processed_constraints.append((constraint, constraint_fields))
         #traits need to be added up here when using !derive (eg. Eq, Ord)
         self.output.append(f"\n// Structure and parser for {struct.name}\n")
         self.output.append("\n#[derive(Debug")
@@ -235,18 +337,18 @@ class RustFormatter(Formatter):
             elif trait == "Ordinal":
                 self.output.append(", Ord")
         self.output.append(")]\n")
-        self.output.extend(["pub struct ", camelcase(struct.name), " {\n"])
+        self.output.extend(["pub struct ", self.rust_type(struct.name), " {\n"])
         parser_functions = []
         field_names = []
         generator = self.closure_term_gen()
         for field in struct.get_fields():
             type_name = field.field_type.name if isinstance(field.field_type, ConstructableType) else "nothing"
-            self.output.append("    pub %s: %s,\n" % (field.field_name, camelcase(type_name)))
+            self.output.append("    pub %s: %s,\n" % (field.field_name, self.rust_type(type_name)))
             parser_functions.append("parse_{name}".format(name=type_name.lower()))
             field_names.append(f"{field.field_name}")
         self.output.append("}\n")
-        self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context) {{\n".format(fname=struct.name.replace(" ", "_").replace("-", "_").lower(),typename=camelcase(struct.name)))
-        self.output += self.format_struct_field(0, camelcase(struct.name), field_names, parser_functions, processed_constraints)
+        self.output.append("\npub fn parse_{fname}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {typename}>, &'a mut Context) {{\n".format(fname=struct.name.replace(" ", "_").replace("-", "_").lower(),typename=self.rust_type(struct.name)))
+        self.output += self.format_struct_fields(camelcase(struct.name), field_names, parser_functions, processed_constraints)
         self.output.append("}\n")
         self.struct_field_signatures = {}
 
@@ -256,14 +358,14 @@ class RustFormatter(Formatter):
         if array.length is None:
             closure_terms = self.closure_term_gen()
             self.output.append("#[derive(Debug)]")
-            self.output.append("\nstruct %s(Vec<%s" % (camelcase(array.name), camelcase(element_type_name)))
+            self.output.append("\nstruct %s(Vec<%s" % (self.rust_type(array.name), self.rust_type(element_type_name)))
             if isinstance(array.element_type, BitString):
                 self.output.append("(u%d)" % self.assign_int_size(self.expr_traversal.dfs_expression(array.element_type.size)))
             self.output.append(">);")
             self.output.append("\nfn parse_{fname}(input: (&[u8], usize)) -> nom::IResult<(&[u8], usize), {typename}>{{\n    // TODO: implement\n    unimplemented!()\n}}".format(fname=array.name.replace(" ", "_").replace("-", "_").lower(), typename=camelcase(array.name)))
         else:
             self.output.append("#[derive(Debug)]")
-            self.output.append("\nstruct %s([%s" % (camelcase(array.name), camelcase(element_type_name)))
+            self.output.append("\nstruct %s([%s" % (self.rust_type(array.name), self.rust_type(element_type_name)))
             if isinstance(array.element_type, BitString):
                 self.output.append("(u%d)" % self.assign_int_size(self.expr_traversal.dfs_expression(array.element_type.size)))
             self.output.append("; %s]);" % self.expr_traversal.dfs_expression(array.length))
@@ -312,45 +414,114 @@ class RustFormatter(Formatter):
         for i in range(len(ascii_letters)):
             yield ascii_letters[i]
 
-    def format_pdu_variants(self, index: int, struct_name: str, field_names: List[str], parser_func_names: List[str]):
-        indentation = "    "*(index+1) + "    "*(index)
+    def format_pdu_variants(self, parser_func_names: List[str], indentation: str) -> List[str]:
+        """
+        Try each of the PDU parsers in turn, returning the first that succeeds, or the error from
+        the last if none do.
+        """
         generated_code = []
         con_str = "context"
-        if index > 0:
-            con_str = f"con{index-1}"
-        generated_code.append(f"{indentation}let {field_names[index]} = {parser_func_names[index]}(input, {con_str});\n")
-        generated_code.append(f"{indentation}match {field_names[index]} {{\n")
-        if index+1 == len(field_names):
-            generated_code.append(f"{indentation}    (nom::IResult::Ok((i, o)), con{index}) => (nom::IResult::Ok((i, o)), con{index}),\n")
-            generated_code.append(f"{indentation}    (nom::IResult::Err(e), con{index}) => (nom::IResult::Err(e), con{index})\n")
-            generated_code.append(f"{indentation}}}\n")
-        else:
-            generated_code.append(f"{indentation}    (nom::IResult::Ok((i, o)), con{index}) => (nom::IResult::Ok((i, o)), con{index}),\n")
-            generated_code.append(f"{indentation}    (nom::IResult::Err(_e), con{index}) => {{\n")
-            generated_code = generated_code + self.format_pdu_variants(index+1, struct_name, field_names, parser_func_names)
-            generated_code.append(f"{indentation}    }}\n")
-            generated_code.append(f"{indentation}}}\n")
+        for index, parser_func_name in enumerate(parser_func_names[:-1]):
+            generated_code.append(f"{indentation}let con{index} = match {parser_func_name}(input, {con_str}) {{\n")
+            generated_code.append(f"{indentation}    (nom::IResult::Ok((i, o)), con) => return (nom::IResult::Ok((i, o)), con),\n")
+            generated_code.append(f"{indentation}    (nom::IResult::Err(_e), con) => con\n")
+            generated_code.append(f"{indentation}}};\n")
+            con_str = f"con{index}"
+        generated_code.append(f"{indentation}{parser_func_names[-1]}(input, {con_str})\n")
         return generated_code
 
+    def constant_field_value(self, constraint: Expression) -> Optional[Tuple[str, int]]:
+        """
+        If the constraint requires a field of the structure to equal a constant number, the name
+        of the field and its value.
+        """
+        if not isinstance(constraint, MethodInvocationExpression) or constraint.method_name != "eq" or len(constraint.arg_exprs) != 1:
+            return None
+        operands = [constraint.target, constraint.arg_exprs[0].arg_value]
+        for field_expr, value_expr in [operands, operands[::-1]]:
+            if isinstance(field_expr, MethodInvocationExpression) and field_expr.method_name == "to_number":
+                field_expr = field_expr.target
+            if isinstance(field_expr, FieldAccessExpression) and isinstance(field_expr.target, SelfExpression) and \
+               isinstance(value_expr, ConstantExpression) and value_expr.constant_type == Number():
+                return (field_expr.field_name, int(value_expr.constant_value))
+        return None
+
+    def find_pdu_discriminator(self, protocol: Protocol) -> Optional[Tuple[int, int, Dict[int, List[str]]]]:
+        """
+        Find a field that every PDU has, at the same static offset and with the same fixed width,
+        and constrains to equal a constant. The PDU can then be chosen by the value of that field
+        before any of them are parsed. Returns the offset and width of the field, in bits, and the
+        names of the PDUs with each value, or None if there is no such field.
+        """
+        pdus = [protocol.get_type(pdu_name) for pdu_name in protocol.get_pdu_names()]
+        if len(pdus) < 2 or not all(isinstance(pdu, Struct) for pdu in pdus):
+            return None
+        values : Dict[str, Dict[str, int]] = {}
+        for pdu in pdus:
+            values[pdu.name] = {}
+            for constraint in cast(Struct, pdu).constraints:
+                field_value = self.constant_field_value(constraint)
+                if field_value is not None:
+                    values[pdu.name][field_value[0]] = field_value[1]
+        for field in cast(Struct, pdus[0]).get_fields():
+            field_layouts = [self.layouts[pdu.name].field(field.field_name) for pdu in pdus
+                             if field.field_name in values[pdu.name] and isinstance(cast(Struct, pdu).field(field.field_name).field_type, BitString)]
+            if len(field_layouts) != len(pdus):
+                continue
+            offset = field_layouts[0].offset
+            width  = field_layouts[0].fixed_size
+            if offset is None or width is None or offset + width > 128:
+                continue
+            if any(field_layout.offset != offset or field_layout.fixed_size != width or field_layout.is_present is not True for field_layout in field_layouts):
+                continue
+            if any(not 0 <= values[pdu.name][field.field_name] < 2**width for pdu in pdus):
+                continue
+            pdus_by_value : Dict[int, List[str]] = {}
+            for pdu in pdus:
+                pdus_by_value.setdefault(values[pdu.name][field.field_name], []).append(pdu.name)
+            return (offset, width, pdus_by_value)
+        return None
+
     def format_protocol(self, protocol: Protocol):
         self.output.append("\n// Parse incoming PDUs\n")
+        pdu_type = "PDU<'a>" if any(pdu_name in self.lifetimes for pdu_name in protocol.get_pdu_names()) else "PDU"
         self.output.append("\n#[derive(Debug)]")
-        self.output.append("\npub enum PDU {\n")
-        self.output.append(",\n".join([f"\t{camelcase(pdu_name)}({camelcase(pdu_name)})" for pdu_name in protocol.get_pdu_names()]))
+        self.output.append(f"\npub enum {pdu_type} {{\n")
+        self.output.append(",\n".join([f"\t{camelcase(pdu_name)}({self.rust_type(pdu_name)})" for pdu_name in protocol.get_pdu_names()]))
         self.output.append("\n}\n\n")
         parse_funcs = []
-        variant_names = []
         for pdu_name in protocol.get_pdu_names():
             type_name = camelcase(pdu_name)
             parse_func_name = pdu_name.replace(" ", "_").replace("-", "_").lower()
             parse_funcs.append(f"parse_pdu_{parse_func_name}")
-            variant_names.append(f"pdu_{parse_func_name}")
-            self.output.append(f"pub fn parse_pdu_{parse_func_name}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), PDU>, &'a mut Context) {{\n")
+            self.output.append(f"pub fn parse_pdu_{parse_func_name}<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {pdu_type}>, &'a mut Context) {{\n")
             self.output.append(f"\tmatch parse_{parse_func_name}(input, context) {{\n")
             self.output.append(f"\t\t(nom::IResult::Ok((([], 0), o)), con) => (nom::IResult::Ok(((&[], 0), PDU::{type_name}(o))), con),\n")
             self.output.append(f"\t\t(nom::IResult::Ok(((i, c), _o)), con) => (nom::IResult::Err(nom::Err::Error(((i, c), nom::error::ErrorKind::NonEmpty))), con),\n")
             self.output.append(f"\t\t(nom::IResult::Err(e), con) => (nom::IResult::Err(e), con)\n")
             self.output.append("\t}\n}\n\n")
-        self.output.append("pub fn parse_pdu<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), PDU>, &'a mut Context) {\n")
-        self.output += self.format_pdu_variants(0, "bleh", variant_names, parse_funcs)
+        self.output.append(f"pub fn parse_pdu<'a>(input: (&'a [u8], usize), context: &'a mut Context) -> (nom::IResult<(&'a [u8], usize), {pdu_type}>, &'a mut Context) {{\n")
+        discriminator = self.find_pdu_discriminator(protocol)
+        if discriminator is None:
+            self.output += self.format_pdu_variants(parse_funcs, "    ")
+        else:
+            # Read the field that identifies the PDU, and the bits before it, and dispatch on its
+            # value; only PDUs that share a value are tried in turn
+            offset, width, pdus_by_value = discriminator
+            value_str = "d" if offset == 0 else f"d & {hex(2**width - 1)}"
+            self.output.append(f"    let discriminator: nom::IResult<(&'a [u8], usize), u{self.assign_int_size(offset + width)}> = take({offset + width}_usize)(input);\n")
+            self.output.append(f"    match discriminator {{\n")
+            self.output.append(f"        nom::IResult::Ok((_, d)) => match {value_str} {{\n")
+            for value, pdu_names in pdus_by_value.items():
+                value_parse_funcs = [parse_funcs[protocol.get_pdu_names().index(pdu_name)] for pdu_name in pdu_names]
+                if len(value_parse_funcs) == 1:
+                    self.output.append(f"            {value} => {value_parse_funcs[0]}(input, context),\n")
+                else:
+                    self.output.append(f"            {value} => {{\n")
+                    self.output += self.format_pdu_variants(value_parse_funcs, "                ")
+                    self.output.append(f"            }}\n")
+            self.output.append(f"            _ => (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Switch))), context)\n")
+            self.output.append(f"        }},\n")
+            self.output.append(f"        nom::IResult::Err(e) => (nom::IResult::Err(e), context)\n")
+            self.output.append(f"    }}\n")
         self.output.append("}")
@@ -0,0 +1,129 @@
+# =================================================================================================
+# Copyright (C) 2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import hashlib
+import os
+import parsley
+
+from pathlib       import Path
+from typing        import Any, Dict, Optional
+from ometa.grammar import OMeta
+from ometa.runtime import OMetaBase, writePython
+from ometa.builder import moduleFromGrammar
+
+# Compiling a grammar with parsley.makeGrammar() first parses the grammar and generates the
+# Python source of a parser class, which is by far the most expensive step, then compiles that
+# source into a module. The generated source depends only on the grammar text and the version of
+# parsley, so it is cached on disk, keyed by a hash of both, and the compiled module is cached
+# in-process. Bindings are applied per call, since parsers bind their own instance methods.
+
+GRAMMAR_CACHE_ENV = "NPT_GRAMMAR_CACHE"
+
+_grammar_modules : Dict[str, Any] = {}
+
+
+def grammar_cache_dir() -> Path:
+    """
+    Returns the directory holding cached grammars. This is $NPT_GRAMMAR_CACHE if set, otherwise
+    npt/grammars within the user's cache directory.
+    """
+    cache_dir = os.environ.get(GRAMMAR_CACHE_ENV)
+    if cache_dir:
+        return Path(cache_dir)
+    xdg_cache = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache:
+        return Path(xdg_cache) / "npt" / "grammars"
+    return Path.home() / ".cache" / "npt" / "grammars"
+
+
+def grammar_key(grammar: str, name: str = "Grammar") -> str:
+    key = hashlib.sha256()
+    key.update(parsley.__version__.encode("utf-8"))
+    key.update(b"\0")
+    key.update(name.encode("utf-8"))
+    key.update(b"\0")
+    key.update(grammar.encode("utf-8"))
+    return key.hexdigest()
+
+
+def _generate_source(grammar: str, name: str) -> str:
+    tree = OMeta(grammar).parseGrammar(name)
+    return writePython(tree, grammar)
+
+
+def _load_source(grammar: str, name: str, key: str, cache_dir: Path) -> str:
+    cache_file = cache_dir / f"{key}.py"
+    try:
+        with open(cache_file, "r") as cached:
+            return cached.read()
+    except OSError:
+        pass
+    source = _generate_source(grammar, name)
+    # The cache is an optimisation only: failure to write it must not stop the grammar being used.
+    # Write to a temporary file and rename, so concurrent processes never see a partial file.
+    try:
+        cache_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
+        tmp_file = cache_dir / f"{key}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as tmp:
+            tmp.write(source)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return source
+
+
+def make_grammar(grammar: str, bindings: Dict[str, Any], name: str = "Grammar", cache_dir: Optional[Path] = None) -> Any:
+    """
+    Equivalent to parsley.makeGrammar(grammar, bindings, name), but the compiled grammar is cached
+    in-process and on disk.
+
+    Parameters:
+        grammar   - the text of the grammar
+        bindings  - a mapping of names to objects, made available to the grammar rules
+        name      - the name of the generated parser class
+        cache_dir - the on-disk cache directory; defaults to grammar_cache_dir()
+    """
+    key = grammar_key(grammar, name)
+    module = _grammar_modules.get(key)
+    if module is None:
+        source = _load_source(grammar, name, key, cache_dir if cache_dir is not None else grammar_cache_dir())
+        module = moduleFromGrammar(source, name, f"pymeta_grammar__{name}_{key[:16]}", f"/pymeta_generated_code/{key}.py")
+        _grammar_modules[key] = module
+    return parsley.wrapGrammar(module.createParserClass(OMetaBase, bindings))
+
+
+def load_grammar(grammar_file: Path, bindings: Dict[str, Any], name: str = "Grammar") -> Any:
+    """
+    Read a grammar file and compile it using make_grammar()
+    """
+    with open(grammar_file, "r") as grammar:
+        return make_grammar(grammar.read(), bindings, name)
+
+# vim: set tw=0 ai:
@@ -0,0 +1,288 @@
+# =================================================================================================
+# Copyright (C) 2018-2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+"""
+Static layout analysis of the types of a protocol.
+
+The size of a type is an expression, that may depend on the values of other fields of the
+structure containing it. Where that expression is a constant, or can be bounded, the sizes of
+the types, and the offsets of the fields within structures, are known when the code is generated.
+The layout of a type gives its minimum and maximum sizes in bits, a number of bits that its
+size is always a multiple of, and, for a structure, the layout of each of its fields: a field
+has a static offset if every field before it is always present and has a fixed size, and is
+aligned if it always starts on a byte boundary, even if its offset is not static.
+
+Formatters can use this to check the length of the input once, rather than per field, to read
+fields at fixed offsets, and to reject undersized PDUs before parsing any of their fields.
+"""
+
+from dataclasses  import dataclass, field
+from math         import gcd
+from npt.protocol import *
+from typing       import Dict, List, Optional, Set, Tuple
+
+# The bounds of a number: a minimum, and a maximum, or None if it is unbounded
+Bounds = Tuple[int, Optional[int]]
+
+
+@dataclass
+class FieldLayout:
+    field_name : str
+    offset     : Optional[int]
+    min_size   : int
+    max_size   : Optional[int]
+    is_present : Optional[bool]
+    size_multiple : int
+    aligned       : bool
+
+    @property
+    def fixed_size(self) -> Optional[int]:
+        return self.min_size if self.min_size == self.max_size else None
+
+    @property
+    def byte_aligned(self) -> bool:
+        """
+        True if this field always starts on a byte boundary, and is a whole number of bytes long.
+        """
+        return self.aligned and self.size_multiple % 8 == 0
+
+
+@dataclass
+class TypeLayout:
+    min_size : int
+    max_size : Optional[int]
+    size_multiple : int = 1
+    fields   : List[FieldLayout] = field(default_factory=list)
+
+    @property
+    def fixed_size(self) -> Optional[int]:
+        return self.min_size if self.min_size == self.max_size else None
+
+    def field(self, field_name: str) -> FieldLayout:
+        for field_layout in self.fields:
+            if field_layout.field_name == field_name:
+                return field_layout
+        raise ProtocolTypeError(f"Layout has no field named {field_name}")
+
+
+_unknown = TypeLayout(0, None)
+
+def _add(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    return a + b if a is not None and b is not None else None
+
+
+class LayoutAnalyser:
+    """
+    Computes the layouts of types, remembering the layout of each type it has analysed.
+    """
+    layouts : Dict[int, TypeLayout]
+    pending : Set[int]
+
+    def __init__(self) -> None:
+        self.layouts = {}
+        self.pending = set()
+
+    def layout(self, pt: ProtocolType) -> TypeLayout:
+        if id(pt) in self.layouts:
+            return self.layouts[id(pt)]
+        if id(pt) in self.pending:
+            # A recursive type has no static layout
+            return _unknown
+        self.pending.add(id(pt))
+        result = self.analyse(pt)
+        self.pending.remove(id(pt))
+        self.layouts[id(pt)] = result
+        return result
+
+    def analyse(self, pt: ProtocolType) -> TypeLayout:
+        if isinstance(pt, Struct):
+            return self.analyse_struct(pt)
+        elif isinstance(pt, Array):
+            return self.analyse_array(pt)
+        elif isinstance(pt, Option):
+            reference = self.layout(pt.reference_type)
+            return TypeLayout(0, reference.max_size, reference.size_multiple)
+        elif isinstance(pt, Enum):
+            if len(pt.variants) == 0:
+                return _unknown
+            variants = [self.layout(variant) for variant in pt.variants]
+            max_sizes = [variant.max_size for variant in variants]
+            multiple  = 0
+            for variant in variants:
+                multiple = gcd(multiple, variant.size_multiple)
+            return TypeLayout(min(variant.min_size for variant in variants), None if None in max_sizes else max(cast(List[int], max_sizes)), multiple)
+        elif isinstance(pt, RepresentableType) and pt.size is not None:
+            return self.size_layout(pt.size, None)
+        return _unknown
+
+    def size_layout(self, size: Expression, containing_type: Optional[ProtocolType]) -> TypeLayout:
+        bounds   = self.bounds(size, containing_type)
+        multiple = self.multiple(size, containing_type)
+        if bounds is None:
+            return TypeLayout(0, None, multiple)
+        return TypeLayout(max(bounds[0], 0), bounds[1], multiple)
+
+    def analyse_array(self, pt: Array, containing_type: Optional[ProtocolType] = None) -> TypeLayout:
+        element = self.layout(pt.element_type)
+        length  = self.bounds(pt.length, containing_type) if pt.length is not None else None
+        # Each element is a multiple of the size of the elements, and if the elements are of a
+        # fixed size, so is the array as a whole, times a multiple of the length
+        multiple = element.size_multiple
+        if element.fixed_size is not None and pt.length is not None:
+            multiple = element.fixed_size * self.multiple(pt.length, containing_type)
+        if length is None:
+            return TypeLayout(0, None, multiple)
+        return TypeLayout(element.min_size * length[0], None if element.max_size is None or length[1] is None else element.max_size * length[1], multiple)
+
+    def field_type_layout(self, field_type: RepresentableType, containing_type: Struct) -> TypeLayout:
+        """
+        The layout of the type of a field. The sizes of bitstrings and the lengths of arrays may
+        refer to other fields of the structure, so are bounded within it.
+        """
+        if isinstance(field_type, BitString) and field_type.size is not None:
+            return self.size_layout(field_type.size, containing_type)
+        elif isinstance(field_type, Array):
+            return self.analyse_array(field_type, containing_type)
+        return self.layout(field_type)
+
+    def analyse_struct(self, pt: Struct) -> TypeLayout:
+        fields   : List[FieldLayout] = []
+        offset   : Optional[int] = 0
+        min_size : int = 0
+        max_size : Optional[int] = 0
+        multiple : int = 0
+        # The offset of the current field modulo 8, if known
+        residue  : Optional[int] = 0
+        for struct_field in pt.get_fields():
+            type_layout = self.field_type_layout(struct_field.field_type, pt)
+
+            is_present = struct_field.is_present
+            present    = is_present.constant_value if isinstance(is_present, ConstantExpression) and is_present.constant_type == Boolean() else None
+            field_min  = type_layout.min_size if present is True else 0
+            field_max  = type_layout.max_size if present is not False else 0
+            field_multiple = type_layout.size_multiple if present is not False else 0
+            fields.append(FieldLayout(struct_field.field_name, offset, field_min, field_max, present, field_multiple, residue == 0))
+            if field_min != field_max:
+                offset = None
+            offset   = _add(offset, field_max)
+            min_size = min_size + field_min
+            max_size = _add(max_size, field_max)
+            multiple = gcd(multiple, field_multiple)
+            if residue is not None and field_multiple % 8 != 0:
+                residue = (residue + field_min) % 8 if field_min == field_max else None
+        return TypeLayout(min_size, max_size, multiple, fields)
+
+    def multiple(self, expr: Expression, containing_type: Optional[ProtocolType]) -> int:
+        """
+        A number that the value of a number valued expression, evaluated within the given
+        containing type, is always a multiple of. This is 1 if nothing is known, and 0 if the value
+        is always 0.
+        """
+        if isinstance(expr, ConstantExpression):
+            if expr.constant_type == Number() and isinstance(expr.constant_value, int):
+                return abs(expr.constant_value)
+            return 1
+        elif isinstance(expr, IfElseExpression):
+            return gcd(self.multiple(expr.if_true, containing_type), self.multiple(expr.if_false, containing_type))
+        elif not isinstance(expr, MethodInvocationExpression):
+            return 1
+
+        if len(expr.arg_exprs) == 0 and expr.method_name == "size":
+            try:
+                return self.layout(expr.target.result_type(containing_type)).size_multiple
+            except ProtocolTypeError:
+                return 1
+        if len(expr.arg_exprs) != 1:
+            return 1
+        target = self.multiple(expr.target, containing_type)
+        other  = self.multiple(expr.arg_exprs[0].arg_value, containing_type)
+        if expr.method_name in ["plus", "minus"]:
+            return gcd(target, other)
+        elif expr.method_name in ["multiply", "mul"]:
+            return target * other
+        return 1
+
+    def bounds(self, expr: Expression, containing_type: Optional[ProtocolType]) -> Optional[Bounds]:
+        """
+        Bounds on the value of a non-negative number valued expression, evaluated within the given
+        containing type, or None if it cannot be bounded.
+        """
+        if isinstance(expr, ConstantExpression):
+            if expr.constant_type == Number() and isinstance(expr.constant_value, int) and expr.constant_value >= 0:
+                return (expr.constant_value, expr.constant_value)
+            return None
+        elif isinstance(expr, IfElseExpression):
+            if_true  = self.bounds(expr.if_true,  containing_type)
+            if_false = self.bounds(expr.if_false, containing_type)
+            if if_true is None or if_false is None:
+                return None
+            return (min(if_true[0], if_false[0]), None if if_true[1] is None or if_false[1] is None else max(if_true[1], if_false[1]))
+        elif not isinstance(expr, MethodInvocationExpression):
+            return None
+
+        if len(expr.arg_exprs) == 0:
+            try:
+                target_type = expr.target.result_type(containing_type)
+            except ProtocolTypeError:
+                return None
+            if expr.method_name == "size":
+                size = self.layout(target_type)
+                return (size.min_size, size.max_size)
+            if expr.method_name == "to_number" and isinstance(target_type, BitString):
+                width = self.layout(target_type).max_size
+                return (0, None if width is None else 2 ** width - 1)
+            return None
+        if len(expr.arg_exprs) != 1:
+            return None
+
+        target = self.bounds(expr.target, containing_type)
+        other  = self.bounds(expr.arg_exprs[0].arg_value, containing_type)
+        if target is None or other is None:
+            return None
+        if expr.method_name == "plus":
+            return (target[0] + other[0], _add(target[1], other[1]))
+        elif expr.method_name in ["multiply", "mul"]:
+            return (target[0] * other[0], None if target[1] is None or other[1] is None else target[1] * other[1])
+        elif expr.method_name == "minus":
+            # A negative size is malformed, so the lower bound is at least zero
+            return (0 if other[1] is None else max(target[0] - other[1], 0), None if target[1] is None else target[1] - other[0])
+        elif expr.method_name == "divide":
+            return (0 if other[1] is None or other[1] == 0 else target[0] // other[1], None if target[1] is None or other[0] == 0 else target[1] // other[0])
+        return None
+
+
+def analyse_layout(protocol: Protocol) -> Dict[str, TypeLayout]:
+    """
+    The layout of each of the types of the protocol, by type name, including its PDUs.
+    """
+    analyser = LayoutAnalyser()
+    return {type_name: analyser.layout(protocol.get_type(type_name)) for type_name in protocol.get_type_names()}
+
+# vim: set tw=0 ai:
@@ -37,7 +37,7 @@ import npt.rfc as rfc
 class Parser(abc.ABC):
 
     @abc.abstractmethod
-    def build_protocol(self, proto: Optional[Protocol], input: Union[str, rfc.RFC], name: str=None) -> Protocol:
+    def build_protocol(self, proto: Optional[Protocol], input: Union[str, rfc.RFC, rfc.Middle], name: str=None) -> Protocol:
         """
         Build a Protocol object for the protocol represented by the input string.
 
@@ -45,7 +45,8 @@ class Parser(abc.ABC):
             proto -- A protocol object. If specified, the input parser should augment this Protocol
                      rather than creating a new Protocol. This allows input parsers to be chained
                      together to define a single Protocol.
-            input -- A string representing a protocol definition or RFC DOM object
+            input -- A string representing a protocol definition, an RFC DOM object, or the
+                     middle of an RFC DOM object
 
         Returns:
             A Protocol object
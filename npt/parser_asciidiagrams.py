@@ -29,13 +29,16 @@
 # =================================================================================================
 
 import string
-import parsley
 
 import npt.rfc as rfc
 import npt.protocol
 
-from npt.parser import Parser
-from typing     import cast, Optional, Union, List
+from npt.parser        import Parser
+from npt.grammar_cache import load_grammar
+from pathlib           import Path
+from typing            import cast, Optional, Union, List
+
+GRAMMAR_FILE = Path(__file__).parent / "grammar_asciidiagrams.txt"
 
 def stem(phrase):
     if phrase[-1] == 's':
@@ -54,6 +57,31 @@ def valid_type_name_convertor(name):
         name = "T" + name
     return name.capitalize().replace(" ", "_")
 
+# Each of the paragraph-level grammar rules can only match text containing its anchor phrase, so
+# paragraphs are classified by these phrases before any rule is tried: most paragraphs in a
+# document contain none, and never need to be parsed. The phrases are literal text in the grammar
+# rules. Where the grammar allows arbitrary whitespace between the words of a phrase ("ws"), the
+# phrase is matched against the paragraph with all whitespace removed.
+RULE_ANCHORS = {
+    "preamble"            : [("isformattedasfollows:", True)],
+    "function"            : [("function is defined as:", False)],
+    "enum"                : [("is one of: ", False), ("is either ", False)],
+    "serialised_to_func"  : [("is serialised to ", False)],
+    "parsed_from_func"    : [("is parsed from ", False)],
+    "protocol_definition" : [("Thisdocumentdescribesthe", True)],
+}
+
+def candidate_rules(text: str) -> List[str]:
+    """
+    Returns the names of the paragraph-level grammar rules that could match the given text.
+    """
+    compact_text = "".join(text.split())
+    rules = []
+    for rule, anchors in RULE_ANCHORS.items():
+        if any(anchor in (compact_text if compact else text) for anchor, compact in anchors):
+            rules.append(rule)
+    return rules
+
 class AsciiDiagramsParser(Parser):
     def __init__(self) -> None:
         super().__init__()
@@ -111,89 +139,101 @@ class AsciiDiagramsParser(Parser):
         self.functions = {}
         self.serialise_to = {}
         self.parse_from = {}
-        with open("npt/grammar_asciidiagrams.txt") as grammarFile:
-            return parsley.makeGrammar(grammarFile.read(),
-                                   {
-                                     "ascii_uppercase"         : string.ascii_uppercase,
-                                     "ascii_lowercase"         : string.ascii_lowercase,
-                                     "ascii_letters"           : string.ascii_letters,
-                                     "punctuation"             : string.punctuation,
-                                     "new_constant"            : self.new_constant,
-                                     "build_tree"              : self.build_tree,
-                                     "new_fieldaccess"         : self.new_fieldaccess,
-                                     "new_methodinvocation"    : self.new_methodinvocation,
-                                     "new_this"                : self.new_this,
-                                     "new_field"               : self.new_field,
-                                     "proc_diagram_fields"     : self.proc_diagram_fields,
-                                     "stem"                    : stem,
-                                     "protocol"                : self.proto
-                                   })
+        return load_grammar(GRAMMAR_FILE,
+                            {
+                              "ascii_uppercase"         : string.ascii_uppercase,
+                              "ascii_lowercase"         : string.ascii_lowercase,
+                              "ascii_letters"           : string.ascii_letters,
+                              "punctuation"             : string.punctuation,
+                              "new_constant"            : self.new_constant,
+                              "build_tree"              : self.build_tree,
+                              "new_fieldaccess"         : self.new_fieldaccess,
+                              "new_methodinvocation"    : self.new_methodinvocation,
+                              "new_this"                : self.new_this,
+                              "new_field"               : self.new_field,
+                              "proc_diagram_fields"     : self.proc_diagram_fields,
+                              "stem"                    : stem,
+                              "protocol"                : self.proto
+                            })
 
     def process_section(self, section : rfc.Section, parser, structs):
         for i in range(len(section.content)):
             t = section.content[i]
             if isinstance(t, rfc.T):
                 for j in range(len(t.content)):
-                    inner_t = cast(rfc.Text, t.content[j])
-                    try:
-                        pdu_name = parser(inner_t.content.strip()).preamble()
-                        artwork = cast(rfc.Artwork, section.content[i+1]).content
-                        artwork_fields = parser(cast(rfc.Text, artwork).content.strip()).diagram()
-                        where = section.content[i+2]
-                        desc_list = cast(rfc.DL, section.content[i+3])
-                        fields = {}
-                        name_map = {}
-                        for k in range(len(desc_list.content)):
-                            title, desc = desc_list.content[k]
-                            field = parser(cast(rfc.Text, title.content[0]).content.strip()).field_title()
-                            try:
-                                context_field = parser(cast(rfc.Text, desc.content[-1]).content.strip()).context_use()
-                            except:
-                                context_field = None
-                            field["context_field"] = context_field
-                            if field["short_label"] is not None:
-                                name_map[field["short_label"]] = field["full_label"]
-                            fields[field["full_label"]] = field
-
-                        self.structs[valid_type_name_convertor(pdu_name)] = {}
-                        self.structs[valid_type_name_convertor(pdu_name)]["name_map"] = name_map
-                        self.structs[valid_type_name_convertor(pdu_name)]["fields"] = fields
-                    except Exception as e:
-                        pass
-
-                    try:
-                        function_name = parser(inner_t.content.strip()).function()
-                        function_artwork = cast(rfc.Artwork, section.content[i+1])
-                        function_text = cast(rfc.Text, function_artwork.content)
-                        function_def = parser(function_text.content.strip()).function_signature()
-                        self.functions[valid_field_name_convertor(function_name)] = function_def
-                    except Exception as e:
-                        pass
-
-                    try:
-                        enum_name, variants = parser(inner_t.content.strip()).enum()
-                        self.enums[valid_type_name_convertor(enum_name)] = [valid_type_name_convertor(variant) for variant in variants]
-                    except Exception as e:
-                        pass
-
-                    try:
-                        from_type, to_type, func_name = parser(inner_t.content.strip()).serialised_to_func()
-                        self.serialise_to[valid_type_name_convertor(from_type)] = (valid_type_name_convertor(to_type), valid_field_name_convertor(func_name))
-                    except Exception as e:
-                        pass
-
-                    try:
-                        from_type, to_type, func_name = parser(inner_t.content.strip()).parsed_from_func()
-                        self.parse_from[valid_type_name_convertor(from_type)] = (valid_type_name_convertor(to_type), valid_field_name_convertor(func_name))
-                    except Exception as e:
-                        pass
-
-                    try:
-                        protocol_name, pdus = parser(inner_t.content.strip()).protocol_definition()
-                        self.protocol_name = protocol_name
-                        self.pdus = [valid_type_name_convertor(pdu) for pdu in pdus]
-                    except Exception as e:
+                    inner_t = t.content[j]
+                    if not isinstance(inner_t, rfc.Text):
+                        continue
+                    text = inner_t.content.strip()
+                    rules = candidate_rules(text)
+                    if len(rules) == 0:
                         continue
+
+                    if "preamble" in rules:
+                        try:
+                            pdu_name = parser(text).preamble()
+                            artwork = cast(rfc.Artwork, section.content[i+1]).content
+                            artwork_fields = parser(cast(rfc.Text, artwork).content.strip()).diagram()
+                            where = section.content[i+2]
+                            desc_list = cast(rfc.DL, section.content[i+3])
+                            fields = {}
+                            name_map = {}
+                            for k in range(len(desc_list.content)):
+                                title, desc = desc_list.content[k]
+                                field = parser(cast(rfc.Text, title.content[0]).content.strip()).field_title()
+                                try:
+                                    context_field = parser(cast(rfc.Text, desc.content[-1]).content.strip()).context_use()
+                                except:
+                                    context_field = None
+                                field["context_field"] = context_field
+                                if field["short_label"] is not None:
+                                    name_map[field["short_label"]] = field["full_label"]
+                                fields[field["full_label"]] = field
+
+                            self.structs[valid_type_name_convertor(pdu_name)] = {}
+                            self.structs[valid_type_name_convertor(pdu_name)]["name_map"] = name_map
+                            self.structs[valid_type_name_convertor(pdu_name)]["fields"] = fields
+                        except Exception as e:
+                            pass
+
+                    if "function" in rules:
+                        try:
+                            function_name = parser(text).function()
+                            function_artwork = cast(rfc.Artwork, section.content[i+1])
+                            function_text = cast(rfc.Text, function_artwork.content)
+                            function_def = parser(function_text.content.strip()).function_signature()
+                            self.functions[valid_field_name_convertor(function_name)] = function_def
+                        except Exception as e:
+                            pass
+
+                    if "enum" in rules:
+                        try:
+                            enum_name, variants = parser(text).enum()
+                            self.enums[valid_type_name_convertor(enum_name)] = [valid_type_name_convertor(variant) for variant in variants]
+                        except Exception as e:
+                            pass
+
+                    if "serialised_to_func" in rules:
+                        try:
+                            from_type, to_type, func_name = parser(text).serialised_to_func()
+                            self.serialise_to[valid_type_name_convertor(from_type)] = (valid_type_name_convertor(to_type), valid_field_name_convertor(func_name))
+                        except Exception as e:
+                            pass
+
+                    if "parsed_from_func" in rules:
+                        try:
+                            from_type, to_type, func_name = parser(text).parsed_from_func()
+                            self.parse_from[valid_type_name_convertor(from_type)] = (valid_type_name_convertor(to_type), valid_field_name_convertor(func_name))
+                        except Exception as e:
+                            pass
+
+                    if "protocol_definition" in rules:
+                        try:
+                            protocol_name, pdus = parser(text).protocol_definition()
+                            self.protocol_name = protocol_name
+                            self.pdus = [valid_type_name_convertor(pdu) for pdu in pdus]
+                        except Exception as e:
+                            continue
         if section.sections is not None:
             for subsection in section.sections:
                 self.process_section(subsection, parser, structs)
@@ -252,8 +292,7 @@ class AsciiDiagramsParser(Parser):
                 elif size_expr is not None and field["units"] in ["byte", "bytes"]:
                     size_expr = self.build_expr(("method", size_expr, "multiply", ("const", "Number", 8)), struct_name)
                 if type(size_expr) is npt.protocol.ConstantExpression:
-                    field_type = npt.protocol.BitString(name, size_expr)
-                    self.proto.add_type(field_type)
+                    field_type = cast(npt.protocol.BitString, self.proto.add_type(npt.protocol.BitString(name, size_expr)))
                 else:
                     field_type = npt.protocol.BitString(name, size_expr)
                     self.proto.add_type(field_type)
@@ -315,7 +354,7 @@ class AsciiDiagramsParser(Parser):
         else:
             raise Exception("Unknown type: %s" % (type_name))
 
-    def build_protocol(self, proto: Optional[npt.protocol.Protocol], input: Union[str, rfc.RFC], name: str=None) -> npt.protocol.Protocol:
+    def build_protocol(self, proto: Optional[npt.protocol.Protocol], input: Union[str, rfc.RFC, rfc.Middle], name: str=None) -> npt.protocol.Protocol:
         # if a Protocol hasn't been passed in, then instantiate one
         if proto is None:
             self.proto = npt.protocol.Protocol()
@@ -329,7 +368,9 @@ class AsciiDiagramsParser(Parser):
         structs : List[npt.protocol.Struct]= []
 
         if isinstance(input, rfc.RFC):
-            for section in input.middle.content:
+            input = input.middle
+        if isinstance(input, rfc.Middle):
+            for section in input.content:
                 self.process_section(section, parser, structs)
 
         for pdu_name in self.pdus:
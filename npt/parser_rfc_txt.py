@@ -28,39 +28,84 @@
 # SPDX-License-Identifier: BSD-2-Clause
 # =================================================================================================
 
+import re
 import sys
-import parsley
 import string
 
 import npt.rfc as rfc
 
-from typing import Dict, List
-
-def depaginate(lines):
-    depaginated_lines = []
-    for i in range(len(lines)):
-        line_no = i - (56 * int(i/56))
-        if line_no not in [53, 54, 55, 0, 1, 2]:
-            if line_no == 52 and i+8 < len(lines):
-                indent_prev = len(lines[i-1]) - len(lines[i-1].lstrip())
-                indent_next = len(lines[i+8]) - len(lines[i+8].lstrip())
-                if (indent_prev == indent_next):
-                    continue
-            depaginated_lines.append(lines[i])
-    return depaginated_lines
-
-def trim_blank_lines(lines):
-    trimmed_lines = []
-    started = False
-    for i in range(len(lines)):
-        if not started and lines[i] == "\n":
+from npt.grammar_cache import load_grammar
+from pathlib           import Path
+from typing            import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+GRAMMAR_FILE = Path(__file__).parent / "grammar_rfc.txt"
+
+# A page footer, such as "McQuistin, et al.   Expires 18 December 2020   [Page 1]"
+_page_footer = re.compile(r".*\[Page \d+\]\s*")
+
+def depaginate(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Remove the page breaks from a text RFC, lazily, given its lines.
+
+    A page break is found either from the page footer, which ends "[Page N]", or from a form
+    feed, and includes the blank lines before the footer, the form feed, the header line of the
+    next page, and the blank lines after that header. Each page break is replaced by a single
+    blank line.
+    """
+    blank_lines   = 0       # blank lines not yet known to be outside a page break
+    in_page_break = False   # in a page break, and before the header of the next page
+    after_header  = False   # in a page break, and after the header of the next page
+    for line in lines:
+        if line.startswith("\f"):
+            line = line[1:]
+            blank_lines   = 0
+            in_page_break = True
+            after_header  = False
+            if line.strip() == "":
+                continue
+        if line.strip() == "":
+            if in_page_break:
+                # The page has no header
+                in_page_break = False
+                after_header  = True
+            if not after_header:
+                blank_lines += 1
+            continue
+        if _page_footer.fullmatch(line) and not in_page_break:
+            blank_lines   = 0
+            in_page_break = True
+            after_header  = False
             continue
-        if i > 0 and lines[i] == "\n" and lines[i-1] == "\n":
+        if in_page_break:
+            # The first line after the footer or form feed is the header of the next page
+            in_page_break = False
+            after_header  = True
             continue
-        else:
-            trimmed_lines.append(lines[i])
-            started = True
-    return trimmed_lines
+        if after_header:
+            after_header = False
+            yield "\n"
+        for _ in range(blank_lines):
+            yield "\n"
+        blank_lines = 0
+        yield line
+    if in_page_break or after_header:
+        yield "\n"
+    for _ in range(blank_lines):
+        yield "\n"
+
+def trim_blank_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Remove the leading blank lines, and collapse each run of blank lines to a single blank line,
+    lazily.
+    """
+    started = False
+    prev    = None
+    for line in lines:
+        if line == "\n" and (not started or prev == "\n"):
+            continue
+        started = True
+        prev    = line
+        yield line
 
 def structure_subsections(sections):
     section_depths : Dict[int, List[rfc.Section]] = {}
@@ -84,25 +129,309 @@ def infer_toc(alpha:str, num:str):
     return 3
 
 def generate_parser(grammarFilename):
-    with open(grammarFilename) as grammarFile:
-        return parsley.makeGrammar(grammarFile.read(),
-                                   {
-                                     "ascii_uppercase"       : string.ascii_uppercase,
-                                     "ascii_lowercase"       : string.ascii_lowercase,
-                                     "ascii_letters"         : string.ascii_letters,
-                                     "punctuation"           : string.punctuation,
-                                     "rfc"                   : rfc,
-                                     "get_doc_series"        : get_doc_series,
-                                     "get_ipr_code"          : get_ipr_code,
-                                     "structure_subsections" : structure_subsections,
-                                     "infer_toc"             : infer_toc,
-                                   })
-
-def parse_rfc(rfcTxt):
-    rfcTxt = depaginate(rfcTxt)
-    rfcTxt = trim_blank_lines(rfcTxt)
-    parser = generate_parser("npt/grammar_rfc.txt")
-    rfc = parser("".join(rfcTxt)).rfc()
+    return load_grammar(grammarFilename,
+                        {
+                          "ascii_uppercase"       : string.ascii_uppercase,
+                          "ascii_lowercase"       : string.ascii_lowercase,
+                          "ascii_letters"         : string.ascii_letters,
+                          "punctuation"           : string.punctuation,
+                          "rfc"                   : rfc,
+                          "get_doc_series"        : get_doc_series,
+                          "get_ipr_code"          : get_ipr_code,
+                          "structure_subsections" : structure_subsections,
+                          "infer_toc"             : infer_toc,
+                        })
+
+# =================================================================================================
+# Line-oriented structurer
+#
+# This produces the same rfc.RFC DOM as the grammar in grammar_rfc.txt, but works a line at a time
+# rather than a character at a time, so that its run time is linear in the size of the document.
+# Each of the regular expressions below matches one complete line, and is the line-level
+# equivalent of the grammar rule with the same name.
+# =================================================================================================
+
+_tokens      = r"[!-~][ -~]*"           # ((word|number) ws)+
+_words       = r"[!-/:-~][ !-/:-~]*"    # (word ws)+
+_header_id   = r"(?:0 {19}1 {19}2 {19}3|0 {19}1 {19}2|0 {19}1|0)"
+
+_line              = re.compile(r" {3,}(" + _tokens + r")\n")
+_header_line       = re.compile(r" *" + _tokens + r"\n")
+_title             = re.compile(r" *(" + _words + r")\n")
+_doc_name          = re.compile(r" *(" + _tokens + r")\n")
+_tocline           = re.compile(r" {3,}((?:[A-Za-z]\.)?)((?:\d+\.)*) *" + _words + r"\d*\n")
+_section_name      = re.compile(r"((?:\d+\.)+) *(" + _words + r")\n")
+_appendix_name     = re.compile(r"\s*Appendix [A-Za-z]\. *(" + _words + r")\n")
+_appendix_sub_name = re.compile(r"[A-Za-z]\.((?:\d+\.)+) *(" + _words + r")\n")
+_header_type1      = re.compile(r" *(:* *" + _header_id + r")\n")
+_header_type2      = [re.compile(r" *(: *" + _tokens + r"\n)"),
+                      re.compile(r" *(:\n)"),
+                      re.compile(r" *(: *" + _header_id + r")\n")]
+_diag_ref          = re.compile(r" {3,}(Figure *\d+(?:\.(?:[A-Za-z]+|\d+))*): *((?:" + _tokens + r")?)\n")
+
+
+class TextStructurer:
+    """
+    Structure a depaginated text RFC, given as a list of lines, into an rfc.RFC.
+
+    Raises a ValueError identifying the offending line if the document does not follow the
+    structure expected by grammar_rfc.txt.
+    """
+    def __init__(self, lines: List[str]) -> None:
+        self.lines = lines
+        self.pos   = 0
+
+    def error(self, expected: str) -> ValueError:
+        found = self.lines[self.pos] if self.pos < len(self.lines) else "end of input"
+        return ValueError(f"line {self.pos + 1}: expected {expected}, found {found!r}")
+
+    def peek(self, pattern: "re.Pattern[str]") -> Optional["re.Match[str]"]:
+        if self.pos < len(self.lines):
+            return pattern.fullmatch(self.lines[self.pos])
+        return None
+
+    def match(self, pattern: "re.Pattern[str]") -> Optional["re.Match[str]"]:
+        m = self.peek(pattern)
+        if m is not None:
+            self.pos += 1
+        return m
+
+    def expect(self, pattern: "re.Pattern[str]", expected: str) -> "re.Match[str]":
+        m = self.match(pattern)
+        if m is None:
+            raise self.error(expected)
+        return m
+
+    def blank(self) -> bool:
+        if self.pos < len(self.lines) and self.lines[self.pos] == "\n":
+            self.pos += 1
+            return True
+        return False
+
+    def expect_blank(self) -> None:
+        if not self.blank():
+            raise self.error("blank line")
+
+    def expect_token(self, token: str) -> None:
+        # A quoted token in the grammar skips any preceding whitespace, including blank lines
+        while self.pos < len(self.lines) and self.lines[self.pos].isspace():
+            self.pos += 1
+        if self.pos == len(self.lines) or self.lines[self.pos].lstrip() != token + "\n":
+            raise self.error(repr(token))
+        self.pos += 1
+
+    def text_lines(self) -> List[str]:
+        lines = []
+        m : Optional["re.Match[str]"] = self.match(_line)
+        while m is not None:
+            lines.append(m.group(1) + "\n")
+            m = self.match(_line)
+        return lines
+
+    def paragraphs(self) -> None:
+        # (line+ nl)+
+        count = 0
+        while True:
+            start = self.pos
+            if len(self.text_lines()) == 0 or not self.blank():
+                self.pos = start
+                break
+            count += 1
+        if count == 0:
+            raise self.error("text")
+
+    def t(self) -> Optional[rfc.T]:
+        lines = self.text_lines()
+        if len(lines) == 0:
+            return None
+        return rfc.T([rfc.Text("".join(lines))], None, None, None, None)
+
+    def ascii_packet_header(self) -> Optional[str]:
+        m = self.match(_header_type1)
+        if m is not None:
+            return m.group(1) + "\n"
+        start  = self.pos
+        header = ""
+        for pattern in _header_type2:
+            part = self.match(pattern)
+            if part is None:
+                self.pos = start
+                return None
+            header += part.group(1)
+        return header + "\n"
+
+    def ascii_packet_diag_ref(self) -> Optional[Tuple[str, str]]:
+        start = self.pos
+        if self.blank():
+            m = self.match(_diag_ref)
+            if m is not None:
+                return (m.group(1), m.group(2))
+        self.pos = start
+        return None
+
+    def ascii_packet_diagram(self) -> Optional[rfc.Artwork]:
+        start  = self.pos
+        header = self.ascii_packet_header()
+        if header is None:
+            return None
+        lines = self.text_lines()
+        if len(lines) == 0:
+            self.pos = start
+            return None
+        fig_ref = self.ascii_packet_diag_ref()
+        # The grammar gives the content of artwork as a list, so the same is done here
+        return rfc.Artwork( [rfc.Text("".join([header] + lines))], # type: ignore
+                            "left",
+                            None,
+                            fig_ref[0] if fig_ref else None,
+                            None,
+                            fig_ref[1] if fig_ref else None,
+                            None,
+                            None,
+                            None,
+                            None)
+
+    def section_content(self, allow_diagrams: bool) -> List[Union[rfc.Artwork, rfc.Aside, rfc.BlockQuote, rfc.DL, rfc.Figure, rfc.IRef, rfc.OL, rfc.SourceCode, rfc.T, rfc.Table, rfc.TextTable, rfc.UL]]:
+        # ((ascii_packet_diagram|t):text nl -> text)*
+        content : List[Union[rfc.Artwork, rfc.Aside, rfc.BlockQuote, rfc.DL, rfc.Figure, rfc.IRef, rfc.OL, rfc.SourceCode, rfc.T, rfc.Table, rfc.TextTable, rfc.UL]] = []
+        while True:
+            start = self.pos
+            text : Union[None, rfc.Artwork, rfc.T] = self.ascii_packet_diagram() if allow_diagrams else None
+            if text is None:
+                text = self.t()
+            if text is None or not self.blank():
+                self.pos = start
+                return content
+            content.append(text)
+
+    def section(self, depth: int, name: str, allow_diagrams: bool) -> Tuple[int, rfc.Section]:
+        self.expect_blank()
+        return (depth, rfc.Section(rfc.Name([rfc.Text(name)]),
+                                   self.section_content(allow_diagrams),
+                                   [],
+                                   None,
+                                   True,
+                                   False,
+                                   None,
+                                   "default"))
+
+    def front(self) -> Tuple[rfc.Front, str, str, str]:
+        if self.match(_header_line) is None:
+            raise self.error("header")
+        while self.match(_header_line) is not None:
+            pass
+        self.expect_blank()
+        title_obj = rfc.Title(rfc.Text(self.expect(_title, "title").group(1)), None, None)
+        doc_name_str = self.expect(_doc_name, "document name").group(1)
+
+        self.expect_token("Abstract")
+        self.expect_blank()
+        t = self.t()
+        if t is None:
+            raise self.error("abstract")
+        abstract_obj = rfc.Abstract([t], None)
+        self.expect_blank()
+
+        self.expect_token("Status of This Memo")
+        self.expect_blank()
+        start = self.pos
+        self.paragraphs()
+        status_name = get_doc_series(self.lines[start:self.pos])
+
+        self.expect_token("Copyright Notice")
+        self.expect_blank()
+        start = self.pos
+        self.paragraphs()
+        ipr_code = get_ipr_code(self.lines[start:self.pos])
+
+        self.expect_token("Table of Contents")
+        self.expect_blank()
+        m : Optional["re.Match[str]"] = self.expect(_tocline, "table of contents")
+        toc_depth = []
+        while m is not None:
+            toc_depth.append(infer_toc(m.group(1), m.group(2)))
+            m = self.match(_tocline)
+        self.expect_blank()
+
+        return (rfc.Front(title_obj, [rfc.SeriesInfo(status_name, doc_name_str, status_name, None, None, doc_name_str)], [], None, [], [], [], abstract_obj, [], None),
+                doc_name_str, ipr_code, str(max(toc_depth)))
+
+    def middle(self) -> rfc.Middle:
+        sections = []
+        m : Optional["re.Match[str]"] = self.expect(_section_name, "section")
+        while m is not None:
+            sections.append(self.section(m.group(1).count('.'), m.group(2), True))
+            m = self.match(_section_name)
+        return rfc.Middle(structure_subsections(sections))
+
+    def appendix_name(self) -> Optional[Tuple[int, str]]:
+        start = self.pos
+        while self.pos < len(self.lines) and self.lines[self.pos].isspace():
+            self.pos += 1
+        m = self.match(_appendix_name)
+        if m is not None:
+            return (1, m.group(1))
+        self.pos = start
+        m = self.match(_appendix_sub_name)
+        if m is not None:
+            return (m.group(1).count('.') + 1, m.group(2))
+        return None
+
+    def back(self) -> rfc.Back:
+        appendices = []
+        name = self.appendix_name()
+        if name is None:
+            raise self.error("appendix")
+        while name is not None:
+            appendices.append(self.section(name[0], name[1], False))
+            name = self.appendix_name()
+
+        self.expect_token("Authors' Addresses")
+        self.expect_blank()
+        self.paragraphs()
+        return rfc.Back([], [], structure_subsections(appendices))
+
+    def rfc(self) -> rfc.RFC:
+        front_obj, doc_name_str, ipr_code, toc_depth = self.front()
+        middle_obj = self.middle()
+        back_obj   = self.back()
+        if self.pos != len(self.lines):
+            raise self.error("end of input")
+        return rfc.RFC([],
+                       front_obj,
+                       middle_obj,
+                       back_obj,
+                       None,
+                       None,
+                       doc_name_str,
+                       True,
+                       ipr_code,
+                       None,
+                       None,
+                       None,
+                       None,
+                       None,
+                       None,
+                       "IETF",
+                       True,
+                       toc_depth,
+                       True,
+                       None,
+                       "3")
+
+
+def parse_rfc(rfcTxt: Iterable[str], engine: str = "grammar"):
+    """
+    Parse a text RFC, given its lines, which can be an open file. The engine is either "grammar", to structure the
+    document using the parsley grammar in grammar_rfc.txt, or "lines", to use the equivalent, but
+    much faster, line-oriented TextStructurer.
+    """
+    lines = list(trim_blank_lines(depaginate(rfcTxt)))
+    if engine == "lines":
+        return TextStructurer(lines).rfc()
+    assert engine == "grammar", f"unknown text engine {engine}"
+    parser = generate_parser(GRAMMAR_FILE)
+    rfc = parser("".join(lines)).rfc()
     return rfc
 
 if __name__ == "__main__":
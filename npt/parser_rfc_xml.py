@@ -28,7 +28,7 @@
 # SPDX-License-Identifier: BSD-2-Clause
 # =================================================================================================
 
-from typing import List as ListType, Union, Optional, Tuple
+from typing import List as ListType, Union, Optional, Tuple, IO
 
 import sys
 import xml.etree.ElementTree as ET
@@ -1419,6 +1419,33 @@ def parse_rfc(xmlElement: ET.Element) -> rfc.RFC:
                    xmlElement.attrib.get("updates"),
                    xmlElement.attrib.get("version"))
 
+
+def parse_middle_iter(source: Union[str, IO[bytes]]) -> rfc.Middle:
+    """
+    Parse only the <middle> element of an RFC, given the file name or a binary file object.
+
+    This is intended for protocol extraction, which needs nothing outside the middle of the
+    document. Rather than building the whole tree before converting it, the XML is parsed
+    incrementally: each top-level section of the middle is converted to an rfc.Section as soon
+    as it is complete, and the elements of the <front> and <back>, which can be most of a
+    document, are discarded as they are parsed.
+    """
+    content = []
+    path : ListType[str] = []
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            path.append(element.tag)
+            continue
+        path.pop()
+        if len(path) >= 2 and path[1] == "middle":
+            if len(path) == 2 and element.tag == "section":
+                content.append(parse_section(element))
+                element.clear()
+        else:
+            element.clear()
+    return rfc.Middle(content)
+
+
 if __name__ == "__main__":
     rfcXml = ET.parse(sys.argv[1]).getroot()
     parsed_rfc = parse_rfc(rfcXml)
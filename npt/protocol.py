@@ -29,11 +29,13 @@
 # =================================================================================================
 
 from abc         import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from copy        import copy, deepcopy
-from typing      import Dict, List, Any, Optional, cast, Union
+from typing      import Callable, Dict, Iterator, List, Mapping, Any, Optional, Set, Tuple, cast, Union
 
+import functools
 import unittest
+import weakref
 import re
 
 # Type names begin with an upper case letter, function names do not:
@@ -50,6 +52,24 @@ class ProtocolTypeError(Exception):
 # =================================================================================================
 # Traits:
 
+# A class with a single instance, created on first use: the standard traits, and primitive types
+class Singleton(type):
+    _instances : Dict["Singleton", "Singleton"] = {}
+
+    def __call__(cls, *args, **kwargs):
+        if cls not in cls._instances:
+            instance = super(Singleton, cls).__call__(*args, **kwargs)
+            # Creating the methods of a trait creates the primitive types, which implement the
+            # trait, so the instance may already have been created while this one was
+            if cls not in cls._instances:
+                cls._instances[cls] = instance
+                instance.__post_init__()
+        return cls._instances[cls]
+
+    def __post_init__(self):
+        pass
+
+
 @dataclass(frozen=True)
 class TypeVariable:
     name : str
@@ -58,83 +78,111 @@ class TypeVariable:
         return isinstance(other, TypeVariable) and self.name == other.name
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Trait:
+    """
+    A named set of methods. Traits are compared, and hashed, by identity: each of the standard
+    traits below is a singleton, so that checking whether a type implements a trait does not
+    compare method lists. Traits are immutable, so copying one gives the trait itself, and its
+    methods are indexed by name once, when it is created.
+    """
     name    : str
     methods : List["Function"]
+    methods_by_name : Dict[str, "Function"] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "methods_by_name", {method.name : method for method in self.methods})
 
     def __eq__(self, other: object) -> bool:
-        return isinstance(other, Trait) and self.name == other.name and self.methods == other.methods
+        return self is other
+
+    def __hash__(self) -> int:
+        return id(self)
+
+    def __copy__(self) -> "Trait":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "Trait":
+        return self
+
+
+# The methods of each trait are created once, when its singleton instance is created:
+_trait_methods : Dict[str, List["Function"]] = {}
+
+def trait_methods(trait_name: str, make_methods: Callable[[], List["Function"]]) -> List["Function"]:
+    if trait_name not in _trait_methods:
+        _trait_methods[trait_name] = make_methods()
+    return _trait_methods[trait_name]
 
 
-class Value(Trait):
+class Value(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("Value", [
-            Function("get", [Parameter("self", TypeVariable("T"))], TypeVariable("T")),
-            Function("set", [Parameter("self", TypeVariable("T")), Parameter("value", TypeVariable("T"))], Nothing())
-        ])
+        super().__init__("Value", trait_methods("Value", lambda: [
+                Function("get", [Parameter("self", TypeVariable("T"))], TypeVariable("T")),
+                Function("set", [Parameter("self", TypeVariable("T")), Parameter("value", TypeVariable("T"))], Nothing())
+            ]))
 
 
-class Sized(Trait):
+class Sized(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("Sized", [
-            Function("size", [Parameter("self", TypeVariable("T"))], Number())
-        ])
+        super().__init__("Sized", trait_methods("Sized", lambda: [
+                Function("size", [Parameter("self", TypeVariable("T"))], Number())
+            ]))
 
 
-class IndexCollection(Trait):
+class IndexCollection(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("IndexCollection", [
-            Function("get",    [Parameter("self", TypeVariable("T")), Parameter("index", Number())], TypeVariable("ET")),
-            Function("set",    [Parameter("self", TypeVariable("T")), Parameter("index", Number()), Parameter("value", TypeVariable("ET"))], Nothing()),
-            Function("length", [Parameter("self", TypeVariable("T"))], Number()),
-        ])
+        super().__init__("IndexCollection", trait_methods("IndexCollection", lambda: [
+                Function("get",    [Parameter("self", TypeVariable("T")), Parameter("index", Number())], TypeVariable("ET")),
+                Function("set",    [Parameter("self", TypeVariable("T")), Parameter("index", Number()), Parameter("value", TypeVariable("ET"))], Nothing()),
+                Function("length", [Parameter("self", TypeVariable("T"))], Number()),
+            ]))
 
 
-class Equality(Trait):
+class Equality(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("Equality", [
-            Function("eq", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("ne", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean())
-        ])
+        super().__init__("Equality", trait_methods("Equality", lambda: [
+                Function("eq", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("ne", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean())
+            ]))
 
 
-class Ordinal(Trait):
+class Ordinal(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("Ordinal", [
-            Function("lt", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("le", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("gt", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("ge", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean())
-        ])
+        super().__init__("Ordinal", trait_methods("Ordinal", lambda: [
+                Function("lt", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("le", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("gt", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("ge", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean())
+            ]))
 
 
-class BooleanOps(Trait):
+class BooleanOps(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("BooleanOps", [
-            Function("and", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("or",  [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
-            Function("not", [Parameter("self", TypeVariable("T"))], Boolean())
-        ])
+        super().__init__("BooleanOps", trait_methods("BooleanOps", lambda: [
+                Function("and", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("or",  [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], Boolean()),
+                Function("not", [Parameter("self", TypeVariable("T"))], Boolean())
+            ]))
 
 
-class ArithmeticOps(Trait):
+class ArithmeticOps(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("ArithmeticOps", [
-            Function("plus",     [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
-            Function("minus",    [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
-            Function("multiply", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
-            Function("divide",   [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
-            Function("modulo",   [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
-            Function("pow",      [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T"))
-        ])
+        super().__init__("ArithmeticOps", trait_methods("ArithmeticOps", lambda: [
+                Function("plus",     [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
+                Function("minus",    [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
+                Function("multiply", [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
+                Function("divide",   [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
+                Function("modulo",   [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T")),
+                Function("pow",      [Parameter("self", TypeVariable("T")), Parameter("other", TypeVariable("T"))], TypeVariable("T"))
+            ]))
 
 
-class NumberRepresentable(Trait):
+class NumberRepresentable(Trait, metaclass=Singleton):
     def __init__(self):
-        super().__init__("NumberRepresentable", [
-            Function("to_number", [Parameter("self", TypeVariable("T"))], Number())
-        ])
+        super().__init__("NumberRepresentable", trait_methods("NumberRepresentable", lambda: [
+                Function("to_number", [Parameter("self", TypeVariable("T"))], Number())
+            ]))
 
 # =================================================================================================
 # Expressions as defined in Section 3.4 of the IR specification:
@@ -145,11 +193,39 @@ class Expression(ABC):
         """ Expression is an abstract class whose sub-classes must implement result_type() """
 
 
+ResultTypeMethod = Callable[[Any, Optional["ProtocolType"]], "ProtocolType"]
+
+def memoise_result_type(result_type: ResultTypeMethod) -> ResultTypeMethod:
+    """
+    Decorator for the result_type() method of an Expression, caching its result for each
+    containing type on the expression. Expressions are immutable, and the fields of structures
+    and the methods of types are never removed or redefined. The fields of the context can be
+    removed, when pruning a protocol, so a cached result is only valid until the next removal.
+    Only successful results are cached, so an expression that fails to type check is checked
+    again when asked.
+    """
+    @functools.wraps(result_type)
+    def memoised(self: Expression, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
+        cache : Optional[Dict[int, Tuple[Optional[ProtocolType], ProtocolType, int]]] = self.__dict__.get("_result_types", None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, "_result_types", cache)
+        # Keyed by identity, holding a reference to the containing type so that its id is not reused
+        cached = cache.get(id(containing_type), None)
+        if cached is not None and cached[2] == Context._field_removals:
+            return cached[1]
+        rt = result_type(self, containing_type)
+        cache[id(containing_type)] = (containing_type, rt, Context._field_removals)
+        return rt
+    return memoised
+
+
 @dataclass(frozen=True)
 class ArgumentExpression(Expression):
     arg_name: str
     arg_value: Expression
 
+    @memoise_result_type
     def result_type(self, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
         return self.arg_value.result_type(containing_type)
 
@@ -164,6 +240,7 @@ class MethodInvocationExpression(Expression):
         if re.search(FUNC_NAME_REGEX, self.method_name) == None:
             raise ProtocolTypeError("Method {}: invalid name".format(self.method_name))
 
+    @memoise_result_type
     def result_type(self, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
         args   = [Argument(arg.arg_name, arg.result_type(containing_type), arg.arg_value) for arg in self.arg_exprs]
         result = self.target.result_type(containing_type)
@@ -181,6 +258,7 @@ class FunctionInvocationExpression(Expression):
     func      : "Function"
     arg_exprs : List[ArgumentExpression]
 
+    @memoise_result_type
     def result_type(self, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
         if not self.func.accepts_arguments([Argument(arg.arg_name, arg.result_type(containing_type), arg.arg_value) for arg in self.arg_exprs]):
             raise ProtocolTypeError(f"Function {self.func.name}: invalid arguments")
@@ -199,12 +277,13 @@ class FieldAccessExpression(Expression):
     target     : Expression
     field_name : str
 
+    @memoise_result_type
     def result_type(self, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
-        if isinstance(self.target.result_type(containing_type), Struct):
-            struct = cast(Struct, self.target.result_type(containing_type))
-            return struct.field(self.field_name).field_type
+        target_type = self.target.result_type(containing_type)
+        if isinstance(target_type, Struct):
+            return target_type.field(self.field_name).field_type
         else:
-            raise ProtocolTypeError(f"Cannot access fields in object of type {self.target.result_type(containing_type)}")
+            raise ProtocolTypeError(f"Cannot access fields in object of type {target_type}")
 
 
 @dataclass(frozen=True)
@@ -222,13 +301,15 @@ class IfElseExpression(Expression):
     if_true   : Expression
     if_false  : Expression
 
+    @memoise_result_type
     def result_type(self, containing_type: Optional["ProtocolType"]) -> "ProtocolType":
         result_type = self.condition.result_type(containing_type)
         if result_type != Boolean():
             raise ProtocolTypeError("Cannot create IfElseExpression: condition is not boolean")
-        if self.if_true.result_type(containing_type) != self.if_false.result_type(containing_type):
+        if_true_type = self.if_true.result_type(containing_type)
+        if if_true_type != self.if_false.result_type(containing_type):
             raise ProtocolTypeError("Cannot create IfElseExpression: branch types differ")
-        return self.if_true.result_type(containing_type)
+        return if_true_type
 
 
 @dataclass(frozen=True)
@@ -254,50 +335,179 @@ class ConstantExpression(Expression):
 # -------------------------------------------------------------------------------------------------
 # ProtocolType base class:
 
+class TraitBinding:
+    """
+    A trait implemented by a type, and the types bound to its type variables. The methods of the
+    trait are bound to those types when first looked up. A type derived from the type, by
+    derive_from(), shares the TraitBinding, and so the bound methods.
+    """
+    def __init__(self, trait: "Trait", type_variables: Dict[TypeVariable, "ProtocolType"]) -> None:
+        self.trait          = trait
+        self.type_variables = type_variables
+        self._bound : Dict[str, "Function"] = {}
+
+    def get(self, method_name: str) -> Optional["Function"]:
+        bound = self._bound.get(method_name, None)
+        if bound is not None:
+            return bound
+        method = self.trait.methods_by_name.get(method_name, None)
+        if method is None:
+            return None
+        mimpl_rt   = method.return_type if not isinstance(method.return_type, TypeVariable) else self.type_variables[method.return_type]
+        mimpl_parameters = [Parameter(p.param_name, p.param_type if not isinstance(p.param_type, TypeVariable) else self.type_variables[p.param_type]) for p in method.parameters]
+        bound = Function(method.name, mimpl_parameters, mimpl_rt)
+        self._bound[method_name] = bound
+        return bound
+
+
+class MethodTable(Mapping[str, "Function"]):
+    """
+    The methods of a type, by name, as given by the traits that it implements.
+
+    Implementing a trait records a TraitBinding for it, rather than a copy of each of its methods,
+    and methods are looked up through the TraitBindings of the type. Since no two traits that a
+    type implements have a method of the same name, each method name is found in only one of them.
+    """
+    def __init__(self) -> None:
+        self._traits : List[TraitBinding] = []
+
+    def add_trait(self, trait: "Trait", type_variables: Dict[TypeVariable, "ProtocolType"]) -> None:
+        self._traits.append(TraitBinding(trait, type_variables))
+
+    def conflicts_with(self, trait: "Trait") -> bool:
+        """
+        Check whether a method of the given trait has the same name as one already in the table.
+        """
+        return any(not trait.methods_by_name.keys().isdisjoint(binding.trait.methods_by_name) for binding in self._traits)
+
+    def lookup(self, method_name: str) -> Optional["Function"]:
+        for binding in self._traits:
+            bound = binding.get(method_name)
+            if bound is not None:
+                return bound
+        return None
+
+    def __getitem__(self, method_name: str) -> "Function":
+        bound = self.lookup(method_name)
+        if bound is None:
+            raise KeyError(method_name)
+        return bound
+
+    def __contains__(self, method_name: object) -> bool:
+        return any(method_name in binding.trait.methods_by_name for binding in self._traits)
+
+    def __iter__(self) -> Iterator[str]:
+        for binding in self._traits:
+            yield from binding.trait.methods_by_name
+
+    def __len__(self) -> int:
+        return sum(len(binding.trait.methods_by_name) for binding in self._traits)
+
+    def __copy__(self) -> "MethodTable":
+        table = MethodTable()
+        table._traits = copy(self._traits)
+        return table
+
+
 class ProtocolType:
+    """
+    The base class of all types. Each type caches the methods it resolves through its chain of
+    parents, and the set of its ancestors, so that repeated lookups during type checking do not
+    walk the chain. Both caches are computed lazily. Each type holds weak references to the types
+    whose parent it is, and a change to the parent or the methods of a type discards its caches
+    and those of the types below it, so that a lookup never needs to check that its cache is
+    still valid.
+
+    A type derived from another shares the storage of its traits and methods, and those of the
+    attributes named in _copy_on_write by subclasses, until either type modifies them: the
+    attributes that may be shared are named in _shared, and are copied by _own() before they
+    are modified.
+    """
     traits  : List["Trait"]
-    methods : Dict[str, "Function"]
-    parent  : Optional["ProtocolType"]
+    methods : MethodTable
+    _trait_set : Set["Trait"]
+    _shared    : Set[str]
+    _parent    : Optional["ProtocolType"]
+    _children  : "weakref.WeakValueDictionary[int, ProtocolType]"
+
+    _copy_on_write : Tuple[str, ...] = ("traits", "_trait_set", "methods")
 
     def __init__(self, parent: Optional["ProtocolType"] = None):
+        self._shared = set()
         self.traits = []
-        self.methods = {}
+        self._trait_set = set()
+        self.methods = MethodTable()
+        self._children = weakref.WeakValueDictionary()
+        self._parent = None
         self.parent = parent
 
+    @property
+    def parent(self) -> Optional["ProtocolType"]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent: Optional["ProtocolType"]) -> None:
+        if self._parent is not None:
+            self._parent._children.pop(id(self), None)
+        self._parent = parent
+        if parent is not None:
+            parent._children[id(self)] = self
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        """
+        Discard the methods and ancestors cached by this type, and by the types below it.
+        """
+        self._resolved_methods : Dict[str, "Function"] = {}
+        self._ancestors        : Optional[Set[int]] = None
+        for child in list(self._children.values()):
+            child._invalidate()
+
+    def _own(self, *attributes: str) -> None:
+        """
+        Copy those of the given attributes whose storage may be shared with another type.
+        """
+        for attribute in attributes:
+            if attribute in self._shared:
+                setattr(self, attribute, copy(getattr(self, attribute)))
+                self._shared.remove(attribute)
+
     def implement_trait(self, trait: "Trait", type_variables: Dict[TypeVariable, "ProtocolType"] = {}) -> None:
-        type_variables = {TypeVariable("T") : self, **type_variables}
-        if trait in self.traits:
+        if trait in self._trait_set:
             raise ProtocolTypeError(f"Type {self} already implements trait {trait.name}")
-        else:
-            for method in trait.methods:
-                if method.name in self.methods:
-                    raise ProtocolTypeError(f"Type {self} already implements a method {method.name}")
-                else:
-                    mimpl_name = method.name
-                    mimpl_rt   = method.return_type if not isinstance(method.return_type, TypeVariable) else type_variables[method.return_type]
-                    mimpl_parameters = [Parameter(p.param_name, p.param_type if not isinstance(p.param_type, TypeVariable) else type_variables[p.param_type]) for p in method.parameters]
-                    self.methods[method.name] = Function(mimpl_name, mimpl_parameters, mimpl_rt)
-            self.traits.append(trait)
+        if self.methods.conflicts_with(trait):
+            method_name = next(method.name for method in trait.methods if method.name in self.methods)
+            raise ProtocolTypeError(f"Type {self} already implements a method {method_name}")
+        self._own("traits", "_trait_set", "methods")
+        self.methods.add_trait(trait, {TypeVariable("T") : self, **type_variables})
+        self.traits.append(trait)
+        self._trait_set.add(trait)
+        self._invalidate()
+
+    def implements_trait(self, trait: "Trait") -> bool:
+        return trait in self._trait_set
 
     def get_method(self, method_name: str) -> "Function":
-        method = None
-        current_type = self
-        while method is None:
-            method = current_type.methods.get(method_name, None)
-            if current_type.parent is not None:
-                current_type = current_type.parent
-            else:
-                break
-        if method is None:
-            raise ProtocolTypeError(f"{self} and its parents do not implement the {method_name} method")
-        return method
+        method = self._resolved_methods.get(method_name, None)
+        if method is not None:
+            return method
+        current_type : Optional[ProtocolType] = self
+        while current_type is not None:
+            method = current_type.methods.lookup(method_name)
+            if method is not None:
+                self._resolved_methods[method_name] = method
+                return method
+            current_type = current_type.parent
+        raise ProtocolTypeError(f"{self} and its parents do not implement the {method_name} method")
 
     def is_a(self, obj):
-        parents = []
-        while self.parent is not None:
-            parents.append(self.parent)
-            self = self.parent
-        return obj in parents
+        if self._ancestors is None:
+            self._ancestors = set()
+            current_type = self.parent
+            while current_type is not None:
+                self._ancestors.add(id(current_type))
+                current_type = current_type.parent
+        return id(obj) in self._ancestors
 
     def __str__(self):
         return f"{type(self).__name__}<::{' '.join([trait.name for trait in self.traits])}>"
@@ -306,18 +516,6 @@ class ProtocolType:
 # -------------------------------------------------------------------------------------------------
 # ProtocolType mixins:
 
-class Singleton(type):
-    _instances : Dict["Singleton", "Singleton"] = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-            cls._instances[cls].__post_init__()
-        return cls._instances[cls]
-
-    def __post_init__(self):
-        pass
-
 class PrimitiveType(ProtocolType, metaclass=Singleton):
     """
     PrimitiveTypes are instantiated only once, and cannot be constructed by a Protocol definition.
@@ -357,7 +555,8 @@ class ConstructableType(ProtocolType):
 
     def derive_from(self, name: str, also_implements: List[Trait]) -> "ConstructableType":
         """
-        Derive a new type from this type.
+        Derive a new type from this type. The new type shares the storage of this type until
+        either of them is modified.
 
         Parameters:
             self            - the type that the new type is derived from
@@ -366,7 +565,10 @@ class ConstructableType(ProtocolType):
         """
         new_type = copy(self)
         new_type.name = name
-        new_type.methods = copy(self.methods)
+        self._shared = self._shared | set(self._copy_on_write)
+        new_type._shared = set(self._copy_on_write)
+        new_type._children = weakref.WeakValueDictionary()
+        new_type.parent = self.parent
         for trait in also_implements:
             new_type.implement_trait(trait)
         return new_type
@@ -464,6 +666,8 @@ class Struct(RepresentableType, ConstructableType):
     parse_from   : Optional["Function"]
     serialise_to : Optional["Function"]
 
+    _copy_on_write = ProtocolType._copy_on_write + ("fields", "constraints", "actions")
+
     def __init__(self, name: str, fields: List[StructField], constraints: List[Expression], actions: List[Expression]) -> None:
         super().__init__(name=name)
         self.fields = {}
@@ -482,16 +686,21 @@ class Struct(RepresentableType, ConstructableType):
     def add_field(self, field: StructField) -> None:
         if field.field_name in self.fields:
             raise ProtocolTypeError(f"{self.name} already contains a field named {field.field_name}")
+        self._own("fields")
         self.fields[field.field_name] = field
 
     def add_constraint(self, constraint: Expression) -> None:
-        if constraint.result_type(self) != Boolean():
-            raise ProtocolTypeError(f"Invalid constraint: {constraint.result_type(self)} != Boolean")
+        result_type = constraint.result_type(self)
+        if result_type != Boolean():
+            raise ProtocolTypeError(f"Invalid constraint: {result_type} != Boolean")
+        self._own("constraints")
         self.constraints.append(constraint)
 
     def add_action(self, action: Expression) -> None:
-        if action.result_type(self) != Nothing():
-            raise ProtocolTypeError(f"Invalid action: {action.result_type(self)} != Nothing")
+        result_type = action.result_type(self)
+        if result_type != Nothing():
+            raise ProtocolTypeError(f"Invalid action: {result_type} != Nothing")
+        self._own("actions")
         self.actions.append(action)
 
     def field(self, field_name: str) -> StructField:
@@ -600,6 +809,10 @@ class ContextField():
 class Context(InternalType, ConstructableType):
     fields: Dict[str, ContextField]
 
+    _copy_on_write = ProtocolType._copy_on_write + ("fields",)
+    # Counts the fields removed from any context, invalidating the memoised result types
+    _field_removals : int = 0
+
     def __init__(self, name: str):
         super().__init__(name=name)
         self.fields = {}
@@ -607,8 +820,15 @@ class Context(InternalType, ConstructableType):
     def add_field(self, field: ContextField) -> None:
         if field.field_name in self.fields:
             raise ProtocolTypeError(f"{self.name} already has a field named {field.field_name}")
+        self._own("fields")
         self.fields[field.field_name] = field
 
+    def remove_field(self, field_name: str) -> None:
+        self.field(field_name)
+        self._own("fields")
+        del self.fields[field_name]
+        Context._field_removals += 1
+
     def field(self, field_name: str) -> ContextField:
         if field_name not in self.fields:
             raise ProtocolTypeError(f"{self.name} has no field named {field_name}")
@@ -618,15 +838,50 @@ class Context(InternalType, ConstructableType):
         return list(self.fields.values())
 
 
+@dataclass
+class RemovedDefinitions:
+    """
+    The definitions removed from a protocol by Protocol.remove_unreachable(): the names of its
+    types, the aliases for them, the parse and serialise functions synthesised for them, and the
+    fields of the context.
+    """
+    types          : List[str]
+    aliases        : List[str]
+    functions      : List[str]
+    context_fields : List[str]
+
+
 class Protocol(InternalType, ConstructableType):
-    _types   : Dict[str, ConstructableType]
-    _funcs   : List[str]
-    _context : Context
-    _pdus    : List[str]
+    """
+    A protocol, and the types that it defines.
 
-    def __init__(self):
+    If intern_types is set, structurally identical types are interned as they are added: a
+    BitString with a constant size is replaced by a single canonical BitString of that size,
+    named BitString_<size>, and the name it was added with is kept as an alias for that type.
+
+    As each type is added, the types of the protocol that it depends on are recorded, giving a
+    dependency graph from which the order in which the types are to be generated is found.
+    """
+    intern_types : bool
+    _types    : Dict[str, ConstructableType]
+    _aliases  : Dict[str, str]
+    _interned : Dict[Tuple[type, Any], str]
+    _dependencies : Dict[str, List[str]]
+    _looked_through : Dict[int, Set[str]]
+    _type_order   : Optional[Tuple[List[str], List[str]]]
+    _funcs    : List[str]
+    _context  : Context
+    _pdus     : List[str]
+
+    def __init__(self, intern_types: bool = False):
         super().__init__(name="Protocol")
+        self.intern_types = intern_types
         self._types = {}
+        self._aliases = {}
+        self._interned = {}
+        self._dependencies = {}
+        self._looked_through = {}
+        self._type_order = None
         self._funcs = []
         self._context = Context("Context")
         self.add_type(self._context)
@@ -637,9 +892,105 @@ class Protocol(InternalType, ConstructableType):
         self.add_type(BitString("DataUnit", ContextAccessExpression(self._context, "data_size")))
 
     def _check_typename(self, name: str):
-        if name in self._types:
+        if name in self._types or name in self._aliases:
             raise ProtocolTypeError(f"Cannot create type {self.name}: already exists")
 
+    def _structural_key(self, new_type: ConstructableType) -> Optional[Tuple[type, Any]]:
+        """
+        A key identifying the structure of the given type, if it can be interned, or None.
+        """
+        if type(new_type) is BitString and isinstance(new_type.size, ConstantExpression) and new_type.size.constant_type == Number():
+            return (BitString, new_type.size.constant_value)
+        return None
+
+    def _intern_type(self, new_type: ConstructableType, key: Tuple[type, Any]) -> ConstructableType:
+        if key not in self._interned:
+            canonical = BitString(f"BitString_{key[1]}", ConstantExpression(Number(), key[1]))
+            self._check_typename(canonical.name)
+            self._register_type(canonical)
+            self._interned[key] = canonical.name
+        self.add_type_alias(new_type.name, self._interned[key])
+        return self._types[self._interned[key]]
+
+    def _register_type(self, new_type: ConstructableType) -> None:
+        self._types[new_type.name] = new_type
+        self._dependencies[new_type.name] = self._find_dependencies(new_type)
+        # Types added before this one may have been built from it, before it was part of the protocol
+        for type_name in self._looked_through.pop(id(new_type), set()):
+            self._dependencies[type_name] = self._find_dependencies(self._types[type_name])
+        self._type_order = None
+
+    def _find_dependencies(self, pt: ConstructableType) -> List[str]:
+        """
+        The names of the types of this protocol that the given type is built from, in the order
+        they are used. Types that are not part of the protocol, such as the Options returned by
+        parse functions, are looked through to the types of the protocol that they are built from.
+        The parse_from and serialise_to functions of a type are not dependencies of the type: they
+        are built from it.
+        """
+        dependencies : List[str] = []
+        visited = set([id(pt)])
+
+        def visit(current: ProtocolType) -> None:
+            parts : List[Union[ProtocolType, TypeVariable]] = []
+            if isinstance(current, Option):
+                parts = [current.reference_type]
+            elif isinstance(current, Array):
+                parts = [current.element_type]
+            elif isinstance(current, Struct):
+                parts = [field.field_type for field in current.get_fields()]
+            elif isinstance(current, Enum):
+                parts = list(current.variants)
+            elif isinstance(current, Function):
+                parts = [param.param_type for param in current.parameters] + [current.return_type]
+            elif isinstance(current, Context):
+                parts = [field.field_type for field in current.get_fields()]
+            for part in parts:
+                if not isinstance(part, ConstructableType) or id(part) in visited:
+                    continue
+                visited.add(id(part))
+                if self._types.get(part.name, None) is part:
+                    dependencies.append(part.name)
+                else:
+                    self._looked_through.setdefault(id(part), set()).add(pt.name)
+                    visit(part)
+
+        visit(pt)
+        return dependencies
+
+    def _find_references(self, pt: ConstructableType, type_names: Set[str], context_fields: Set[str]) -> None:
+        """
+        Add the names of the types of this protocol, and the fields of its context, that are used
+        by the expressions of the given type: its size, and the presence conditions, constraints
+        and actions of a structure.
+        """
+        exprs : List[Optional[Expression]] = []
+        if isinstance(pt, RepresentableType):
+            exprs.append(pt.size)
+        if isinstance(pt, Array):
+            exprs.append(pt.length)
+        if isinstance(pt, Struct):
+            exprs += [field.is_present for field in pt.get_fields()] + pt.constraints + pt.actions
+        while len(exprs) > 0:
+            expr = exprs.pop()
+            if isinstance(expr, ArgumentExpression):
+                exprs.append(expr.arg_value)
+            elif isinstance(expr, MethodInvocationExpression):
+                exprs += [expr.target] + list(expr.arg_exprs)
+            elif isinstance(expr, FunctionInvocationExpression):
+                if self._types.get(expr.func.name, None) is expr.func:
+                    type_names.add(expr.func.name)
+                exprs += list(expr.arg_exprs)
+            elif isinstance(expr, FieldAccessExpression):
+                exprs.append(expr.target)
+            elif isinstance(expr, ContextAccessExpression):
+                context_fields.add(expr.field_name)
+            elif isinstance(expr, IfElseExpression):
+                exprs += [expr.condition, expr.if_true, expr.if_false]
+            elif isinstance(expr, ConstantExpression):
+                if isinstance(expr.constant_type, ConstructableType) and self._types.get(expr.constant_type.name, None) is expr.constant_type:
+                    type_names.add(expr.constant_type.name)
+
     # =============================================================================================
     # Public API:
 
@@ -662,11 +1013,36 @@ class Protocol(InternalType, ConstructableType):
         Parameters:
             self  - the protocol to which the type is added
             new_type - the type to be added to the protocol
+
+        Returns the type that represents new_type in this protocol. This is new_type itself,
+        unless the protocol interns types, and new_type is structurally identical to a canonical
+        type, in which case the canonical type is returned, and new_type's name is an alias for it.
         """
         self._check_typename(new_type.name)
-        self._types[new_type.name] = new_type
+        key = self._structural_key(new_type) if self.intern_types else None
+        if key is not None:
+            return self._intern_type(new_type, key)
+        self._register_type(new_type)
         return new_type
 
+    def add_type_alias(self, alias: str, type_name: str) -> None:
+        """
+        Add an alias for a type of this protocol. If the protocol interns types, the type becomes
+        the canonical type for those structurally identical to it.
+
+        Parameters:
+            self      - the protocol to which the alias is added
+            alias     - the name of the alias
+            type_name - the name of a pre-existing type of this protocol
+        """
+        self._check_typename(alias)
+        if type_name not in self._types:
+            raise ProtocolTypeError(f"Cannot create alias {alias}: no type named {type_name}")
+        self._aliases[alias] = type_name
+        key = self._structural_key(self._types[type_name])
+        if key is not None:
+            self._interned[key] = type_name
+
     def define_pdu(self, pdu: str) -> None:
         """
         Define a PDU for this protocol.
@@ -678,6 +1054,67 @@ class Protocol(InternalType, ConstructableType):
         assert pdu in self._types
         assert isinstance(self._types[pdu], RepresentableType)
         self._pdus.append(pdu)
+        self._type_order = None
+
+    def remove_unreachable(self) -> RemovedDefinitions:
+        """
+        Remove the types, and the fields of the context, that cannot be reached from the PDUs of
+        this protocol, so that they are not synthesised or formatted. A type is reachable if a
+        reachable type is built from it, or uses it in an expression. The context, and the
+        DataUnit type from which PDUs are parsed, are always kept. A protocol with no PDUs is
+        left unchanged.
+
+        Returns the definitions that were removed.
+        """
+        removed = RemovedDefinitions([], [], [], [])
+        if len(self._pdus) == 0:
+            return removed
+
+        reachable      : Set[str] = set()
+        context_fields : Set[str] = {"data_size"}
+        pending = self._pdus + ["DataUnit"]
+        while len(pending) > 0:
+            while len(pending) > 0:
+                type_name = pending.pop()
+                if type_name in reachable:
+                    continue
+                reachable.add(type_name)
+                references = set(self._dependencies[type_name])
+                self._find_references(self._types[type_name], references, context_fields)
+                pending += [name for name in references if name not in reachable]
+            # The types of the fields of the context that are used are reachable, and may in turn
+            # use other fields of the context
+            for field_name in context_fields:
+                field_type = self._context.fields[field_name].field_type if field_name in self._context.fields else None
+                if isinstance(field_type, ConstructableType) and self._types.get(field_type.name, None) is field_type and field_type.name not in reachable:
+                    pending.append(field_type.name)
+
+        for type_name, pt in list(self._types.items()):
+            if type_name in reachable or pt is self._context:
+                continue
+            removed.types.append(type_name)
+            for func in [getattr(pt, "parse_from", None), getattr(pt, "serialise_to", None)]:
+                if func is not None:
+                    removed.functions.append(func.name)
+            del self._types[type_name]
+            del self._dependencies[type_name]
+        for alias, type_name in list(self._aliases.items()):
+            if type_name not in self._types:
+                removed.aliases.append(alias)
+                del self._aliases[alias]
+        for key, type_name in list(self._interned.items()):
+            if type_name not in self._types:
+                del self._interned[key]
+        for dependents in self._looked_through.values():
+            dependents.intersection_update(self._types.keys())
+        self._funcs = [func_name for func_name in self._funcs if func_name in self._types]
+
+        for field_name in list(self._context.fields.keys()):
+            if field_name not in context_fields:
+                removed.context_fields.append(field_name)
+                self._context.remove_field(field_name)
+        self._type_order = None
+        return removed
 
     def synthesise(self) -> None:
         for ptype in self._types.values():
@@ -697,11 +1134,17 @@ class Protocol(InternalType, ConstructableType):
         return self.name
 
     def has_type(self, type_name: str) -> bool:
-        return type_name in self._types
+        return type_name in self._types or type_name in self._aliases
 
     def get_type(self, type_name: str) -> ConstructableType:
         assert self.has_type(type_name)
-        return self._types[type_name]
+        return self._types[self._aliases.get(type_name, type_name)]
+
+    def get_type_aliases(self) -> Dict[str, str]:
+        """
+        The names of the types that were interned, mapped to the names of their canonical types.
+        """
+        return dict(self._aliases)
 
     def has_func(self, func_name: str) -> bool:
         return func_name in self._funcs
@@ -722,4 +1165,48 @@ class Protocol(InternalType, ConstructableType):
     def get_type_names(self) -> List[str]:
         return list(self._types.keys())
 
+    def get_type_order(self) -> List[str]:
+        """
+        The names of the types needed by the PDUs of this protocol and by its context, ordered so
+        that each type comes after the types it depends on. Types are ordered depth-first from each
+        PDU in turn, and then from the context. The order is cached until a type or PDU is added.
+        Raises ProtocolTypeError if the types depend on each other in a cycle.
+        """
+        # The fields of the context are added as the types that set them are built, so its
+        # dependencies are found again each time
+        context_dependencies = self._find_dependencies(self._context)
+        if self._type_order is not None and self._type_order[0] == context_dependencies:
+            return list(self._type_order[1])
+        self._dependencies[self._context.name] = context_dependencies
+
+        order : List[str] = []
+        done  : Set[str] = set()
+        for root in self._pdus + [self._context.name]:
+            if root in done:
+                continue
+            # Iterative depth-first search: each entry is a type, and the index of the next of its
+            # dependencies to visit. The types on the stack are those whose dependencies are being
+            # visited, so finding one of them again means that there is a cycle.
+            stack  : List[Tuple[str, int]] = [(root, 0)]
+            active : Set[str] = {root}
+            while len(stack) > 0:
+                type_name, index = stack[-1]
+                dependencies = self._dependencies[type_name]
+                if index == len(dependencies):
+                    stack.pop()
+                    active.remove(type_name)
+                    done.add(type_name)
+                    order.append(type_name)
+                    continue
+                stack[-1] = (type_name, index + 1)
+                dependency = dependencies[index]
+                if dependency in active:
+                    cycle = [name for name, _ in stack[[name for name, _ in stack].index(dependency):]]
+                    raise ProtocolTypeError(f"Cannot order types: {' -> '.join(cycle + [dependency])} form a cycle")
+                if dependency not in done:
+                    stack.append((dependency, 0))
+                    active.add(dependency)
+        self._type_order = (context_dependencies, order)
+        return list(order)
+
 # vim: set tw=0 ai:
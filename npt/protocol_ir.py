@@ -0,0 +1,314 @@
+# =================================================================================================
+# Copyright (C) 2018-2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+
+"""
+Snapshots of synthesised protocols.
+
+A Protocol is saved as a compact JSON document, giving its name, context, types, type aliases and
+PDUs, so that it can be loaded again without reparsing the document that described it. Types are
+saved in the order they were added to the protocol, which is an order in which each can be
+constructed from those before it. The parse_from and serialise_to functions of each type are
+restored once all the types have been constructed, since their signatures refer back to the type.
+
+Within a snapshot, a type is referred to as {"ref": name} if it is one of the types defined by the
+protocol, {"primitive": name} if it is a primitive type, or {"var": name} if it is a type variable.
+Any other type is saved inline, in the same form as the types of the protocol. Expressions are
+saved as lists, whose first element names the kind of expression.
+"""
+
+import json
+
+from npt.protocol import *
+from pathlib      import Path
+from typing       import Any, Dict, List, Optional, Union
+
+IR_FORMAT  = "npt-protocol-ir"
+IR_VERSION = 1
+
+class ProtocolIRError(Exception):
+    def __init__(self, reason):
+        self.reason = reason
+
+
+# The traits that can be restored by name:
+_traits = {trait().name : trait for trait in [Value, Sized, IndexCollection, Equality, Ordinal, BooleanOps, ArithmeticOps, NumberRepresentable]}
+
+_primitives = {"Number" : Number, "Boolean" : Boolean, "Nothing" : Nothing}
+
+# =================================================================================================
+# Saving:
+
+class _Saver:
+    def __init__(self, protocol: Protocol) -> None:
+        self.protocol = protocol
+
+    def type_ref(self, pt: Union[ProtocolType, TypeVariable, None]) -> Any:
+        if pt is None:
+            return None
+        if isinstance(pt, TypeVariable):
+            return {"var" : pt.name}
+        if isinstance(pt, PrimitiveType):
+            return {"primitive" : type(pt).__name__}
+        if isinstance(pt, ConstructableType) and self.protocol.has_type(pt.name) and self.protocol.get_type(pt.name) is pt:
+            return {"ref" : pt.name}
+        return self.type_def(pt)
+
+    def expr(self, expr: Optional[Expression]) -> Any:
+        if expr is None:
+            return None
+        if isinstance(expr, MethodInvocationExpression):
+            return ["method", self.expr(expr.target), expr.method_name, [[arg.arg_name, self.expr(arg.arg_value)] for arg in expr.arg_exprs]]
+        if isinstance(expr, FunctionInvocationExpression):
+            return ["function", self.type_ref(expr.func), [[arg.arg_name, self.expr(arg.arg_value)] for arg in expr.arg_exprs]]
+        if isinstance(expr, FieldAccessExpression):
+            return ["field", self.expr(expr.target), expr.field_name]
+        if isinstance(expr, ContextAccessExpression):
+            if expr.context is not self.protocol.get_context():
+                raise ProtocolIRError(f"Cannot save access to field {expr.field_name} of a context not belonging to the protocol")
+            return ["context", expr.field_name]
+        if isinstance(expr, IfElseExpression):
+            return ["ifelse", self.expr(expr.condition), self.expr(expr.if_true), self.expr(expr.if_false)]
+        if isinstance(expr, SelfExpression):
+            return ["self"]
+        if isinstance(expr, ConstantExpression):
+            if not isinstance(expr.constant_value, (bool, int, float, str)):
+                raise ProtocolIRError(f"Cannot save constant {expr.constant_value!r}")
+            return ["const", self.type_ref(expr.constant_type), expr.constant_value]
+        raise ProtocolIRError(f"Cannot save expression {expr}")
+
+    def type_def(self, pt: ProtocolType) -> Dict[str, Any]:
+        if not isinstance(pt, ConstructableType):
+            raise ProtocolIRError(f"Cannot save type {pt}")
+        tdef : Dict[str, Any] = {"kind" : type(pt).__name__, "name" : pt.name}
+        if isinstance(pt, BitString):
+            tdef["size"] = self.expr(pt.size)
+        elif isinstance(pt, Option):
+            tdef["reference_type"] = self.type_ref(pt.reference_type)
+        elif isinstance(pt, Array):
+            tdef["element_type"] = self.type_ref(pt.element_type)
+            tdef["length"] = self.expr(pt.length)
+        elif isinstance(pt, Struct):
+            tdef["fields"] = [[field.field_name, self.type_ref(field.field_type), self.expr(field.is_present)] for field in pt.get_fields()]
+            tdef["constraints"] = [self.expr(constraint) for constraint in pt.constraints]
+            tdef["actions"] = [self.expr(action) for action in pt.actions]
+        elif isinstance(pt, Enum):
+            tdef["variants"] = [self.type_ref(variant) for variant in pt.variants]
+        elif isinstance(pt, Function):
+            tdef["parameters"] = [[param.param_name, self.type_ref(param.param_type)] for param in pt.parameters]
+            tdef["return_type"] = self.type_ref(pt.return_type)
+        elif isinstance(pt, Context):
+            tdef["fields"] = [[field.field_name, self.type_ref(field.field_type)] for field in pt.get_fields()]
+        else:
+            raise ProtocolIRError(f"Cannot save type {pt}")
+        tdef["traits"] = [trait.name for trait in pt.traits]
+        return tdef
+
+    def functions(self, pt: ConstructableType) -> Optional[Dict[str, Any]]:
+        if not isinstance(pt, (Struct, Array, Enum)):
+            return None
+        if pt.parse_from is None and pt.serialise_to is None:
+            return None
+        return {"parse_from"   : self.type_ref(pt.parse_from),
+                "serialise_to" : self.type_ref(pt.serialise_to)}
+
+    def protocol_def(self) -> Dict[str, Any]:
+        types = []
+        functions = {}
+        for type_name in self.protocol.get_type_names():
+            pt = self.protocol.get_type(type_name)
+            types.append(self.type_def(pt))
+            funcs = self.functions(pt)
+            if funcs is not None:
+                functions[type_name] = funcs
+        return {"format"       : IR_FORMAT,
+                "version"      : IR_VERSION,
+                "name"         : self.protocol.get_protocol_name(),
+                "intern_types" : self.protocol.intern_types,
+                "types"        : types,
+                "aliases"      : self.protocol.get_type_aliases(),
+                "functions"    : functions,
+                "pdus"         : self.protocol.get_pdu_names()}
+
+# =================================================================================================
+# Loading:
+
+class _Loader:
+    def __init__(self, protocol: Protocol) -> None:
+        self.protocol = protocol
+
+    def type_ref(self, ref: Any) -> Any:
+        if ref is None:
+            return None
+        if "var" in ref:
+            return TypeVariable(ref["var"])
+        if "primitive" in ref:
+            if ref["primitive"] not in _primitives:
+                raise ProtocolIRError(f"Unknown primitive type {ref['primitive']}")
+            return _primitives[ref["primitive"]]()
+        if "ref" in ref:
+            if not self.protocol.has_type(ref["ref"]):
+                raise ProtocolIRError(f"Type {ref['ref']} is used before it is defined")
+            return self.protocol.get_type(ref["ref"])
+        return self.type_def(ref)
+
+    def optional_expr(self, expr: Any) -> Optional[Expression]:
+        if expr is None:
+            return None
+        return self.expr(expr)
+
+    def expr(self, expr: Any) -> Expression:
+        kind = expr[0]
+        if kind == "method":
+            return MethodInvocationExpression(self.expr(expr[1]), expr[2], [ArgumentExpression(name, self.expr(value)) for name, value in expr[3]])
+        if kind == "function":
+            return FunctionInvocationExpression(self.type_ref(expr[1]), [ArgumentExpression(name, self.expr(value)) for name, value in expr[2]])
+        if kind == "field":
+            return FieldAccessExpression(self.expr(expr[1]), expr[2])
+        if kind == "context":
+            return ContextAccessExpression(self.protocol.get_context(), expr[1])
+        if kind == "ifelse":
+            return IfElseExpression(self.expr(expr[1]), self.expr(expr[2]), self.expr(expr[3]))
+        if kind == "self":
+            return SelfExpression()
+        if kind == "const":
+            return ConstantExpression(self.type_ref(expr[1]), expr[2])
+        raise ProtocolIRError(f"Unknown expression {kind}")
+
+    def implement_traits(self, pt: ConstructableType, trait_names: List[str]) -> None:
+        """
+        Implement the traits that pt had when saved, beyond those its constructor gives it.
+        """
+        implemented = [trait.name for trait in pt.traits]
+        if implemented != trait_names[:len(implemented)]:
+            raise ProtocolIRError(f"Type {pt.name} was saved with traits {trait_names}, not {implemented}")
+        for trait_name in trait_names[len(implemented):]:
+            if trait_name not in _traits:
+                raise ProtocolIRError(f"Type {pt.name} implements unknown trait {trait_name}")
+            pt.implement_trait(_traits[trait_name]())
+
+    def type_def(self, tdef: Dict[str, Any]) -> ConstructableType:
+        kind = tdef["kind"]
+        name = tdef["name"]
+        pt : ConstructableType
+        if kind == "BitString":
+            pt = BitString(name, self.optional_expr(tdef["size"]))
+        elif kind == "Option":
+            pt = Option(name, self.type_ref(tdef["reference_type"]))
+        elif kind == "Array":
+            pt = Array(name, self.type_ref(tdef["element_type"]), self.optional_expr(tdef["length"]))
+        elif kind == "Struct":
+            fields = [StructField(field_name, self.type_ref(field_type), self.optional_expr(is_present)) for field_name, field_type, is_present in tdef["fields"]]
+            pt = Struct(name, fields, [self.expr(c) for c in tdef["constraints"]], [self.expr(a) for a in tdef["actions"]])
+        elif kind == "Enum":
+            pt = Enum(name, [self.type_ref(variant) for variant in tdef["variants"]])
+        elif kind == "Function":
+            pt = Function(name, [Parameter(param_name, self.type_ref(param_type)) for param_name, param_type in tdef["parameters"]], self.type_ref(tdef["return_type"]))
+        else:
+            raise ProtocolIRError(f"Unknown kind of type {kind}")
+        self.implement_traits(pt, tdef["traits"])
+        return pt
+
+    def protocol_def(self, pdef: Dict[str, Any]) -> Protocol:
+        if pdef.get("format", None) != IR_FORMAT:
+            raise ProtocolIRError("Not a protocol snapshot")
+        if pdef.get("version", None) != IR_VERSION:
+            raise ProtocolIRError(f"Unsupported protocol snapshot version {pdef.get('version', None)}: expected {IR_VERSION}")
+        try:
+            return self.protocol_body(pdef)
+        except (KeyError, TypeError, IndexError, ValueError) as e:
+            raise ProtocolIRError(f"Malformed protocol snapshot: {type(e).__name__} {e}")
+
+    def protocol_body(self, pdef: Dict[str, Any]) -> Protocol:
+        if pdef["name"] != self.protocol.get_protocol_name():
+            self.protocol.set_protocol_name(pdef["name"])
+        for tdef in pdef["types"]:
+            if tdef["kind"] == "Context":
+                # The context is created with the protocol. Its fields are restored first, as any
+                # expression may refer to them.
+                context = self.protocol.get_context()
+                for field_name, field_type in tdef["fields"]:
+                    if field_name not in context.fields:
+                        context.add_field(ContextField(field_name, self.type_ref(field_type)))
+        for tdef in pdef["types"]:
+            if not self.protocol.has_type(tdef["name"]):
+                self.protocol.add_type(self.type_def(tdef))
+        for alias, type_name in pdef["aliases"].items():
+            self.protocol.add_type_alias(alias, type_name)
+        for type_name, funcs in pdef["functions"].items():
+            pt = self.protocol.get_type(type_name)
+            if not isinstance(pt, (Struct, Array, Enum)):
+                raise ProtocolIRError(f"Malformed protocol snapshot: {type_name} cannot have parse and serialise functions")
+            pt.parse_from   = self.type_ref(funcs["parse_from"])
+            pt.serialise_to = self.type_ref(funcs["serialise_to"])
+        for pdu_name in pdef["pdus"]:
+            self.protocol.define_pdu(pdu_name)
+        self.protocol.intern_types = pdef["intern_types"]
+        return self.protocol
+
+# =================================================================================================
+# Public API:
+
+def dumps(protocol: Protocol) -> str:
+    """
+    Save a protocol as a snapshot, returning the text of the snapshot.
+    """
+    return json.dumps(_Saver(protocol).protocol_def(), separators=(",", ":"))
+
+
+def loads(snapshot: str) -> Protocol:
+    """
+    Load a protocol from the text of a snapshot saved by dumps().
+    """
+    try:
+        pdef = json.loads(snapshot)
+    except json.JSONDecodeError as e:
+        raise ProtocolIRError(f"Not a protocol snapshot: {e}")
+    if not isinstance(pdef, dict):
+        raise ProtocolIRError("Not a protocol snapshot")
+    return _Loader(Protocol()).protocol_def(pdef)
+
+
+def save(protocol: Protocol, filepath: Path) -> None:
+    """
+    Save a protocol as a snapshot in the given file.
+    """
+    with open(filepath, "w") as outfile:
+        outfile.write(dumps(protocol))
+
+
+def load(filepath: Path) -> Protocol:
+    """
+    Load a protocol from a snapshot in the given file.
+    """
+    with open(filepath, "r") as infile:
+        return loads(infile.read())
+
+# vim: set tw=0 ai:
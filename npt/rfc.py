@@ -33,16 +33,53 @@
 # The xml2rfc Version 3 Vocabulary, as defined in RFC 7991
 # =================================================================================================
 
-from typing      import List as ListType, Union, Optional, Tuple
-from dataclasses import dataclass
+import sys
+
+from typing      import List as ListType, Union, Optional, Tuple, Type, TypeVar, Any, cast
+from dataclasses import dataclass, fields
 
 class Elem:
-    pass
+    """
+    Base class for the elements of the RFC DOM.
+
+    A parsed document holds a very large number of elements, so elements are
+    dataclasses wrapped by the compact decorator below, which gives each class
+    __slots__ rather than a per-instance __dict__. Attribute values, which
+    repeat heavily within and across documents, are interned as elements are
+    constructed.
+    """
+    __slots__ : Tuple[str, ...] = ()
+    _interned : Tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        for name in self._interned:
+            value = getattr(self, name)
+            if value is not None:
+                object.__setattr__(self, name, sys.intern(value))
+
+
+ElemType = TypeVar("ElemType", bound=Elem)
+
+def compact(cls: Type[ElemType]) -> Type[ElemType]:
+    """
+    Class decorator for RFC DOM elements, applied to a dataclass: recreates
+    the class with __slots__ for its fields, and records which string-valued
+    attributes (but not text content) are to be interned.
+    """
+    cls_fields = fields(cast(Any, cls))
+    cls_dict   = dict(cls.__dict__)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    cls_dict["__slots__"] = tuple(f.name for f in cls_fields)
+    cls_dict["_interned"] = tuple(f.name for f in cls_fields
+                                  if f.type in (str, Optional[str]) and f.name != "content")
+    return cast(Type[ElemType], type(cls.__name__, cls.__bases__, cls_dict))
 
 # =================================================================================================
 # SVG element
 # =================================================================================================
 
+@compact
 @dataclass
 class SVG(Elem):
     pass
@@ -51,6 +88,7 @@ class SVG(Elem):
 # Text element
 # =================================================================================================
 
+@compact
 @dataclass
 class Text(Elem):
     content : str
@@ -59,6 +97,7 @@ class Text(Elem):
 # BCP14 element
 # =================================================================================================
 
+@compact
 @dataclass
 class BCP14(Elem):
     """
@@ -70,6 +109,7 @@ class BCP14(Elem):
 # EM element
 # =================================================================================================
 
+@compact
 @dataclass
 class EM(Elem):
     """
@@ -81,6 +121,7 @@ class EM(Elem):
 # {C, X, I, E, Rel}Ref elements
 # =================================================================================================
 
+@compact
 @dataclass
 class RelRef(Elem):
     """
@@ -92,6 +133,7 @@ class RelRef(Elem):
     section       : str
     target        : str
 
+@compact
 @dataclass
 class ERef(Elem):
     """
@@ -100,6 +142,7 @@ class ERef(Elem):
     content : Optional[Text]
     target  : str
 
+@compact
 @dataclass
 class IRef(Elem):
     """
@@ -109,6 +152,7 @@ class IRef(Elem):
     primary : Optional[bool]
     subitem : Optional[str]
 
+@compact
 @dataclass
 class XRef(Elem):
     """
@@ -119,6 +163,7 @@ class XRef(Elem):
     pageno  : Optional[bool]
     target  : str
 
+@compact
 @dataclass
 class CRef(Elem):
     """
@@ -133,6 +178,7 @@ class CRef(Elem):
 # Sub and Sup elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Strong(Elem):
     """
@@ -140,6 +186,7 @@ class Strong(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, "Sub", "Sup", "TT", XRef]]
 
+@compact
 @dataclass
 class TT(Elem):
     """
@@ -147,6 +194,7 @@ class TT(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, Strong, "Sub", "Sup", XRef]]
 
+@compact
 @dataclass
 class Sub(Elem):
     """
@@ -154,6 +202,7 @@ class Sub(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, Strong, TT, XRef]]
 
+@compact
 @dataclass
 class Sup(Elem):
     """
@@ -165,6 +214,7 @@ class Sup(Elem):
 # SpanX element
 # =================================================================================================
 
+@compact
 @dataclass
 class SpanX(Elem):
     """
@@ -179,6 +229,7 @@ class SpanX(Elem):
 # T elements
 # =================================================================================================
 
+@compact
 @dataclass
 class List(Elem):
     """
@@ -189,6 +240,7 @@ class List(Elem):
     hangIndent : Optional[str]
     style      : Optional[str]
 
+@compact
 @dataclass
 class VSpace(Elem):
     """
@@ -196,6 +248,7 @@ class VSpace(Elem):
     """
     blankLines : Optional[str]
 
+@compact
 @dataclass
 class T(Elem):
     """
@@ -211,6 +264,7 @@ class T(Elem):
 # Artwork element
 # =================================================================================================
 
+@compact
 @dataclass
 class Artwork(Elem):
     """
@@ -231,6 +285,7 @@ class Artwork(Elem):
 # Pre and Postamble elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Postamble(Elem):
     """
@@ -238,6 +293,7 @@ class Postamble(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, SpanX, Strong, Sub, Sup, TT, XRef]]
 
+@compact
 @dataclass
 class Preamble(Elem):
     """
@@ -249,6 +305,7 @@ class Preamble(Elem):
 # Name element
 # =================================================================================================
 
+@compact
 @dataclass
 class Name(Elem):
     """
@@ -260,6 +317,7 @@ class Name(Elem):
 # SourceCode element
 # =================================================================================================
 
+@compact
 @dataclass
 class SourceCode(Elem):
     """
@@ -275,6 +333,7 @@ class SourceCode(Elem):
 # Figure element
 # =================================================================================================
 
+@compact
 @dataclass
 class Figure(Elem):
     """
@@ -298,6 +357,7 @@ class Figure(Elem):
 # OL elements
 # =================================================================================================
 
+@compact
 @dataclass
 class LI(Elem):
     """
@@ -307,6 +367,7 @@ class LI(Elem):
                     ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, Strong, Sub, Sup, TT, XRef]]]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class UL(Elem):
     """
@@ -317,6 +378,7 @@ class UL(Elem):
     empty   : Optional[bool]
     spacing : Optional[str]
 
+@compact
 @dataclass
 class OL(Elem):
     """
@@ -333,6 +395,7 @@ class OL(Elem):
 # DL elements
 # =================================================================================================
 
+@compact
 @dataclass
 class DD(Elem):
     """
@@ -342,6 +405,7 @@ class DD(Elem):
                     ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, Strong, Sub, Sup, TT, XRef]]]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class DT(Elem):
     """
@@ -350,6 +414,7 @@ class DT(Elem):
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, Strong, Sub, Sup, TT, XRef]]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class DL(Elem):
     """
@@ -364,6 +429,7 @@ class DL(Elem):
 # TextTable elements
 # =================================================================================================
 
+@compact
 @dataclass
 class TTCol(Elem):
     """
@@ -373,6 +439,7 @@ class TTCol(Elem):
     align   : Optional[str]
     width   : Optional[str]
 
+@compact
 @dataclass
 class C(Elem):
     """
@@ -380,6 +447,7 @@ class C(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, SpanX, Strong, Sub, Sup, TT, XRef]]
 
+@compact
 @dataclass
 class TextTable(Elem):
     """
@@ -400,12 +468,14 @@ class TextTable(Elem):
 # TR elements
 # =================================================================================================
 
+@compact
 @dataclass
 class BR(Elem):
     """
     RFC 7991 Section 2.12
     """
 
+@compact
 @dataclass
 class TH(Elem):
     """
@@ -418,6 +488,7 @@ class TH(Elem):
     colspan : Optional[str]
     rowspan : Optional[str]
 
+@compact
 @dataclass
 class TD(Elem):
     """
@@ -430,6 +501,7 @@ class TD(Elem):
     colspan : Optional[str]
     rowspan : Optional[str]
 
+@compact
 @dataclass
 class TR(Elem):
     """
@@ -442,6 +514,7 @@ class TR(Elem):
 # Table elements
 # =================================================================================================
 
+@compact
 @dataclass
 class TBody(Elem):
     """
@@ -450,6 +523,7 @@ class TBody(Elem):
     content : ListType[TR]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class TFoot(Elem):
     """
@@ -458,6 +532,7 @@ class TFoot(Elem):
     content : ListType[TR]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class THead(Elem):
     """
@@ -466,6 +541,7 @@ class THead(Elem):
     content : ListType[TR]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class Table(Elem):
     """
@@ -482,6 +558,7 @@ class Table(Elem):
 # Section elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Aside(Elem):
     """
@@ -490,6 +567,7 @@ class Aside(Elem):
     content : ListType[Union[Artwork, DL, Figure, IRef, List, OL, T, Table, UL]]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class BlockQuote(Elem):
     """
@@ -501,6 +579,7 @@ class BlockQuote(Elem):
     cite       : Optional[str]
     quotedFrom : Optional[str]
 
+@compact
 @dataclass
 class Section(Elem):
     """
@@ -519,6 +598,7 @@ class Section(Elem):
 # Middle element
 # =================================================================================================
 
+@compact
 @dataclass
 class Middle(Elem):
     """
@@ -530,6 +610,7 @@ class Middle(Elem):
 # Postal elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Street(Elem):
     """
@@ -538,6 +619,7 @@ class Street(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Region(Elem):
     """
@@ -546,6 +628,7 @@ class Region(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class PostalLine(Elem):
     """
@@ -554,6 +637,7 @@ class PostalLine(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class City(Elem):
     """
@@ -562,6 +646,7 @@ class City(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Code(Elem):
     """
@@ -570,6 +655,7 @@ class Code(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Country(Elem):
     """
@@ -578,6 +664,7 @@ class Country(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Postal(Elem):
     """
@@ -590,6 +677,7 @@ class Postal(Elem):
 # Address elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Email(Elem):
     """
@@ -598,6 +686,7 @@ class Email(Elem):
     content : Text
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Phone(Elem):
     """
@@ -605,6 +694,7 @@ class Phone(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class URI(Elem):
     """
@@ -612,6 +702,7 @@ class URI(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class Facsimile(Elem):
     """
@@ -619,6 +710,7 @@ class Facsimile(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class Address(Elem):
     """
@@ -634,6 +726,7 @@ class Address(Elem):
 # Author elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Organization(Elem):
     """
@@ -643,6 +736,7 @@ class Organization(Elem):
     abbrev  : Optional[str]
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Author(Elem):
     """
@@ -662,6 +756,7 @@ class Author(Elem):
 # Front elements
 # =================================================================================================
 
+@compact
 @dataclass
 class SeriesInfo(Elem):
     """
@@ -674,6 +769,7 @@ class SeriesInfo(Elem):
     stream     : Optional[str]
     value      : str
 
+@compact
 @dataclass
 class Title(Elem):
     """
@@ -683,6 +779,7 @@ class Title(Elem):
     abbrev  : Optional[str]
     ascii   : Optional[str]
 
+@compact
 @dataclass
 class Date(Elem):
     """
@@ -692,6 +789,7 @@ class Date(Elem):
     month  : Optional[str]
     year   : Optional[str]
 
+@compact
 @dataclass
 class Area(Elem):
     """
@@ -699,6 +797,7 @@ class Area(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class Workgroup(Elem):
     """
@@ -706,6 +805,7 @@ class Workgroup(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class Keyword(Elem):
     """
@@ -713,6 +813,7 @@ class Keyword(Elem):
     """
     content : Text
 
+@compact
 @dataclass
 class Abstract(Elem):
     """
@@ -721,6 +822,7 @@ class Abstract(Elem):
     content : ListType[Union[DL, OL, T, UL]]
     anchor  : Optional[str]
 
+@compact
 @dataclass
 class Note(Elem):
     """
@@ -731,6 +833,7 @@ class Note(Elem):
     removeInRFC : Optional[bool]
     title       : Optional[str]
 
+@compact
 @dataclass
 class Boilerplate(Elem):
     """
@@ -738,6 +841,7 @@ class Boilerplate(Elem):
     """
     content : ListType[Section]
 
+@compact
 @dataclass
 class Front(Elem):
     """
@@ -758,6 +862,7 @@ class Front(Elem):
 # References and ReferenceGroup elements
 # =================================================================================================
 
+@compact
 @dataclass
 class Format(Elem):
     """
@@ -767,6 +872,7 @@ class Format(Elem):
     target : Optional[str]
     type   : str
 
+@compact
 @dataclass
 class Annotation(Elem):
     """
@@ -774,6 +880,7 @@ class Annotation(Elem):
     """
     content : ListType[Union[Text, BCP14, CRef, EM, ERef, IRef, RelRef, SpanX, Strong, Sub, Sup, TT, XRef]]
 
+@compact
 @dataclass
 class RefContent(Elem):
     """
@@ -781,6 +888,7 @@ class RefContent(Elem):
     """
     content : ListType[Union[Text, BCP14, EM, Strong, Sub, Sup, TT]]
 
+@compact
 @dataclass
 class Reference(Elem):
     """
@@ -792,6 +900,7 @@ class Reference(Elem):
     quoteTitle : Optional[bool]
     target     : Optional[str]
 
+@compact
 @dataclass
 class ReferenceGroup(Elem):
     """
@@ -800,6 +909,7 @@ class ReferenceGroup(Elem):
     content : ListType[Reference]
     anchor  : str
 
+@compact
 @dataclass
 class References(Elem):
     """
@@ -814,6 +924,7 @@ class References(Elem):
 # Back elements
 # =================================================================================================
 
+@compact
 @dataclass
 class DisplayReference(Elem):
     """
@@ -822,6 +933,7 @@ class DisplayReference(Elem):
     target : str
     to     : str
 
+@compact
 @dataclass
 class Back(Elem):
     """
@@ -835,6 +947,7 @@ class Back(Elem):
 # Link element
 # =================================================================================================
 
+@compact
 @dataclass
 class Link(Elem):
     """
@@ -847,6 +960,7 @@ class Link(Elem):
 # RFC
 # =================================================================================================
 
+@compact
 @dataclass
 class RFC(Elem):
     """
@@ -0,0 +1,270 @@
+# =================================================================================================
+# Copyright (C) 2018-2020 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+
+"""
+Simplification of the expressions of a protocol.
+
+The expressions built by the parsers are direct translations of the text of a document, so they
+contain arithmetic on constants, such as byte counts multiplied out to bits, and checks that
+cannot fail. Formatters render expressions as they are given, and the generated parsers would
+repeat this work for every PDU. The simplifier rewrites each expression to a simpler equivalent,
+with the same result type:
+
+  - methods invoked on constants are evaluated, as are the sizes of fixed-size fields;
+  - arithmetic is normalised: constants are moved to the right of commutative operations, chains
+    of constant additions and multiplications are combined, and identities such as x*1 removed;
+  - comparisons of an expression with itself, boolean operations with a constant operand, and
+    conditional expressions with a constant condition are reduced.
+
+simplify_protocol() applies this to the sizes, presence conditions, constraints and actions of
+the types of a protocol, and removes the constraints that always hold.
+"""
+
+from npt.protocol import *
+from typing       import Any, Dict, List, Optional, Set, cast
+
+# Evaluation of methods on constant numbers and booleans. A method that is not defined for the
+# given constants, such as a division with a remainder, is not evaluated.
+def _divide(a: int, b: int) -> Optional[int]:
+    return a // b if b != 0 and a % b == 0 else None
+
+def _modulo(a: int, b: int) -> Optional[int]:
+    return a % b if b != 0 else None
+
+def _pow(a: int, b: int) -> Optional[int]:
+    return a ** b if b >= 0 else None
+
+_number_methods : Dict[str, Callable[[int, int], Any]] = {
+    "plus"     : lambda a, b: a + b,
+    "minus"    : lambda a, b: a - b,
+    "multiply" : lambda a, b: a * b,
+    "mul"      : lambda a, b: a * b,
+    "divide"   : _divide,
+    "modulo"   : _modulo,
+    "pow"      : _pow,
+    "eq"       : lambda a, b: a == b,
+    "ne"       : lambda a, b: a != b,
+    "lt"       : lambda a, b: a < b,
+    "le"       : lambda a, b: a <= b,
+    "gt"       : lambda a, b: a > b,
+    "ge"       : lambda a, b: a >= b,
+}
+
+_boolean_methods : Dict[str, Callable[[bool, bool], Any]] = {
+    "and" : lambda a, b: a and b,
+    "or"  : lambda a, b: a or b,
+    "eq"  : lambda a, b: a == b,
+    "ne"  : lambda a, b: a != b,
+}
+
+# Operations whose operands can be swapped, giving the operation to use once they are. Array sizes
+# are built using "mul", which is treated as "multiply".
+_swapped = {"plus" : "plus", "multiply" : "multiply", "mul" : "multiply", "eq" : "eq", "ne" : "ne",
+            "lt" : "gt", "le" : "ge", "gt" : "lt", "ge" : "le", "and" : "and", "or" : "or"}
+
+# The result of comparing an expression with itself
+_reflexive = {"eq" : True, "le" : True, "ge" : True, "ne" : False, "lt" : False, "gt" : False}
+
+
+def number_constant(expr: Optional[Expression]) -> Optional[int]:
+    """
+    The value of expr, if it is a constant number, or None.
+    """
+    if isinstance(expr, ConstantExpression) and expr.constant_type == Number() and isinstance(expr.constant_value, int) and not isinstance(expr.constant_value, bool):
+        return expr.constant_value
+    return None
+
+
+def boolean_constant(expr: Optional[Expression]) -> Optional[bool]:
+    """
+    The value of expr, if it is a constant boolean, or None.
+    """
+    if isinstance(expr, ConstantExpression) and expr.constant_type == Boolean() and isinstance(expr.constant_value, bool):
+        return expr.constant_value
+    return None
+
+
+def number(value: int) -> ConstantExpression:
+    return ConstantExpression(Number(), value)
+
+
+def boolean(value: bool) -> ConstantExpression:
+    return ConstantExpression(Boolean(), value)
+
+
+class ExpressionSimplifier:
+    """
+    Simplifies expressions evaluated within the given containing type.
+    """
+    containing_type: Optional[ProtocolType]
+
+    def __init__(self, containing_type: Optional[ProtocolType]):
+        self.containing_type = containing_type
+
+    def result_type(self, expr: Expression) -> Optional[ProtocolType]:
+        try:
+            return expr.result_type(self.containing_type)
+        except ProtocolTypeError:
+            return None
+
+    def simplify(self, expr: Expression) -> Expression:
+        if isinstance(expr, ArgumentExpression):
+            return ArgumentExpression(expr.arg_name, self.simplify(expr.arg_value))
+        elif isinstance(expr, MethodInvocationExpression):
+            target = self.simplify(expr.target)
+            args   = [cast(ArgumentExpression, self.simplify(arg)) for arg in expr.arg_exprs]
+            return self.simplify_method(target, expr.method_name, args)
+        elif isinstance(expr, FunctionInvocationExpression):
+            return FunctionInvocationExpression(expr.func, [cast(ArgumentExpression, self.simplify(arg)) for arg in expr.arg_exprs])
+        elif isinstance(expr, FieldAccessExpression):
+            return FieldAccessExpression(self.simplify(expr.target), expr.field_name)
+        elif isinstance(expr, IfElseExpression):
+            return self.simplify_ifelse(self.simplify(expr.condition), self.simplify(expr.if_true), self.simplify(expr.if_false))
+        return expr
+
+    def simplify_ifelse(self, condition: Expression, if_true: Expression, if_false: Expression) -> Expression:
+        value = boolean_constant(condition)
+        if value is not None:
+            return if_true if value else if_false
+        if if_true == if_false:
+            return if_true
+        return IfElseExpression(condition, if_true, if_false)
+
+    def simplify_method(self, target: Expression, method_name: str, args: List[ArgumentExpression]) -> Expression:
+        """
+        Simplify an invocation of method_name on target, whose target and arguments have already
+        been simplified.
+        """
+        if method_name == "size" and len(args) == 0:
+            target_type = self.result_type(target)
+            if isinstance(target_type, RepresentableType) and number_constant(target_type.size) is not None:
+                return cast(Expression, target_type.size)
+        if len(args) != 1 or args[0].arg_name != "other":
+            return MethodInvocationExpression(target, method_name, args)
+        other = args[0].arg_value
+
+        # Evaluate methods on constants
+        target_number, other_number = number_constant(target), number_constant(other)
+        if target_number is not None and other_number is not None and method_name in _number_methods:
+            result = _number_methods[method_name](target_number, other_number)
+            if isinstance(result, bool):
+                return boolean(result)
+            if result is not None:
+                return number(result)
+        target_flag, other_flag = boolean_constant(target), boolean_constant(other)
+        if target_flag is not None and other_flag is not None and method_name in _boolean_methods:
+            return boolean(_boolean_methods[method_name](target_flag, other_flag))
+
+        # Move constants to the right of commutative operations, if the operands have the same type
+        if isinstance(target, ConstantExpression) and not isinstance(other, ConstantExpression) and method_name in _swapped:
+            if self.result_type(other) == target.constant_type:
+                return self.simplify_method(other, _swapped[method_name], [ArgumentExpression("other", target)])
+
+        if target == other and method_name in _reflexive:
+            return boolean(_reflexive[method_name])
+
+        if other_number is not None:
+            return self.simplify_arithmetic(target, method_name, other_number)
+        if other_flag is not None and method_name in ["and", "or"]:
+            # x and true = x, x and false = false, x or false = x, x or true = true
+            if other_flag == (method_name == "and"):
+                return target
+            return boolean(other_flag)
+        return MethodInvocationExpression(target, method_name, args)
+
+    def simplify_arithmetic(self, target: Expression, method_name: str, value: int) -> Expression:
+        """
+        Simplify target.method_name(value), where value is a constant number.
+        """
+        if method_name == "mul":
+            method_name = "multiply"
+        if (method_name in ["plus", "minus"] and value == 0) or (method_name in ["multiply", "divide", "pow"] and value == 1):
+            return target
+        if method_name == "multiply" and value == 0:
+            return number(0)
+        if method_name == "pow" and value == 0:
+            return number(1)
+        if method_name == "minus" and value < 0:
+            return self.simplify_arithmetic(target, "plus", -value)
+        if method_name == "plus" and value < 0:
+            return self.simplify_arithmetic(target, "minus", -value)
+
+        # Combine with a constant operation on the target: (x + a) - b = x + (a - b), etc.
+        if isinstance(target, MethodInvocationExpression) and len(target.arg_exprs) == 1:
+            inner_name  = "multiply" if target.method_name == "mul" else target.method_name
+            inner_value = number_constant(target.arg_exprs[0].arg_value)
+            if inner_value is not None:
+                if inner_name in ["plus", "minus"] and method_name in ["plus", "minus"]:
+                    offset = (inner_value if inner_name == "plus" else -inner_value) + (value if method_name == "plus" else -value)
+                    return self.simplify_arithmetic(target.target, "plus", offset)
+                if inner_name == "multiply" and method_name == "multiply":
+                    return self.simplify_arithmetic(target.target, "multiply", inner_value * value)
+                if inner_name == "multiply" and method_name == "divide" and value != 0 and inner_value % value == 0:
+                    return self.simplify_arithmetic(target.target, "multiply", inner_value // value)
+                if inner_name == "multiply" and method_name == "divide" and inner_value != 0 and value % inner_value == 0:
+                    return self.simplify_arithmetic(target.target, "divide", value // inner_value)
+        return MethodInvocationExpression(target, method_name, [ArgumentExpression("other", number(value))])
+
+
+def simplify_protocol(protocol: Protocol) -> None:
+    """
+    Simplify the expressions of each type of the protocol, in place. The sizes of the fields of a
+    structure, and the lengths of arrays, may refer to other fields of the structure, so are
+    simplified within the structure that contains them.
+    """
+    simplified : Set[int] = set()
+
+    def simplify_size(pt: ProtocolType, simplifier: ExpressionSimplifier) -> None:
+        if id(pt) in simplified:
+            return
+        simplified.add(id(pt))
+        if isinstance(pt, BitString) and pt.size is not None:
+            pt.size = simplifier.simplify(pt.size)
+        elif isinstance(pt, Array):
+            if pt.length is not None:
+                pt.length = simplifier.simplify(pt.length)
+            if pt.size is not None:
+                pt.size = simplifier.simplify(pt.size)
+
+    for type_name in protocol.get_type_names():
+        pt = protocol.get_type(type_name)
+        if isinstance(pt, Struct):
+            simplifier = ExpressionSimplifier(pt)
+            for field in pt.get_fields():
+                simplify_size(field.field_type, simplifier)
+                field.is_present = simplifier.simplify(field.is_present)
+            constraints = [simplifier.simplify(constraint) for constraint in pt.constraints]
+            pt.constraints = [constraint for constraint in constraints if boolean_constant(constraint) is not True]
+            pt.actions = [simplifier.simplify(action) for action in pt.actions]
+    for type_name in protocol.get_type_names():
+        simplify_size(protocol.get_type(type_name), ExpressionSimplifier(None))
+
+# vim: set tw=0 ai:
@@ -31,6 +31,8 @@
 
 
 import argparse
+import hashlib
+import os
 import pathlib
 import json
 import requests
@@ -39,13 +41,14 @@ import functools
 import sys
 from datetime import datetime
 from dataclasses import dataclass, field
-from typing import List, Tuple, Dict, Optional, Callable
+from typing import List, Tuple, Dict, Optional, Callable, Any
 from ietfdata import datatracker, rfcindex
 from pathlib import Path
 
 # supported document extensions
 valid_extns = [".xml", ".txt"]
-output_formats = ["simple", "rust"]
+output_formats = ["simple", "rust", "ir"]
+txt_engines = ["grammar", "lines"]
 
 # npt epoch definition
 epoch = '1970-01-01T00:00:00'
@@ -63,6 +66,7 @@ class RootWorkingDir:
      |-- draft/draft-<draft-name>/<rev>/<input-draft-file>.<extn>
      |-- rfc/<rfcname>/<input-rfc-file>.<extn>
      |-- output  - holds the results of parser generator
+           |-- manifest.json - records the inputs each output was generated from
            |-- draft/draft-<draft-name>/<rev>/<output-draft-file>.<extn>
            |-- rfc/<rfcname>/<output-rfc-file>.<extn>
     """
@@ -82,6 +86,7 @@ class RootWorkingDir:
         self.rfc = self.root / "rfc"
         self.draft = self.root / "draft"
         self.output = self.root / "output"
+        self.manifest = self.root / "output" / "manifest.json"
         self.draft_out = self.root / "output" / "draft"
         self.rfc_out = self.root / "output" / "rfc"
 
@@ -156,6 +161,103 @@ class RootWorkingDir:
             json.dump(self._meta, fp)
 
 
+def file_digest(file_path: pathlib.Path) -> str:
+    """Return the SHA-256 digest of the contents of a file, as a hex string"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def package_digest(package_dir: pathlib.Path = pathlib.Path(__file__).parent) -> str:
+    """Return the SHA-256 digest of the source files of a package, including its
+    grammars, as a hex string. Any change to the source, or the addition, removal
+    or renaming of a source file, changes the digest"""
+    digest = hashlib.sha256()
+    for source_file in sorted(package_dir.rglob("*")):
+        if source_file.is_file() and source_file.suffix in [".py", ".txt"]:
+            digest.update(str(source_file.relative_to(package_dir)).encode("utf-8"))
+            digest.update(file_digest(source_file).encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class BuildManifest:
+    """=================================================================================================================================
+    Record of the inputs from which the outputs for each document were generated,
+    so that documents whose inputs are unchanged can be skipped on later runs.
+    Stored as JSON under the output directory of the root working directory.
+
+    For each input file, the manifest holds :
+     |-- input      - digest of the contents of the input file
+     |-- components - a digest identifying the version of the tool, and the options
+     |                affecting its outputs, that the document was processed with
+     |-- outputs    - the output files generated, for each output format
+
+    A document is current if its input and the tool components are unchanged,
+    and every requested output format was generated and its files still exist.
+    """
+    path       : pathlib.Path
+    components : Dict[str, str]
+    _entries   : Dict[str, Dict[str, Any]] = field(default_factory=dict, init=False)
+    _digests   : Dict[str, str] = field(default_factory=dict, init=False)
+
+    def __enter__(self) -> "BuildManifest":
+        """Context manager constructor"""
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as fp:
+                    self._entries = json.load(fp)
+            except ValueError:
+                # a corrupt manifest only costs a full rebuild
+                self._entries = {}
+        return self
+
+    def __exit__(self, ex_type, ex, ex_tb) -> None:
+        """Context manager destructor"""
+        self.save()
+
+    def _input_digest(self, infile: pathlib.Path) -> str:
+        key = str(infile)
+        if key not in self._digests:
+            self._digests[key] = file_digest(infile)
+        return self._digests[key]
+
+    def is_current(self, infile: pathlib.Path, output_fmts: List[str]) -> bool:
+        """Returns True if outputs in all of output_fmts were previously generated from
+        this input file, by the same tool components, and are still present"""
+        entry = self._entries.get(str(infile))
+        if entry is None or not infile.exists():
+            return False
+        if entry["input"] != self._input_digest(infile) or entry["components"] != self.components:
+            return False
+        for ofmt in output_fmts:
+            if ofmt not in entry["outputs"]:
+                return False
+            if not all(pathlib.Path(outfile).exists() for outfile in entry["outputs"][ofmt]):
+                return False
+        return True
+
+    def record(self, infile: pathlib.Path, outputs: Dict[str, List[pathlib.Path]]) -> None:
+        """Record the outputs generated from an input file, for each output format"""
+        digest = self._input_digest(infile)
+        entry = self._entries.get(str(infile))
+        if entry is None or entry["input"] != digest or entry["components"] != self.components:
+            entry = {"input": digest, "components": self.components, "outputs": {}}
+            self._entries[str(infile)] = entry
+        for ofmt, outfiles in outputs.items():
+            entry["outputs"][ofmt] = [str(outfile) for outfile in outfiles]
+
+    def save(self) -> None:
+        """Write the manifest, replacing the previous version atomically"""
+        self.path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as fp:
+            json.dump(self._entries, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
 @dataclass(frozen=True)
 class DownloadOptions:
     """Consolidated list of options to control download client"""
@@ -480,12 +582,19 @@ class OptionContainer:
     dlopts    : DownloadOptions
     output_fmt: List[str]
     infiles   : List[IETF_URI]
+    jobs      : int = 1
+    rebuild   : bool = False
+    txt_engine: str = "grammar"
+    intern_types: bool = False
+    from_ir   : bool = False
 
     def __post_init__(self) -> None:
         self.root_dir.mkdir(parents=True, exist_ok=True)
         assert self.root_dir.exists() and self.root_dir.is_dir(), f"Cannot write to {self.root_dir}"
         for ofmt in self.output_fmt:
             assert ofmt in output_formats, f"output fmt {ofmt} not in {output_formats}"
+        assert self.jobs >= 1, f"number of jobs {self.jobs} must be at least 1"
+        assert self.txt_engine in txt_engines, f"text engine {self.txt_engine} not in {txt_engines}"
 
 
 def parse_cmdline( arglist : List[str] ) -> Tuple[argparse.Namespace,OptionContainer]:
@@ -525,12 +634,47 @@ def parse_cmdline( arglist : List[str] ) -> Tuple[argparse.Namespace,OptionConta
                     nargs=1,
                     default=["simple,rust"],
                     help=f"comma delimited list of output formats. "
-                         f"current output formats are simple,rust")
+                         f"current output formats are simple,rust,ir")
     ap.add_argument(
         "-f",
         "--force",
         action="store_true",
         help=f"Downloaded files will overwrite files in data directory")
+    ap.add_argument(
+        "-r",
+        "--rebuild",
+        action="store_true",
+        help=f"Regenerate outputs for all documents, even those whose "
+             f"inputs are unchanged since they were last processed")
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=f"Number of documents to process in parallel. "
+             f"Defaults to 1")
+    ap.add_argument(
+        "-te",
+        "--txt-engine",
+        metavar="engine",
+        choices=txt_engines,
+        default="grammar",
+        help=f"Engine used to structure text documents: grammar, or the "
+             f"faster, line-oriented, lines. Defaults to grammar")
+    ap.add_argument(
+        "-it",
+        "--intern-types",
+        action="store_true",
+        help=f"Share a single type between structurally identical fields, "
+             f"such as those of the same constant size, rather than "
+             f"generating a type for each field")
+    ap.add_argument(
+        "--from-ir",
+        action="store_true",
+        help=f"Load the protocol of each document from the snapshot saved "
+             f"by a previous run with the ir output format, rather than "
+             f"parsing the document")
     ap.add_argument(
         "uri",
         metavar='uri',
@@ -550,7 +694,12 @@ def parse_cmdline( arglist : List[str] ) -> Tuple[argparse.Namespace,OptionConta
 
     opt = OptionContainer(pathlib.Path(_obj.dir[0]),
                           DownloadOptions(force=_obj.force),
-                          _obj.outformat[0].split(sep=','), [])
+                          _obj.outformat[0].split(sep=','), [],
+                          jobs=_obj.jobs,
+                          rebuild=_obj.rebuild,
+                          txt_engine=_obj.txt_engine,
+                          intern_types=_obj.intern_types,
+                          from_ir=_obj.from_ir)
     return (_obj, opt )
 
 
@@ -0,0 +1,3 @@
+from typing import Any
+
+def moduleFromGrammar(source: str, className: str, modname: str, filename: str) -> Any: ...
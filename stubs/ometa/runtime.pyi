@@ -0,0 +1,5 @@
+from typing import Any
+
+class OMetaBase: ...
+
+def writePython(tree: Any, grammar: Any) -> str: ...
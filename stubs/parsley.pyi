@@ -2,6 +2,8 @@ from terml.parser import parseTerm as term
 from terml.quasiterm import quasiterm as quasiterm
 from typing import Any, Optional
 
+__version__: str
+
 def wrapGrammar(g: Any, tracefunc: Optional[Any] = ...): ...
 def makeGrammar(source: Any, bindings: Any, name: str = ..., unwrap: bool = ..., extends: Any = ..., tracefunc: Optional[Any] = ...): ...
 def unwrapGrammar(w: Any): ...
@@ -0,0 +1,73 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import xml.etree.ElementTree as ET
+
+import npt.benchmark
+import npt.parser_rfc_xml
+import npt.util
+
+from npt.parser_asciidiagrams import AsciiDiagramsParser
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_draft(self):
+        content  = npt.parser_rfc_xml.parse_rfc(ET.fromstring(npt.benchmark.synthetic_draft(30)))
+        protocol = AsciiDiagramsParser().build_protocol(None, content)
+        self.assertEqual(protocol.get_protocol_name(), "Synthetic")
+        self.assertEqual(len(protocol.get_pdu_names()), 30)
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_file = os.path.join(tmp_dir, "benchmark.json")
+            npt.benchmark.main(["-o", results_file, "-n", "1", "-s", "5", "-of", "simple",
+                                "examples/draft-mcquistin-simple-example.xml"])
+            with open(results_file) as infile:
+                benchmark = json.load(infile)
+        self.assertEqual(benchmark["tool"], npt.util.package_digest())
+        self.assertIn("revision", benchmark)
+        results = benchmark["results"]
+        self.assertEqual([result["document"] for result in results], ["draft-mcquistin-simple-example.xml", "draft-synthetic-5.xml"])
+        for result in results:
+            self.assertIsNone(result["error"])
+            self.assertEqual(list(result["stages"]), ["read", "parse_middle", "build_protocol", "synthesise", "simplify",
+                                                      "remove_unreachable", "order_types", "format:simple", "write:simple"])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set tw=0 ai:
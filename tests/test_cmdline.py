@@ -30,8 +30,10 @@
 import npt.util
 import unittest as ut
 import tempfile, shutil, pathlib
+import contextlib, io, unittest.mock
 from datetime import datetime, timedelta
 from ietfdata import datatracker, rfcindex
+from npt.__main__ import main, tool_components
 import sys
 
 
@@ -239,6 +241,151 @@ class Test_Cmdline(ut.TestCase):
         if rootdir.exists():
             shutil.rmtree(rootdir)
 
+    def test_default_jobs(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+        argv = f"-d {str(rootdir)}".split()
+
+        ap_ns, opts = npt.util.parse_cmdline(arglist=argv)
+        self.assertEqual(opts.jobs, 1)
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_jobs(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+        argv = f"-d {str(rootdir)} --jobs 4".split()
+
+        ap_ns, opts = npt.util.parse_cmdline(arglist=argv)
+        self.assertEqual(opts.jobs, 4)
+
+        with self.assertRaises(AssertionError):
+            npt.util.parse_cmdline(arglist=f"-d {str(rootdir)} -j 0".split())
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_parallel_processing(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+        examples = ["draft-mcquistin-simple-example.xml", "draft-mcquistin-augmented-udp-example.xml"]
+        for example in examples:
+            shutil.copy(pathlib.Path("examples", example), rootdir)
+        (rootdir / "draft-broken.xml").write_text("<rfc><middle><section>")
+        infiles = [str(rootdir / examples[0]), str(rootdir / "draft-broken.xml"), str(rootdir / examples[1])]
+
+        def run(jobs: int) -> list:
+            stdout = io.StringIO()
+            argv = ["npt", "-d", str(rootdir), "-of", "simple", "--rebuild", "--jobs", str(jobs)] + infiles
+            with unittest.mock.patch.object(sys, "argv", argv), contextlib.redirect_stdout(stdout):
+                main()
+            return [line for line in stdout.getvalue().splitlines() if not line.startswith("File [")]
+
+        # Messages are reported in the order the documents were given, and a document that
+        # fails is reported without stopping the others
+        messages = run(2)
+        self.assertEqual(messages, [f"\t{rootdir}/output/draft/draft-mcquistin-simple-example/simple/description.txt",
+                                    f"Error : File {rootdir}/draft-broken.xml: could not parse document (ParseError)",
+                                    f"\t{rootdir}/output/draft/draft-mcquistin-augmented-udp-example/simple/description.txt"])
+        self.assertTrue((rootdir / "output" / "draft" / "draft-mcquistin-augmented-udp-example" / "simple" / "description.txt").exists())
+        self.assertEqual(messages, run(1))
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_txt_engine(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)}".split())
+        self.assertEqual(opts.txt_engine, "grammar")
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)} --txt-engine lines".split())
+        self.assertEqual(opts.txt_engine, "lines")
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_intern_types(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)}".split())
+        self.assertFalse(opts.intern_types)
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)} --intern-types".split())
+        self.assertTrue(opts.intern_types)
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_from_ir(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)}".split())
+        self.assertFalse(opts.from_ir)
+        ap_ns, opts = npt.util.parse_cmdline(arglist=f"-d {str(rootdir)} -of rust --from-ir".split())
+        self.assertTrue(opts.from_ir)
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_build_manifest(self):
+        rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+        infile = rootdir / "draft-test.xml"
+        infile.write_text("<rfc/>")
+        outfile = rootdir / "output" / "description.txt"
+        outfile.parent.mkdir()
+        outfile.write_text("output")
+        components = {"formatter:simple": "1"}
+
+        with npt.util.RootWorkingDir(root=rootdir) as rwd:
+            with npt.util.BuildManifest(rwd.manifest, components) as manifest:
+                self.assertFalse(manifest.is_current(infile, ["simple"]))
+                manifest.record(infile, {"simple": [outfile]})
+                self.assertTrue(manifest.is_current(infile, ["simple"]))
+                self.assertFalse(manifest.is_current(infile, ["simple", "rust"]))
+            self.assertTrue(rwd.manifest.exists())
+
+            # the manifest persists between runs
+            with npt.util.BuildManifest(rwd.manifest, components) as manifest:
+                self.assertTrue(manifest.is_current(infile, ["simple"]))
+
+            # changed tool components invalidate every entry
+            with npt.util.BuildManifest(rwd.manifest, {"formatter:simple": "2"}) as manifest:
+                self.assertFalse(manifest.is_current(infile, ["simple"]))
+
+            # changed input files invalidate their entry
+            infile.write_text("<rfc></rfc>")
+            with npt.util.BuildManifest(rwd.manifest, components) as manifest:
+                self.assertFalse(manifest.is_current(infile, ["simple"]))
+                manifest.record(infile, {"simple": [outfile]})
+                self.assertTrue(manifest.is_current(infile, ["simple"]))
+
+            # missing outputs are regenerated
+            outfile.unlink()
+            with npt.util.BuildManifest(rwd.manifest, components) as manifest:
+                self.assertFalse(manifest.is_current(infile, ["simple"]))
+
+        if rootdir.exists():
+            shutil.rmtree(rootdir)
+
+    def test_tool_components(self):
+        components = tool_components("grammar")
+        self.assertEqual(components, tool_components("grammar"))
+        self.assertNotEqual(components, tool_components("lines"))
+        self.assertNotEqual(components, tool_components("grammar", intern_types=True))
+        self.assertNotEqual(components, tool_components("grammar", from_ir=True))
+
+        # a change to any source file of the tool changes its digest
+        package_dir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
+        (package_dir / "formatter.py").write_text("pass")
+        (package_dir / "grammar.txt").write_text("rule")
+        digest = npt.util.package_digest(package_dir)
+        (package_dir / "grammar.txt").write_text("other rule")
+        self.assertNotEqual(digest, npt.util.package_digest(package_dir))
+        (package_dir / "grammar.txt").write_text("rule")
+        self.assertEqual(digest, npt.util.package_digest(package_dir))
+        (package_dir / "layout.py").write_text("pass")
+        self.assertNotEqual(digest, npt.util.package_digest(package_dir))
+
+        if package_dir.exists():
+            shutil.rmtree(package_dir)
+
     def test_dload_specific_draft(self):
         rootdir = pathlib.Path(tempfile.mkdtemp(dir=pathlib.Path().cwd())).resolve()
         draft_name = 'draft-mcquistin-augmented-ascii-diagrams-06.xml'
@@ -0,0 +1,225 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pathlib            import Path
+from npt.protocol       import *
+from npt.__main__       import format_types, process_document
+from npt.formatter_rust import RustFormatter
+from npt.util           import PositionalArg
+
+def num(value: int) -> ConstantExpression:
+    return ConstantExpression(Number(), value)
+
+def field_value(field_name: str) -> MethodInvocationExpression:
+    return MethodInvocationExpression(FieldAccessExpression(SelfExpression(), field_name), "to_number", [])
+
+def bytes_of(field_name: str) -> MethodInvocationExpression:
+    return MethodInvocationExpression(field_value(field_name), "multiply", [ArgumentExpression("other", num(8))])
+
+def format_rust(protocol: Protocol) -> str:
+    formatter = RustFormatter()
+    format_types(formatter, protocol)
+    formatter.format_protocol(protocol)
+    return formatter.generate_output("test")[Path("src/lib.rs")]
+
+class TestRustFormatter(unittest.TestCase):
+    def setUp(self):
+        # An aligned header, whose payload starts on a byte boundary, and an unaligned header,
+        # whose payload follows a 4-bit field
+        self.protocol = Protocol()
+        length = self.protocol.add_type(BitString("Length", num(8)))
+        flags  = self.protocol.add_type(BitString("Flags", num(4)))
+        aligned_payload   = self.protocol.add_type(BitString("Aligned_payload", bytes_of("length")))
+        unaligned_payload = self.protocol.add_type(BitString("Unaligned_payload", bytes_of("length")))
+        self.protocol.add_type(Struct("Aligned", [StructField("length", cast(RepresentableType, length)),
+                                                  StructField("payload", cast(RepresentableType, aligned_payload))], [], []))
+        self.protocol.add_type(Struct("Unaligned", [StructField("flags", cast(RepresentableType, flags)),
+                                                    StructField("length", cast(RepresentableType, length)),
+                                                    StructField("payload", cast(RepresentableType, unaligned_payload))], [], []))
+        self.protocol.define_pdu("Aligned")
+        self.protocol.define_pdu("Unaligned")
+        self.protocol.synthesise()
+
+    def test_borrowed_bitstrings(self):
+        output = format_rust(self.protocol)
+        # Byte aligned payloads are borrowed from the input, and the types containing them take
+        # its lifetime
+        self.assertIn("pub struct AlignedPayload<'a>(pub &'a [u8]);", output)
+        self.assertIn("input.0.split_at(aligned_payload_size)", output)
+        self.assertIn("pub struct Aligned<'a> {", output)
+        self.assertIn("    pub payload: AlignedPayload<'a>,", output)
+        self.assertIn("pub enum PDU<'a> {", output)
+        # Unaligned payloads are copied bit by bit
+        self.assertIn("pub struct UnalignedPayload(pub Vec<u8>);", output)
+        self.assertIn("pub struct Unaligned {", output)
+
+    def test_flat_struct_parser(self):
+        output = format_rust(self.protocol)
+        # Each field is parsed at the same depth, returning early on error
+        self.assertIn("    let (i0, con0, o0) = match parse_flags(input, context) {\n"
+                      "        (nom::IResult::Ok((i, o)), con) => (i, con, o),\n"
+                      "        (nom::IResult::Err(e), con) => return (nom::IResult::Err(e), con)\n"
+                      "    };\n", output)
+        self.assertIn("    let (i2, con2, o2) = match parse_unaligned_payload(i1, con1, o1.0 as usize) {\n", output)
+        self.assertIn("    (nom::IResult::Ok((i2, Unaligned{flags: o0, length: o1, payload: o2})), con2)\n", output)
+
+    def test_many_fields(self):
+        # The generated parser, and the formatter, do not nest once per field
+        protocol = Protocol()
+        byte     = protocol.add_type(BitString("Byte", num(8)))
+        fields   = [StructField(f"f{i}", cast(RepresentableType, byte)) for i in range(2000)]
+        protocol.add_type(Struct("Wide", fields, [], []))
+        protocol.define_pdu("Wide")
+        protocol.synthesise()
+        output = format_rust(protocol)
+        self.assertIn("    let (i1999, con1999, o1999) = match parse_byte(i1998, con1998) {\n", output)
+        self.assertNotIn("\n            ", output.split("pub fn parse_wide<'a>")[1].split("\n}\n")[0])
+
+    def test_constraint_failures(self):
+        # A constraint is checked as soon as its field is parsed, and rejects the structure with
+        # an error rather than a panic
+        protocol = Protocol()
+        length   = protocol.add_type(BitString("Length", num(8)))
+        kind     = protocol.add_type(BitString("Kind", num(8)))
+        at_least_one = MethodInvocationExpression(field_value("length"), "ge", [ArgumentExpression("other", num(1))])
+        protocol.add_type(Struct("Checked", [StructField("length", cast(RepresentableType, length)),
+                                             StructField("kind", cast(RepresentableType, kind))], [at_least_one], []))
+        protocol.define_pdu("Checked")
+        protocol.synthesise()
+        output = format_rust(protocol)
+        self.assertIn("        (nom::IResult::Err(e), con) => return (nom::IResult::Err(e), con)\n"
+                      "    };\n"
+                      "    if !(o0.0 >= 1) { // check constraint: (length >= 1)\n"
+                      "        return (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Verify))), con0);\n"
+                      "    }\n"
+                      "    let (i1, con1, o1) = match parse_kind(i0, con0) {\n", output)
+        self.assertNotIn("assert!", output)
+
+    def test_pdu_discriminator(self):
+        # Without constraints on their fields, each PDU is tried in turn
+        output = format_rust(self.protocol)
+        self.assertIn("    let con0 = match parse_pdu_aligned(input, context) {\n", output)
+        self.assertIn("    parse_pdu_unaligned(input, con0)\n", output)
+
+        # PDUs whose kind fields are constrained to constants are chosen by the value of that
+        # field, and only those PDUs sharing a value are tried in turn
+        protocol = Protocol()
+        flags    = protocol.add_type(BitString("Flags", num(4)))
+        kind     = protocol.add_type(BitString("Kind", num(4)))
+        for pdu_name, kind_value in [("Request", 1), ("Reply", 2), ("Error", 2)]:
+            is_kind = MethodInvocationExpression(field_value("kind"), "eq", [ArgumentExpression("other", num(kind_value))])
+            protocol.add_type(Struct(pdu_name, [StructField("flags", cast(RepresentableType, flags)),
+                                                StructField("kind", cast(RepresentableType, kind))], [is_kind], []))
+            protocol.define_pdu(pdu_name)
+        protocol.synthesise()
+        output = format_rust(protocol)
+        self.assertIn("    let discriminator: nom::IResult<(&'a [u8], usize), u8> = take(8_usize)(input);\n"
+                      "    match discriminator {\n"
+                      "        nom::IResult::Ok((_, d)) => match d & 0xf {\n"
+                      "            1 => parse_pdu_request(input, context),\n"
+                      "            2 => {\n"
+                      "                let con0 = match parse_pdu_reply(input, context) {\n", output)
+        self.assertIn("                parse_pdu_error(input, con0)\n"
+                      "            }\n"
+                      "            _ => (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Switch))), context)\n", output)
+        # Each PDU parser still checks the value, so that PDUs sharing it can be told apart
+        for pdu_name, kind_value in [("request", 1), ("reply", 2), ("error", 2)]:
+            pdu_parser = output.split(f"pub fn parse_{pdu_name}<'a>")[1].split("\n}\n")[0]
+            self.assertIn(f"    if !(o1.0 == {kind_value}) {{ // check constraint: (kind == {kind_value})\n"
+                          f"        return (nom::IResult::Err(nom::Err::Error((input, nom::error::ErrorKind::Verify))), con1);\n", pdu_parser)
+
+    def test_native_ints(self):
+        # Fixed width fields that are byte aligned, and the size of a native integer, are read
+        # directly from the input bytes; others are read bit by bit
+        protocol = Protocol()
+        flags    = protocol.add_type(BitString("Flags", num(4)))
+        kind     = protocol.add_type(BitString("Kind", num(4)))
+        port     = protocol.add_type(BitString("Port", num(16)))
+        protocol.add_type(Struct("Header", [StructField("flags", cast(RepresentableType, flags)),
+                                            StructField("kind", cast(RepresentableType, kind)),
+                                            StructField("port", cast(RepresentableType, port))], [], []))
+        protocol.define_pdu("Header")
+        protocol.synthesise()
+        output = format_rust(protocol)
+        self.assertIn("    if input.1 == 0 && input.0.len() >= 2 {\n"
+                      "        let (bytes, rest) = input.0.split_at(2);\n"
+                      "        return (nom::IResult::Ok(((rest, 0), Port(u16::from_be_bytes([bytes[0], bytes[1]])))), context);\n"
+                      "    }\n"
+                      "    let port = take(16_usize)(input);\n", output)
+        self.assertEqual(output.count("from_be_bytes"), 1)
+
+        # A field used at an unaligned offset anywhere is always read bit by bit
+        output = format_rust(self.protocol)
+        self.assertNotIn("from_be_bytes", output)
+
+    def test_unexpressible_constraints(self):
+        # A constraint that cannot be expressed in Rust is left out, with a warning
+        protocol = Protocol()
+        length   = protocol.add_type(BitString("Length", num(8)))
+        size     = MethodInvocationExpression(FieldAccessExpression(SelfExpression(), "length"), "size", [])
+        at_least = MethodInvocationExpression(size, "ge", [ArgumentExpression("other", num(8))])
+        protocol.add_type(Struct("Checked", [StructField("length", cast(RepresentableType, length))], [at_least], []))
+        protocol.define_pdu("Checked")
+        protocol.synthesise()
+        formatter = RustFormatter()
+        format_types(formatter, protocol)
+        self.assertNotIn("check constraint", "".join(formatter.output))
+        self.assertEqual(formatter.get_warnings(), ["Constraint on Checked cannot be expressed in Rust, and is not checked"])
+
+    def test_example_constraints(self):
+        # Every constraint check in the Rust generated for the examples is a valid expression
+        examples_dir = Path(os.path.dirname(__file__), "..", "examples")
+        root_dir = Path(tempfile.mkdtemp())
+        try:
+            for example in sorted(examples_dir.glob("*.xml")):
+                shutil.copy(example, root_dir)
+                _, docs = PositionalArg(str(root_dir / example.name)).resolve_argtype()
+                messages, outputs = process_document(docs[0], ["rust"], root_dir)
+                self.assertIn("rust", outputs, msg=messages)
+                for output_filepath in outputs["rust"]:
+                    for line in output_filepath.read_text().splitlines():
+                        if "check constraint" in line:
+                            self.assertRegex(line, r"^    if !\(\S.*\) \{ // check constraint: \(\S.*\)$")
+        finally:
+            shutil.rmtree(root_dir)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set tw=0 ai:
@@ -0,0 +1,86 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pathlib import Path
+
+import npt.grammar_cache
+
+from npt.grammar_cache import make_grammar, grammar_key
+
+GRAMMAR = """
+number = <digit+>:ds -> make_number(ds)
+"""
+
+class TestGrammarCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+        npt.grammar_cache._grammar_modules.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        npt.grammar_cache._grammar_modules.clear()
+
+    def test_make_grammar(self):
+        parser = make_grammar(GRAMMAR, {"make_number": int}, cache_dir=self.cache_dir)
+        self.assertEqual(parser("42").number(), 42)
+        self.assertTrue((self.cache_dir / f"{grammar_key(GRAMMAR)}.py").exists())
+
+    def test_make_grammar_bindings(self):
+        int_parser = make_grammar(GRAMMAR, {"make_number": int}, cache_dir=self.cache_dir)
+        str_parser = make_grammar(GRAMMAR, {"make_number": str}, cache_dir=self.cache_dir)
+        self.assertEqual(int_parser("7").number(), 7)
+        self.assertEqual(str_parser("7").number(), "7")
+
+    def test_make_grammar_from_disk(self):
+        make_grammar(GRAMMAR, {"make_number": int}, cache_dir=self.cache_dir)
+        npt.grammar_cache._grammar_modules.clear()
+        cache_file = self.cache_dir / f"{grammar_key(GRAMMAR)}.py"
+        mtime = cache_file.stat().st_mtime_ns
+        parser = make_grammar(GRAMMAR, {"make_number": int}, cache_dir=self.cache_dir)
+        self.assertEqual(parser("123").number(), 123)
+        self.assertEqual(cache_file.stat().st_mtime_ns, mtime)
+
+    def test_grammar_key(self):
+        self.assertEqual(grammar_key(GRAMMAR), grammar_key(GRAMMAR))
+        self.assertNotEqual(grammar_key(GRAMMAR), grammar_key(GRAMMAR + " "))
+
+# =================================================================================================
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: set tw=0 ai:
@@ -0,0 +1,99 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from npt.protocol import *
+from npt.layout   import LayoutAnalyser, analyse_layout
+
+def num(value: int) -> ConstantExpression:
+    return ConstantExpression(Number(), value)
+
+def field_value(field_name: str) -> MethodInvocationExpression:
+    return MethodInvocationExpression(FieldAccessExpression(SelfExpression(), field_name), "to_number", [])
+
+class TestLayout(unittest.TestCase):
+    def test_fixed_struct(self):
+        version = BitString("Version", num(4))
+        flags   = BitString("Flags", num(4))
+        port    = BitString("Port", num(16))
+        header  = Struct("Header", [StructField("version", version), StructField("flags", flags), StructField("port", port)], [], [])
+        wrapper = Struct("Wrapper", [StructField("header", header), StructField("checksum", port)], [], [])
+
+        analyser = LayoutAnalyser()
+        layout = analyser.layout(header)
+        self.assertEqual(layout.fixed_size, 24)
+        self.assertEqual([f.offset for f in layout.fields], [0, 4, 8])
+        self.assertFalse(layout.field("flags").aligned)
+        self.assertFalse(layout.field("flags").byte_aligned)
+        self.assertTrue(layout.field("port").byte_aligned)
+        self.assertEqual(analyser.layout(wrapper).fixed_size, 40)
+        self.assertEqual(analyser.layout(wrapper).field("checksum").offset, 24)
+
+    def test_variable_struct(self):
+        length  = BitString("Length", num(8))
+        payload = BitString("Payload", MethodInvocationExpression(field_value("length"), "multiply", [ArgumentExpression("other", num(8))]))
+        trailer = BitString("Trailer", num(16))
+        option  = StructField("option", trailer, MethodInvocationExpression(field_value("length"), "gt", [ArgumentExpression("other", num(0))]))
+        header  = Struct("Header", [StructField("length", length), StructField("payload", payload), option, StructField("trailer", trailer)], [], [])
+
+        layout = LayoutAnalyser().layout(header)
+        self.assertEqual((layout.min_size, layout.max_size, layout.fixed_size), (24, 8 + 255 * 8 + 32, None))
+        self.assertEqual([f.offset for f in layout.fields], [0, 8, None, None])
+        self.assertEqual((layout.field("payload").min_size, layout.field("payload").max_size), (0, 2040))
+        self.assertEqual((layout.field("option").min_size, layout.field("option").max_size), (0, 16))
+
+        # Fields after the payload have no static offset, but are known to be byte aligned
+        self.assertEqual(layout.size_multiple, 8)
+        self.assertTrue(layout.field("payload").byte_aligned)
+        self.assertTrue(layout.field("trailer").byte_aligned)
+
+    def test_protocol(self):
+        protocol = Protocol()
+        element  = protocol.add_type(BitString("Element", num(8)))
+        fixed    = protocol.add_type(Array("Fixed", cast(RepresentableType, element), num(4)))
+        rest     = protocol.add_type(Array("Rest", cast(RepresentableType, element), None))
+        protocol.add_type(Struct("Packet", [StructField("fixed", cast(RepresentableType, fixed)), StructField("rest", cast(RepresentableType, rest))], [], []))
+        protocol.define_pdu("Packet")
+
+        layouts = analyse_layout(protocol)
+        self.assertEqual(layouts["Fixed"].fixed_size, 32)
+        self.assertEqual((layouts["Rest"].min_size, layouts["Rest"].max_size), (0, None))
+        self.assertEqual((layouts["Packet"].min_size, layouts["Packet"].max_size), (32, None))
+        self.assertEqual(layouts["Packet"].field("rest").offset, 32)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set tw=0 ai:
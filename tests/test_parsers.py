@@ -44,7 +44,7 @@ import npt.parser_rfc_txt
 import npt.parser_rfc_xml
 
 from npt.parser               import Parser
-from npt.parser_asciidiagrams import AsciiDiagramsParser
+from npt.parser_asciidiagrams import AsciiDiagramsParser, candidate_rules
 
 class TestParsers(unittest.TestCase):
     def setUp(self):
@@ -59,3 +59,54 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(protocol.get_protocol_name(),  "Example")
         self.assertEqual(len(protocol.get_pdu_names()), 4)
         #TODO
+
+    def test_asciidiagram_parser_middle(self):
+        middle = npt.parser_rfc_xml.parse_middle_iter("examples/draft-mcquistin-augmented-ascii-diagrams.xml")
+        self.assertEqual(middle, self.content.middle)
+        protocol = AsciiDiagramsParser().build_protocol(None, middle)
+        self.assertEqual(protocol.get_protocol_name(),  "Example")
+        self.assertEqual(len(protocol.get_pdu_names()), 4)
+
+    def test_rfc_compact_elements(self):
+        section = self.content.middle.content[0]
+        self.assertFalse(hasattr(section, "__dict__"))
+        self.assertIs(section.anchor, sys.intern("intro"))
+        with self.assertRaises(AttributeError):
+            section.not_a_field = None # type: ignore
+
+    def test_rfc_txt_engines(self):
+        with open("examples/draft-mcquistin-augmented-ascii-diagrams.txt" , 'r') as example_file:
+            lines = example_file.readlines()
+        grammar_rfc = npt.parser_rfc_txt.parse_rfc(lines, "grammar")
+        lines_rfc   = npt.parser_rfc_txt.parse_rfc(lines, "lines")
+        self.assertEqual(lines_rfc.front,  grammar_rfc.front)
+        self.assertEqual(lines_rfc.middle, grammar_rfc.middle)
+        self.assertEqual(lines_rfc.back,   grammar_rfc.back)
+        self.assertEqual(lines_rfc,        grammar_rfc)
+
+        with self.assertRaises(ValueError):
+            npt.parser_rfc_txt.parse_rfc(lines[:200], "lines")
+
+    def test_rfc_txt_depaginate(self):
+        page_1 = ["Title\n", "\n", "   First paragraph\n", "\n", "\n",
+                  "Author                 Expires 1 January 2021                [Page 1]\n"]
+        page_2 = ["Internet-Draft         Title                             June 2020\n", "\n",
+                  "   Second paragraph\n", "   continues\n", "\n", "\n", "\n",
+                  "Author                 Expires 1 January 2021                [Page 2]\n"]
+        expected = ["Title\n", "\n", "   First paragraph\n", "\n", "   Second paragraph\n", "   continues\n", "\n"]
+        # Page breaks are found from form feeds, or from the page footers alone
+        paginated = page_1 + ["\f\n"] + page_2 + ["\f\n"]
+        self.assertEqual(list(npt.parser_rfc_txt.trim_blank_lines(npt.parser_rfc_txt.depaginate(iter(paginated)))), expected)
+        paginated = page_1 + page_2
+        self.assertEqual(list(npt.parser_rfc_txt.trim_blank_lines(npt.parser_rfc_txt.depaginate(iter(paginated)))), expected)
+
+    def test_asciidiagram_candidate_rules(self):
+        self.assertEqual(candidate_rules("A Test Header is formatted as follows:"), ["preamble"])
+        self.assertEqual(candidate_rules("A Test Header is\n   formatted as follows:"), ["preamble"])
+        self.assertEqual(candidate_rules("The checksum function is defined as:"), ["function"])
+        self.assertEqual(candidate_rules("A Test is one of: a Foo, a Bar, or a Baz."), ["enum"])
+        self.assertEqual(candidate_rules("A Test is either a Foo or a Bar."), ["enum"])
+        self.assertEqual(candidate_rules("A Test is serialised to a Foo using the bar function."), ["serialised_to_func"])
+        self.assertEqual(candidate_rules("A Test is parsed from a Foo using the bar function."), ["parsed_from_func"])
+        self.assertEqual(candidate_rules("This document describes the Test protocol. The Test protocol uses Foo."), ["protocol_definition"])
+        self.assertEqual(candidate_rules("The remainder of this section is informative."), [])
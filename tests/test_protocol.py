@@ -31,6 +31,7 @@
 import os
 import sys
 import unittest
+import unittest.mock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -364,6 +365,31 @@ class TestProtocol(unittest.TestCase):
         self.assertEqual(fieldaccess_expression.result_type(None), Nothing())
 
 
+    def test_result_type_memoised(self):
+        struct  = Struct("Test", [StructField("testfield", BitString("TestField", ConstantExpression(Number(), 1)))], [], [])
+        field   = FieldAccessExpression(SelfExpression(), "testfield")
+        eq_expr = MethodInvocationExpression(field, "eq", [ArgumentExpression("other", field)])
+
+        with unittest.mock.patch.object(Struct, "field", wraps=struct.field) as field_lookup:
+            self.assertEqual(eq_expr.result_type(struct), Boolean())
+            self.assertEqual(eq_expr.result_type(struct), Boolean())
+            self.assertEqual(field_lookup.call_count, 1)
+
+        # Results are cached for each containing type
+        with self.assertRaises(ProtocolTypeError):
+            eq_expr.result_type(None)
+        self.assertEqual(eq_expr, MethodInvocationExpression(field, "eq", [ArgumentExpression("other", field)]))
+
+        # Results that depend on a field of the context are not kept once it is removed
+        context = Context("Context")
+        context.add_field(ContextField("testfield", BitString("TestField", ConstantExpression(Number(), 1))))
+        value   = MethodInvocationExpression(ContextAccessExpression(context, "testfield"), "to_number", [])
+        self.assertEqual(value.result_type(None), Number())
+        context.remove_field("testfield")
+        with self.assertRaises(ProtocolTypeError):
+            value.result_type(None)
+
+
     def test_field_access_expression_not_a_struct(self):
         fieldaccess_expression = FieldAccessExpression(ConstantExpression(Nothing(), None), "testfield")
         
@@ -484,6 +510,63 @@ class TestProtocol(unittest.TestCase):
         
         self.assertEqual(str(pte.exception), "Type BitString<Test::Sized Value Equality NumberRepresentable> already implements a method get")
 
+
+    def test_trait_identity(self):
+        # The standard traits are singletons, and traits are compared by identity
+        self.assertIs(Value(), Value())
+        self.assertIs(Number().traits[0], Value())
+        methods = [Function("testfunc", [], Nothing())]
+        self.assertNotEqual(Trait("Test", methods), Trait("Test", methods))
+
+        pt = BitString("Test", ConstantExpression(Number(), 1))
+        self.assertTrue(pt.implements_trait(Equality()))
+        self.assertFalse(pt.implements_trait(Ordinal()))
+
+
+    def test_protocol_type_resolution_cache(self):
+        test_trait = Trait("TestTrait", [Function("testfunc", [], Nothing())])
+        grandparent = ProtocolType()
+        parent = ProtocolType(parent=grandparent)
+        child = ProtocolType(parent=parent)
+
+        self.assertTrue(child.is_a(parent))
+        self.assertTrue(child.is_a(grandparent))
+        self.assertFalse(parent.is_a(child))
+
+        with self.assertRaises(ProtocolTypeError):
+            child.get_method("testfunc")
+
+        # Changing a type invalidates the methods and ancestors resolved by the types below it
+        grandparent.implement_trait(test_trait)
+        self.assertIs(child.get_method("testfunc"), grandparent.get_method("testfunc"))
+        self.assertIs(child.get_method("testfunc"), child.get_method("testfunc"))
+
+        child.parent = grandparent
+        self.assertFalse(child.is_a(parent))
+        self.assertTrue(child.is_a(grandparent))
+
+        # Changing a type outside the chain of parents does not change the methods resolved
+        parent.implement_trait(Trait("OtherTrait", [Function("otherfunc", [], Nothing())]))
+        ProtocolType(parent=grandparent).implement_trait(Trait("ThirdTrait", [Function("thirdfunc", [], Nothing())]))
+        self.assertIs(child.get_method("testfunc"), grandparent.get_method("testfunc"))
+        with self.assertRaises(ProtocolTypeError):
+            child.get_method("otherfunc")
+
+        # A method implemented by a nearer ancestor after the lookup overrides the one resolved
+        child.parent = parent
+        self.assertIs(child.get_method("testfunc"), grandparent.get_method("testfunc"))
+        parent.implement_trait(Trait("OverridingTrait", [Function("testfunc", [], Nothing())]))
+        self.assertIs(child.get_method("testfunc"), parent.get_method("testfunc"))
+        self.assertIs(child.get_method("otherfunc"), parent.get_method("otherfunc"))
+
+        # Re-parenting an ancestor changes the ancestors and methods of the types below it
+        parent.parent = None
+        self.assertFalse(child.is_a(grandparent))
+        self.assertTrue(child.is_a(parent))
+        grandparent.implement_trait(Trait("FourthTrait", [Function("fourthfunc", [], Nothing())]))
+        with self.assertRaises(ProtocolTypeError):
+            child.get_method("fourthfunc")
+
     # ---------------------------------------------------------------------------------------------
     # Test cases for BitStrings:
     
@@ -571,12 +654,40 @@ class TestProtocol(unittest.TestCase):
         bitstring = BitString("Test", ConstantExpression(Number(), 1))
         bitstring2 = bitstring.derive_from("Tester", [test_trait])
 
-        self.assertEqual(len(bitstring.traits), 5)
-        self.assertEqual(bitstring.traits[0], Sized())
-        self.assertEqual(bitstring.traits[1], Value())
-        self.assertEqual(bitstring.traits[2], Equality())
-        self.assertEqual(bitstring.traits[3], NumberRepresentable())
-        self.assertEqual(bitstring.traits[4], test_trait)
+        self.assertEqual(len(bitstring2.traits), 5)
+        self.assertEqual(bitstring2.traits[0], Sized())
+        self.assertEqual(bitstring2.traits[1], Value())
+        self.assertEqual(bitstring2.traits[2], Equality())
+        self.assertEqual(bitstring2.traits[3], NumberRepresentable())
+        self.assertEqual(bitstring2.traits[4], test_trait)
+        self.assertTrue(bitstring2.implements_trait(test_trait))
+
+        # The type derived from is not changed
+        self.assertEqual(len(bitstring.traits), 4)
+        self.assertFalse(bitstring.implements_trait(test_trait))
+        with self.assertRaises(ProtocolTypeError):
+            bitstring.get_method("testfunc")
+
+    def test_bitstring_shared_methods(self):
+        bitstring1 = BitString("Test", ConstantExpression(Number(), 1))
+        bitstring2 = BitString("Tester", ConstantExpression(Number(), 1))
+
+        # Instances of a trait share its method definitions
+        self.assertIs(bitstring1.traits[1].methods, bitstring2.traits[1].methods)
+        self.assertIs(bitstring1.traits[1].methods_by_name, bitstring2.traits[1].methods_by_name)
+
+        # Methods are bound to the type they are looked up on, once
+        self.assertIs(bitstring1.methods["eq"], bitstring1.methods["eq"])
+        self.assertEqual(bitstring1.methods["eq"].parameters[1].param_type, bitstring1)
+        self.assertEqual(bitstring2.methods["eq"].parameters[1].param_type, bitstring2)
+
+        # Derived types share the methods bound on the type they derive from, before or after
+        # the type is derived
+        bitstring3 = bitstring1.derive_from("Testing", [])
+        self.assertIs(bitstring3.methods["eq"], bitstring1.methods["eq"])
+        self.assertIs(bitstring3.methods["size"], bitstring1.methods["size"])
+        self.assertEqual(len(bitstring3.methods), 6)
+        self.assertEqual(list(bitstring3.methods), ["size", "get", "set", "eq", "ne", "to_number"])
 
 
     # ---------------------------------------------------------------------------------------------
@@ -818,6 +929,29 @@ class TestProtocol(unittest.TestCase):
         
         self.assertEqual(struct.get_fields(), [sf])
 
+
+    def test_struct_derive_from(self):
+        sf = StructField("test", Nothing())
+        struct = Struct("Test", [sf], [ConstantExpression(Boolean(), True)], [])
+        derived = cast(Struct, struct.derive_from("Derived", []))
+
+        # The derived structure shares the storage of the structure it is derived from, until
+        # either is modified
+        self.assertIs(derived.fields, struct.fields)
+        self.assertIs(derived.constraints, struct.constraints)
+        self.assertIs(derived.methods, struct.methods)
+
+        extra = StructField("extra", Nothing())
+        derived.add_field(extra)
+        derived.add_constraint(ConstantExpression(Boolean(), False))
+        self.assertEqual(derived.get_fields(), [sf, extra])
+        self.assertEqual(struct.get_fields(), [sf])
+        self.assertEqual(struct.constraints, [ConstantExpression(Boolean(), True)])
+        self.assertIs(derived.methods, struct.methods)
+
+        struct.add_action(ConstantExpression(Nothing(), None))
+        self.assertEqual(derived.actions, [])
+
     # ---------------------------------------------------------------------------------------------
     # Test cases for Enum:
 
@@ -1191,6 +1325,117 @@ class TestProtocol(unittest.TestCase):
         
         self.assertTrue(context.get_fields(), [cf])
 
+    # ---------------------------------------------------------------------------------------------
+    # Test cases for Protocol:
+
+    def test_protocol_intern_types(self):
+        protocol = Protocol(intern_types=True)
+        port1 = protocol.add_type(BitString("Source_port", ConstantExpression(Number(), 16)))
+        port2 = protocol.add_type(BitString("Destination_port", ConstantExpression(Number(), 16)))
+        flags = protocol.add_type(BitString("Flags", ConstantExpression(Number(), 8)))
+        payload = protocol.add_type(BitString("Payload", ContextAccessExpression(protocol.get_context(), "data_size")))
+
+        self.assertIs(port1, port2)
+        self.assertEqual(port1.name, "BitString_16")
+        self.assertIsNot(port1, flags)
+        self.assertEqual(payload.name, "Payload")
+        self.assertIs(protocol.get_type("Destination_port"), port1)
+        self.assertEqual(protocol.get_type_aliases(), {"Source_port": "BitString_16", "Destination_port": "BitString_16", "Flags": "BitString_8"})
+        self.assertEqual(protocol.get_type_names(), ["Context", "DataUnit", "BitString_16", "BitString_8", "Payload"])
+
+        with self.assertRaises(ProtocolTypeError):
+            protocol.add_type(BitString("Source_port", ConstantExpression(Number(), 32)))
+
+        # Without interning, each type is kept
+        protocol = Protocol()
+        port1 = protocol.add_type(BitString("Source_port", ConstantExpression(Number(), 16)))
+        port2 = protocol.add_type(BitString("Destination_port", ConstantExpression(Number(), 16)))
+        self.assertIsNot(port1, port2)
+        self.assertEqual(protocol.get_type_aliases(), {})
+
+    def test_protocol_type_order(self):
+        protocol = Protocol()
+        length = BitString("Length", ConstantExpression(Number(), 8))
+        payload = BitString("Payload", ConstantExpression(Number(), 8))
+        header = Struct("Header", [StructField("length", length)], [], [])
+        protocol.add_type(length)
+        protocol.add_type(payload)
+        protocol.add_type(header)
+        protocol.add_type(Struct("Packet", [StructField("header", header), StructField("payload", payload), StructField("length", length)], [], []))
+        protocol.define_pdu("Packet")
+        protocol.define_pdu("Header")
+        protocol.synthesise()
+
+        # Each type comes after those it depends on, and types not needed by a PDU are omitted
+        self.assertEqual(protocol.get_type_order(), ["Length", "Header", "Payload", "Packet", "Context"])
+
+        # Adding a PDU, or a field to the context, changes the order
+        options = protocol.add_type(Array("Options", length, ConstantExpression(Number(), 4)))
+        protocol.get_context().add_field(ContextField("options", options))
+        self.assertEqual(protocol.get_type_order(), ["Length", "Header", "Payload", "Packet", "Options", "Context"])
+
+    def test_protocol_type_order_cycle(self):
+        protocol = Protocol()
+        first = Struct("First", [], [], [])
+        second = Struct("Second", [StructField("first", first)], [], [])
+        first.add_field(StructField("second", second))
+        protocol.add_type(first)
+        protocol.add_type(second)
+        protocol.define_pdu("First")
+
+        with self.assertRaises(ProtocolTypeError) as pte:
+            protocol.get_type_order()
+
+        self.assertEqual(str(pte.exception), "Cannot order types: First -> Second -> First form a cycle")
+
+    def test_protocol_remove_unreachable(self):
+        protocol = Protocol()
+        length = protocol.add_type(BitString("Length", ConstantExpression(Number(), 8)))
+        protocol.add_type(BitString("Unused_field", ConstantExpression(Number(), 8)))
+        options = protocol.add_type(Array("Options", cast(RepresentableType, length), ConstantExpression(Number(), 4)))
+        protocol.get_context().add_field(ContextField("options", options))
+        protocol.get_context().add_field(ContextField("unused", Number()))
+        protocol.get_context().add_field(ContextField("packet_length", Number()))
+        length_value = MethodInvocationExpression(FieldAccessExpression(SelfExpression(), "length"), "to_number", [])
+        set_length = MethodInvocationExpression(ContextAccessExpression(protocol.get_context(), "packet_length"), "set", [ArgumentExpression("value", length_value)])
+        protocol.add_type(Struct("Packet", [StructField("length", cast(RepresentableType, length))], [], [set_length]))
+        protocol.add_type(Struct("Unused", [StructField("length", cast(RepresentableType, length))], [], []))
+        protocol.define_pdu("Packet")
+        protocol.synthesise()
+
+        removed = protocol.remove_unreachable()
+        self.assertEqual(removed.types, ["Unused_field", "Options", "Unused"])
+        self.assertEqual(removed.functions, ["parse_to_options", "serialise_from_options", "parse_to_unused", "serialise_from_unused"])
+        self.assertEqual(removed.context_fields, ["options", "unused"])
+        self.assertEqual([field.field_name for field in protocol.get_context().get_fields()], ["data_size", "packet_length"])
+        self.assertEqual(protocol.get_type_names(), ["Context", "DataUnit", "Length", "Packet"])
+        self.assertEqual(protocol.get_type_order(), ["Length", "Packet", "Context"])
+
+        # The types of the context fields that are used are kept, whatever order the types using
+        # them are reached in
+        protocol = Protocol()
+        ctx_type = protocol.add_type(BitString("Ctxtype", ConstantExpression(Number(), 8)))
+        cee      = protocol.add_type(BitString("Cee", ConstantExpression(Number(), 8)))
+        bee      = protocol.add_type(Struct("Bee", [StructField("cee", cast(RepresentableType, cee))], [], []))
+        protocol.get_context().add_field(ContextField("ctx", ctx_type))
+        ctx_value = MethodInvocationExpression(ContextAccessExpression(protocol.get_context(), "ctx"), "to_number", [])
+        is_set    = MethodInvocationExpression(ctx_value, "eq", [ArgumentExpression("other", ConstantExpression(Number(), 1))])
+        protocol.add_type(Struct("Aye", [StructField("bee", cast(RepresentableType, bee)),
+                                         StructField("cee", cast(RepresentableType, cee)),
+                                         StructField("flag", cast(RepresentableType, cee), is_set)], [], []))
+        protocol.define_pdu("Aye")
+        protocol.synthesise()
+        removed = protocol.remove_unreachable()
+        self.assertEqual(removed.types, [])
+        self.assertEqual(removed.context_fields, [])
+        self.assertTrue(protocol.has_type("Ctxtype"))
+
+        # A protocol without PDUs is left unchanged
+        protocol = Protocol()
+        protocol.add_type(BitString("Length", ConstantExpression(Number(), 8)))
+        self.assertEqual(protocol.remove_unreachable().types, [])
+        self.assertTrue(protocol.has_type("Length"))
+
 # =================================================================================================
 if __name__ == "__main__":
     unittest.main()
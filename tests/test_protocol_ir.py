@@ -0,0 +1,125 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import xml.etree.ElementTree as ET
+
+import npt.parser_rfc_xml
+import npt.protocol_ir
+
+from npt.__main__             import format_types, output_formatters
+from npt.parser_asciidiagrams import AsciiDiagramsParser
+from npt.protocol             import *
+from pathlib                  import Path
+from typing                   import cast
+
+def build_example(filename: str, intern_types: bool = False) -> Protocol:
+    with open(Path("examples", filename)) as infile:
+        content = npt.parser_rfc_xml.parse_rfc(ET.fromstring(infile.read()))
+    protocol = AsciiDiagramsParser().build_protocol(Protocol(intern_types=intern_types), content)
+    protocol.synthesise()
+    return protocol
+
+def format_example(protocol: Protocol, o_fmt: str):
+    formatter = output_formatters[o_fmt]()
+    format_types(formatter, protocol)
+    formatter.format_protocol(protocol)
+    return formatter.generate_output("example")
+
+class TestProtocolIR(unittest.TestCase):
+    def test_round_trip(self):
+        for intern_types in [False, True]:
+            protocol = build_example("draft-mcquistin-augmented-udp-example.xml", intern_types)
+            snapshot = npt.protocol_ir.dumps(protocol)
+            loaded   = npt.protocol_ir.loads(snapshot)
+
+            self.assertEqual(npt.protocol_ir.dumps(loaded), snapshot)
+            self.assertEqual(loaded.get_protocol_name(), "UDP")
+            self.assertEqual(loaded.get_pdu_names(), protocol.get_pdu_names())
+            self.assertEqual(loaded.get_type_names(), protocol.get_type_names())
+            self.assertEqual(loaded.get_type_aliases(), protocol.get_type_aliases())
+            self.assertEqual(loaded.intern_types, intern_types)
+
+            header = cast(Struct, loaded.get_type("Udp_header"))
+            self.assertIsInstance(header, Struct)
+            self.assertIs(header.field("length").field_type, loaded.get_type("Udp_header_length"))
+            self.assertEqual([trait.name for trait in header.traits], ["Sized", "Equality"])
+            self.assertEqual(len(header.constraints), 1)
+            parse_from = cast(Function, header.parse_from)
+            self.assertIs(parse_from.parameters[0].param_type, loaded.get_type("DataUnit"))
+            self.assertIs(cast(Option, parse_from.return_type).reference_type, header)
+
+            # The generated code is the same, whether the protocol was parsed or loaded
+            for o_fmt in ["simple", "rust"]:
+                self.assertEqual(format_example(loaded, o_fmt), format_example(protocol, o_fmt))
+
+    def test_save_load(self):
+        protocol = build_example("draft-mcquistin-simple-example.xml")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            snapshot_file = Path(tmp_dir, "protocol.json")
+            npt.protocol_ir.save(protocol, snapshot_file)
+            loaded = npt.protocol_ir.load(snapshot_file)
+        self.assertEqual(npt.protocol_ir.dumps(loaded), npt.protocol_ir.dumps(protocol))
+
+    def test_version(self):
+        snapshot = json.loads(npt.protocol_ir.dumps(build_example("draft-mcquistin-simple-example.xml")))
+        snapshot["version"] = npt.protocol_ir.IR_VERSION + 1
+
+        with self.assertRaises(npt.protocol_ir.ProtocolIRError) as pie:
+            npt.protocol_ir.loads(json.dumps(snapshot))
+        self.assertEqual(str(pie.exception), f"Unsupported protocol snapshot version {npt.protocol_ir.IR_VERSION + 1}: expected {npt.protocol_ir.IR_VERSION}")
+
+        with self.assertRaises(npt.protocol_ir.ProtocolIRError):
+            npt.protocol_ir.loads("<rfc/>")
+
+        # Snapshots with missing or mistyped contents are rejected in the same way
+        truncated = {"format": npt.protocol_ir.IR_FORMAT, "version": npt.protocol_ir.IR_VERSION}
+        with self.assertRaises(npt.protocol_ir.ProtocolIRError) as pie:
+            npt.protocol_ir.loads(json.dumps(truncated))
+        self.assertTrue(str(pie.exception).startswith("Malformed protocol snapshot"))
+        snapshot["version"] = npt.protocol_ir.IR_VERSION
+        snapshot["types"] = snapshot["types"][:1] + [{"kind": "BitString"}]
+        with self.assertRaises(npt.protocol_ir.ProtocolIRError):
+            npt.protocol_ir.loads(json.dumps(snapshot))
+        snapshot["types"] = 7
+        with self.assertRaises(npt.protocol_ir.ProtocolIRError):
+            npt.protocol_ir.loads(json.dumps(snapshot))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set tw=0 ai:
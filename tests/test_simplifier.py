@@ -0,0 +1,98 @@
+# =================================================================================================
+# Copyright (C) 2018-2019 University of Glasgow
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+# =================================================================================================
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from npt.protocol   import *
+from npt.simplifier import ExpressionSimplifier, simplify_protocol
+
+def num(value: int) -> ConstantExpression:
+    return ConstantExpression(Number(), value)
+
+def method(target: Expression, method_name: str, other: Expression) -> MethodInvocationExpression:
+    return MethodInvocationExpression(target, method_name, [ArgumentExpression("other", other)])
+
+def field_value(field_name: str) -> MethodInvocationExpression:
+    return MethodInvocationExpression(FieldAccessExpression(SelfExpression(), field_name), "to_number", [])
+
+class TestSimplifier(unittest.TestCase):
+    def setUp(self):
+        self.length = BitString("Length", num(8))
+        self.payload = BitString("Payload", method(num(8), "multiply", field_value("length")))
+        self.header = Struct("Header", [StructField("length", self.length), StructField("payload", self.payload)], [], [])
+        self.simplifier = ExpressionSimplifier(self.header)
+
+    def test_constants(self):
+        self.assertEqual(self.simplifier.simplify(method(method(num(2), "plus", num(3)), "multiply", num(8))), num(40))
+        self.assertEqual(self.simplifier.simplify(method(num(12), "ge", num(8))), ConstantExpression(Boolean(), True))
+        self.assertEqual(self.simplifier.simplify(method(num(1), "mul", num(12))), num(12))
+        # Division is only evaluated if it is exact
+        self.assertEqual(self.simplifier.simplify(method(num(7), "divide", num(2))), method(num(7), "divide", num(2)))
+
+    def test_arithmetic(self):
+        length = field_value("length")
+        self.assertEqual(self.simplifier.simplify(method(num(8), "multiply", length)), method(length, "multiply", num(8)))
+        self.assertEqual(self.simplifier.simplify(method(method(length, "multiply", num(32)), "divide", num(8))), method(length, "multiply", num(4)))
+        self.assertEqual(self.simplifier.simplify(method(method(length, "minus", num(8)), "plus", num(3))), method(length, "minus", num(5)))
+        self.assertEqual(self.simplifier.simplify(method(method(length, "plus", num(8)), "minus", num(8))), length)
+        self.assertEqual(self.simplifier.simplify(method(length, "multiply", method(num(2), "minus", num(1)))), length)
+
+    def test_conditions(self):
+        length = field_value("length")
+        true = ConstantExpression(Boolean(), True)
+        self.assertEqual(self.simplifier.simplify(method(length, "ge", length)), true)
+        self.assertEqual(self.simplifier.simplify(method(method(length, "gt", num(2)), "and", true)), method(length, "gt", num(2)))
+        self.assertEqual(self.simplifier.simplify(method(num(2), "lt", length)), method(length, "gt", num(2)))
+        self.assertEqual(self.simplifier.simplify(IfElseExpression(method(num(1), "eq", num(1)), num(3), length)), num(3))
+        # The size of a fixed-size field is known
+        size = MethodInvocationExpression(FieldAccessExpression(SelfExpression(), "length"), "size", [])
+        self.assertEqual(self.simplifier.simplify(method(size, "eq", num(8))), true)
+
+    def test_simplify_protocol(self):
+        protocol = Protocol()
+        protocol.add_type(self.length)
+        protocol.add_type(self.payload)
+        self.header.add_constraint(method(MethodInvocationExpression(FieldAccessExpression(SelfExpression(), "length"), "size", []), "eq", num(8)))
+        self.header.add_constraint(method(field_value("length"), "ge", num(1)))
+        protocol.add_type(self.header)
+        simplify_protocol(protocol)
+
+        self.assertEqual(self.payload.size, method(field_value("length"), "multiply", num(8)))
+        self.assertEqual(self.header.constraints, [method(field_value("length"), "ge", num(1))])
+        self.assertEqual(self.header.field("length").is_present, ConstantExpression(Boolean(), True))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set tw=0 ai:
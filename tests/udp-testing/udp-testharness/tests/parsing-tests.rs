@@ -26,11 +26,14 @@ fn test_parse_udp_header() {
 }
 
 #[test]
-#[should_panic]
 fn test_parse_udp_header_badlength() {
     let mut cap = Capture::from_file("../pcaps/udp-invalid-badlength.pcap").unwrap();
     while let Ok(packet) = cap.next() {
         let mut context = Context { data_size: packet.data.len() as u32 };
-        let _parsed_pkt = parse_udp_header((packet.data, 0), &mut context);
+        let parsed_pkt = parse_udp_header((packet.data, 0), &mut context);
+        match parsed_pkt {
+            (Result::Err(_), _) => {},
+            _ => panic!("Invalid packet was parsed")
+        }
     }
 }